@@ -23,7 +23,7 @@ set -o pipefail
 # utf8.syms
 # text_norm  <-- contains the fsts
 # punctuation_model
-# paragraph_model
+# paragraph_model  <-- not with a joint punctuation and paragraph model
 
 # NOTE! Temporary for now: The graph is updated in update_graph.sh, prep_lang.sh and then make_LM.sh can be used to update the LMs or update_pron_and_LM.sh if used in production.
 
@@ -32,6 +32,7 @@ acoustic_model=
 punct_model=
 paragraph_model=
 text_norm=
+joint_model=false # true if punct_model is a joint punctuation and paragraph model, then it inserts the paragraph breaks as well
 
 # Define the paths. path.sh also called conf/path.conf
 . ./path.sh
@@ -59,8 +60,10 @@ graph=$acoustic_model/graph_3gsmall \
     || error 1 "Failed setting graph variable";
 [ -z $punct_model ] && punct_model=$(ls -t $root_punctuation_modeldir/2*/Model_althingi*.pcl | head -n1) \
     || error 1 "Failed setting punct_model variable";
-[ -z $paragraph_model ] && paragraph_model=$(ls -t $root_paragraph_modeldir/2*/Model_althingi*.pcl | head -n1) \
-    || error 1 "Failed setting paragraph_model variable";
+if [ $joint_model = false ]; then
+  [ -z $paragraph_model ] && paragraph_model=$(ls -t $root_paragraph_modeldir/2*/Model_althingi*.pcl | head -n1) \
+      || error 1 "Failed setting paragraph_model variable";
+fi
 [ -z $text_norm ] && text_norm=$(ls -td $root_text_norm_modeldir/2* | head -n1) \
     || error 1 "Failed setting text_norm variable";
 
@@ -75,8 +78,11 @@ ln -s $extractor $thisbundle/extractor || error 1 "Failed creating extractor sym
 ln -s $graph $thisbundle/graph || error 1 "Failed creating the graph symlink";
 ln -s $lmdir/lang_3gsmall $thisbundle/decoding_lang || error 1 "Failed creating the decoding lang symlink";
 ln -s $lmdir/lang_5g $thisbundle/rescoring_lang || error 1 "Failed creating the rescoring lang symlink";
-ln -s $paragraph_model $thisbundle/paragraph_model || error 1 "Failed creating paragraph model symlink";
-ln -s $punct_model $thisbundle/punctuation_model || error 1 "Failed creating punctuation model symlink";
+# Inference only copies of the punctuation and paragraph models, which load faster than the training checkpoints
+if [ $joint_model = false ]; then
+  python paragraph/export_model.py $paragraph_model $thisbundle/paragraph_model || error 1 "Failed exporting the paragraph model";
+fi
+python punctuator/export_model.py $punct_model $thisbundle/punctuation_model || error 1 "Failed exporting the punctuation model";
 ln -s $text_norm $thisbundle/text_norm || error 1 "Failed creating text_norm symlink";
 ln -s $utf8syms $thisbundle/utf8.syms || error 1 "Failed creating the utf8.syms symlink";
 
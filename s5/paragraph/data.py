@@ -9,6 +9,13 @@ import cPickle
 import codecs
 import fnmatch
 import shutil
+import hashlib
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import profiling
 
 #DATA_PATH = "../data"
 DATA_PATH = "paragraph/processed_data"
@@ -27,6 +34,10 @@ SPACE = "_SPACE"
 MAX_WORD_VOCABULARY_SIZE = 100000
 MIN_WORD_COUNT_IN_VOCAB = 2
 MAX_SEQUENCE_LEN = 180
+# Stage 1 subsequences end at their last paragraph break instead of carrying the rest over, and paragraphs longer than
+# MAX_SEQUENCE_LEN are split instead of dropped, see SubsequenceBuilder. main.py batches them by length with masks.
+# Stage 2 keeps subsequences of MAX_SEQUENCE_LEN tokens, because main2.py caches the stage 1 hidden states of equal length subsequences.
+VARIABLE_LENGTH_SUBSEQUENCES = True
 
 TRAIN_FILE = os.path.join(DATA_PATH, "train")
 DEV_FILE = os.path.join(DATA_PATH, "dev")
@@ -49,25 +60,93 @@ EOP_TOKENS = {"EOP"}
 CRAP_TOKENS = {"<doc>", "<doc.>"} # punctuations that are not included in vocabulary nor mapping, must be added to CRAP_TOKENS
 PAUSE_PREFIX = "<sil="
 
+NUM_WORKERS = multiprocessing.cpu_count() # processes for counting words and converting input files
+MAX_SYNC_SUBSEQUENCES = 1000 # how far into a file to look for the point where the parallel conversion catches up
+
+# A processed dataset is stored in flat binary files next to the given path, so that it can be read through numpy.memmap
+# without parsing and without holding it in RAM:
+# <path>.words - int32 word ids of all subsequences
+# <path>.punctuations - int32 punctuation ids of all subsequences (one less per subsequence than words)
+# <path>.pauses - float32 pause durations aligned with punctuations
+# <path>.offsets - int64 start of each subsequence in <path>.words, followed by the total number of words
+WORDS_SUFFIX = ".words"
+PUNCTUATIONS_SUFFIX = ".punctuations"
+PAUSES_SUFFIX = ".pauses"
+OFFSETS_SUFFIX = ".offsets"
+SIGNATURE_SUFFIX = ".inputs" # what the processed file was built from, see dataset_signature
+
+class Dataset(object):
+    """Subsequences [words, punctuations, pauses] of a processed dataset, read lazily from disk"""
+
+    def __init__(self, path):
+        self.offsets = open_memmap(path + OFFSETS_SUFFIX, np.int64)
+        self.words = open_memmap(path + WORDS_SUFFIX, np.int32)
+        self.punctuations = open_memmap(path + PUNCTUATIONS_SUFFIX, np.int32)
+        self.pauses = open_memmap(path + PAUSES_SUFFIX, np.float32)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i+1]
+        # punctuation and pause sequences are one shorter than word sequences, so the i-th starts i positions earlier
+        return [self.words[start:end], self.punctuations[start-i:end-i-1], self.pauses[start-i:end-i-1]]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+def open_memmap(path, dtype):
+    if os.path.getsize(path) == 0: # empty files can't be mapped
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
 # replacement for pickling that takes less RAM. Useful for large datasets.
 def dump(d, path):
-    with open(path, 'w') as f:
-        for s in d:
-            f.write("%s\n" % repr(s))
+    offsets = [0]
+    with open(path + WORDS_SUFFIX, 'wb') as f_words, open(path + PUNCTUATIONS_SUFFIX, 'wb') as f_punctuations, open(path + PAUSES_SUFFIX, 'wb') as f_pauses:
+        for words, punctuations, pauses in d:
+            np.asarray(words, dtype=np.int32).tofile(f_words)
+            np.asarray(punctuations, dtype=np.int32).tofile(f_punctuations)
+            np.asarray(pauses, dtype=np.float32).tofile(f_pauses)
+            offsets.append(offsets[-1] + len(words))
+    np.asarray(offsets, dtype=np.int64).tofile(path + OFFSETS_SUFFIX)
 
 def load(path):
+    if os.path.exists(path + OFFSETS_SUFFIX):
+        return Dataset(path)
+    # datasets written by older versions, one repr() of a subsequence per line
     d = []
     with open(path, 'r') as f:
         for l in f:
             d.append(eval(l))
     return d
 
-def add_counts(word_counts, line):
+def add_counts(word_counts, line, new_words=None):
     for w in line.split():
         if w in CRAP_TOKENS or w in PUNCTUATION_VOCABULARY or w.startswith(PAUSE_PREFIX):
             continue
+        if new_words is not None and w not in word_counts:
+            new_words.append(w)
         word_counts[w] = word_counts.get(w, 0) + 1
 
+def count_words(input_file):
+    """
+    Word counts of a file as (word, count) pairs in the order of first occurrence.
+    Merging them file by file with merge_counts inserts the words in the same order as counting the files one after another,
+    which matters because build_vocabulary keeps the dict order among words with equal counts.
+    """
+    word_counts = dict()
+    new_words = []
+    with codecs.open(input_file, 'r', 'utf-8') as text:
+        for line in text:
+            add_counts(word_counts, line, new_words)
+    return [(w, word_counts[w]) for w in new_words]
+
+def merge_counts(word_counts, counts):
+    for w, c in counts:
+        word_counts[w] = word_counts.get(w, 0) + c
+
 def build_vocabulary(word_counts):
     return [wc[0] for wc in reversed(sorted(word_counts.items(), key=operator.itemgetter(1))) if wc[1] >= MIN_WORD_COUNT_IN_VOCAB and wc[0] != UNK][:MAX_WORD_VOCABULARY_SIZE] # Unk will be appended to end
 
@@ -89,122 +168,277 @@ def read_vocabulary(file_name):
     with codecs.open(file_name, 'r', 'utf-8') as f:
         return iterable_to_dict(f.readlines())
 
-def write_processed_dataset(input_files, output_file):
+def read_tokens(input_file):
+    with codecs.open(input_file, 'r', 'utf-8') as text:
+        for line in text:
+            for token in line.split():
+                yield token
+
+# words, punctuations, pauses, last_eop_idx (if it's still 0 when MAX_SEQUENCE_LEN is reached, then the sentence is too long and skipped),
+# last_token_was_punctuation (skip first token if it's punctuation), last_pause,
+# skip_until_eop (if a sentence does not fit into subsequence, then we need to skip tokens until we find a new sentence)
+INITIAL_BUILDER_STATE = ((), (), (), 0, True, 0.0, False)
+
+class SubsequenceBuilder(object):
     """
-    data will consist of two sets of aligned subsequences (words and punctuations) of MAX_SEQUENCE_LEN tokens (actually punctuation sequence will be 1 element shorter).
+    Cuts a token stream into aligned subsequences (words and punctuations) of MAX_SEQUENCE_LEN tokens (actually punctuation sequence will be 1 element shorter).
     If a sentence is cut, then it will be added to next subsequence entirely (words before the cut belong to both sequences)
+    With variable_length, a subsequence ends at its last EOP when MAX_SEQUENCE_LEN tokens are reached, so the carried over words
+    are not in both subsequences, and a paragraph that doesn't fit is cut into subsequences of MAX_SEQUENCE_LEN tokens without EOP
+    instead of being skipped.
     """
 
-    data = []
+    def __init__(self, word_vocabulary, punctuation_vocabulary, variable_length=False):
+        self.word_vocabulary = word_vocabulary
+        self.punctuation_vocabulary = punctuation_vocabulary
+        self.variable_length = variable_length
 
-    word_vocabulary = read_vocabulary(WORD_VOCAB_FILE)
-    punctuation_vocabulary = iterable_to_dict(PUNCTUATION_VOCABULARY)
+        self.subsequences = []
 
-    num_total = 0
-    num_unks = 0
+        self.num_total = 0
+        self.num_unks = 0
 
-    current_words = []
-    current_punctuations = []
-    current_pauses = []
+        self.set_state(INITIAL_BUILDER_STATE)
 
-    last_eop_idx = 0 # if it's still 0 when MAX_SEQUENCE_LEN is reached, then the sentence is too long and skipped.
-    last_token_was_punctuation = True # skipt first token if it's punctuation
-    last_pause = 0.0
+    def get_state(self):
+        return (tuple(self.current_words), tuple(self.current_punctuations), tuple(self.current_pauses),
+                self.last_eop_idx, self.last_token_was_punctuation, self.last_pause, self.skip_until_eop)
 
-    skip_until_eop = False # if a sentence does not fit into subsequence, then we need to skip tokens until we find a new sentence
+    def set_state(self, state):
+        current_words, current_punctuations, current_pauses, self.last_eop_idx, self.last_token_was_punctuation, self.last_pause, self.skip_until_eop = state
+        self.current_words = list(current_words)
+        self.current_punctuations = list(current_punctuations)
+        self.current_pauses = list(current_pauses)
 
-    for input_file in input_files:
+    def add(self, token):
+        """Returns True if the token completed a subsequence or a sentence that was too long was dropped"""
+
+        if self.skip_until_eop:
+
+            if token in EOP_TOKENS:
+                self.skip_until_eop = False
+
+            return False
 
-        with codecs.open(input_file, 'r', 'utf-8') as text:
+        elif token in CRAP_TOKENS:
+            return False
 
-            for line in text:
+        elif token.startswith(PAUSE_PREFIX):
+            self.last_pause = float(token.replace(PAUSE_PREFIX,"").replace(">",""))
 
-                for token in line.split():
+        elif token in self.punctuation_vocabulary:
 
-                    if skip_until_eop:
+            if self.last_token_was_punctuation: # if we encounter sequences like: "... !EXLAMATIONMARK .PERIOD ...", then we only use the first punctuation and skip the ones that follow
+                return False
 
-                        if token in EOP_TOKENS:
-                            skip_until_eop = False
+            if token in EOP_TOKENS:
+                self.last_eop_idx = len(self.current_punctuations) # no -1, because the token is not added yet
 
-                        continue
+            punctuation = self.punctuation_vocabulary[token]
 
-                    elif token in CRAP_TOKENS:
-                        continue
+            self.current_punctuations.append(punctuation)
+            self.last_token_was_punctuation = True
 
-                    elif token.startswith(PAUSE_PREFIX):
-                        last_pause = float(token.replace(PAUSE_PREFIX,"").replace(">",""))
+        else:
+
+            if not self.last_token_was_punctuation:
+                self.current_punctuations.append(self.punctuation_vocabulary[SPACE])
+
+            word = self.word_vocabulary.get(token, self.word_vocabulary[UNK])
+
+            self.current_words.append(word)
+            self.current_pauses.append(self.last_pause)
+            self.last_token_was_punctuation = False
+
+            self.num_total += 1
+            self.num_unks += int(word == self.word_vocabulary[UNK])
+
+        if len(self.current_words) < MAX_SEQUENCE_LEN:
+            return False
+
+        # this also means, that last token was a word
+        assert len(self.current_words) == len(self.current_punctuations) + 1, "#words: %d; #punctuations: %d" % (len(self.current_words), len(self.current_punctuations))
+        assert self.current_pauses == [] or len(self.current_words) == len(self.current_pauses), "#words: %d; #pauses: %d" % (len(self.current_words), len(self.current_pauses))
+
+        # Paragraph did not fit into subsequence - continue it in the next one from the last word, which is replaced by END here
+        if self.last_eop_idx == 0 and self.variable_length:
+            subsequence = [
+                self.current_words[:-1] + [self.word_vocabulary[END]],
+                self.current_punctuations,
+                self.current_pauses[1:]
+            ]
 
-                    elif token in punctuation_vocabulary:
+            self.subsequences.append(subsequence)
 
-                        if last_token_was_punctuation: # if we encounter sequences like: "... !EXLAMATIONMARK .PERIOD ...", then we only use the first punctuation and skip the ones that follow
-                            continue
+            self.current_words = self.current_words[-1:]
+            self.current_punctuations = []
+            self.current_pauses = self.current_pauses[-1:]
 
-                        if token in EOP_TOKENS:
-                            last_eop_idx = len(current_punctuations) # no -1, because the token is not added yet
+        # Sentence did not fit into subsequence - skip it
+        elif self.last_eop_idx == 0:
+            self.skip_until_eop = True
 
-                        punctuation = punctuation_vocabulary[token]
+            self.current_words = []
+            self.current_punctuations = []
+            self.current_pauses = []
 
-                        current_punctuations.append(punctuation)
-                        last_token_was_punctuation = True
+            self.last_token_was_punctuation = True # next sequence starts with a new sentence, so is preceded by eop which is punctuation
 
-                    else:
+        elif self.variable_length:
+            # END takes the place of the first word after the EOP
+            subsequence = [
+                self.current_words[:self.last_eop_idx+1] + [self.word_vocabulary[END]],
+                self.current_punctuations[:self.last_eop_idx+1],
+                self.current_pauses[1:self.last_eop_idx+2]
+            ]
 
-                        if not last_token_was_punctuation:
-                            current_punctuations.append(punctuation_vocabulary[SPACE])
+            self.subsequences.append(subsequence)
 
-                        word = word_vocabulary.get(token, word_vocabulary[UNK])
+            self.current_words = self.current_words[self.last_eop_idx+1:]
+            self.current_punctuations = self.current_punctuations[self.last_eop_idx+1:]
+            self.current_pauses = self.current_pauses[self.last_eop_idx+1:]
 
-                        current_words.append(word)
-                        current_pauses.append(last_pause)
-                        last_token_was_punctuation = False
+        else:
+            subsequence = [
+                self.current_words[:-1] + [self.word_vocabulary[END]],
+                self.current_punctuations,
+                self.current_pauses[1:]
+            ]
 
-                        num_total += 1
-                        num_unks += int(word == word_vocabulary[UNK])
+            self.subsequences.append(subsequence)
 
-                    if len(current_words) == MAX_SEQUENCE_LEN: # this also means, that last token was a word
-                        
-                        assert len(current_words) == len(current_punctuations) + 1, "#words: %d; #punctuations: %d" % (len(current_words), len(current_punctuations))
-                        assert current_pauses == [] or len(current_words) == len(current_pauses), "#words: %d; #pauses: %d" % (len(current_words), len(current_pauses))
+            # Carry unfinished sentence to next subsequence
+            self.current_words = self.current_words[self.last_eop_idx+1:]
+            self.current_punctuations = self.current_punctuations[self.last_eop_idx+1:]
+            self.current_pauses = self.current_pauses[self.last_eop_idx+1:]
 
-                        # Sentence did not fit into subsequence - skip it
-                        if last_eop_idx == 0: 
-                            skip_until_eop = True
+        self.last_eop_idx = 0 # sequence always starts with a new sentence
 
-                            current_words = []
-                            current_punctuations = []
-                            current_pauses = []
+        return True
 
-                            last_token_was_punctuation = True # next sequence starts with a new sentence, so is preceded by eop which is punctuation
+def write_processed_dataset(input_files, output_file, variable_length=False):
+    """
+    data will consist of two sets of aligned subsequences (words and punctuations) of MAX_SEQUENCE_LEN tokens (actually punctuation sequence will be 1 element shorter).
+    If a sentence is cut, then it will be added to next subsequence entirely (words before the cut belong to both sequences)
+    """
 
-                        else:
-                            subsequence = [
-                                current_words[:-1] + [word_vocabulary[END]],
-                                current_punctuations,
-                                current_pauses[1:]
-                            ]
+    builder = SubsequenceBuilder(read_vocabulary(WORD_VOCAB_FILE), iterable_to_dict(PUNCTUATION_VOCABULARY), variable_length)
 
-                            data.append(subsequence)
+    for input_file in input_files:
+        for token in read_tokens(input_file):
+            builder.add(token)
 
-                            # Carry unfinished sentence to next subsequence
-                            current_words = current_words[last_eop_idx+1:]
-                            current_punctuations = current_punctuations[last_eop_idx+1:]
-                            current_pauses = current_pauses[last_eop_idx+1:]
+    print "%.2f%% UNK-s in %s" % (builder.num_unks / builder.num_total * 100, output_file)
 
-                        last_eop_idx = 0 # sequence always starts with a new sentence
+    dump(builder.subsequences, output_file)
+
+def write_shard(args):
+    """
+    Converts one input file to a shard as if it was the first file of the dataset.
+    Also returns the builder state after the first MAX_SYNC_SUBSEQUENCES subsequences, which write_processed_dataset_parallel
+    uses to find where a run that continues from the previous file catches up with the shard.
+    """
+    input_file, shard_file, variable_length = args
+
+    builder = SubsequenceBuilder(read_vocabulary(WORD_VOCAB_FILE), iterable_to_dict(PUNCTUATION_VOCABULARY), variable_length)
+    checkpoints = {}
+
+    for i, token in enumerate(read_tokens(input_file)):
+        if builder.add(token) and len(checkpoints) < MAX_SYNC_SUBSEQUENCES:
+            checkpoints[i] = (builder.get_state(), len(builder.subsequences), builder.num_total, builder.num_unks)
+
+    dump(builder.subsequences, shard_file)
+
+    return checkpoints, builder.get_state(), builder.num_total, builder.num_unks
+
+def write_processed_dataset_parallel(input_files, output_file, num_workers=NUM_WORKERS, variable_length=False):
+    """
+    Same output as write_processed_dataset, but the input files are converted to shards in parallel.
+    Subsequences can continue from one file to the next, so each file after the first is re-read from the state the previous
+    file ended in until the state matches the shard's (usually within a few subsequences), and the shard is used from there on.
+    """
+
+    if num_workers < 2 or len(input_files) < 2:
+        write_processed_dataset(input_files, output_file, variable_length)
+        return
+
+    shard_dir = output_file + ".shards"
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+    shard_files = [os.path.join(shard_dir, str(i)) for i in range(len(input_files))]
+
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        shards = pool.map(write_shard, [(input_file, shard_file, variable_length) for input_file, shard_file in zip(input_files, shard_files)])
+    finally:
+        pool.terminate()
+
+    builder = SubsequenceBuilder(read_vocabulary(WORD_VOCAB_FILE), iterable_to_dict(PUNCTUATION_VOCABULARY), variable_length)
+    parts = []
+    num_total = 0
+    num_unks = 0
+
+    for input_file, shard_file, (checkpoints, final_state, shard_total, shard_unks) in zip(input_files, shard_files, shards):
+
+        start = 0 # first subsequence of the shard to use
+        builder.subsequences = []
+        builder.num_total = 0
+        builder.num_unks = 0
+
+        if builder.get_state() != INITIAL_BUILDER_STATE:
+            start = None
+            for i, token in enumerate(read_tokens(input_file)):
+                if builder.add(token) and i in checkpoints and checkpoints[i][0] == builder.get_state():
+                    _, start, shard_total_before, shard_unks_before = checkpoints[i]
+                    shard_total -= shard_total_before
+                    shard_unks -= shard_unks_before
+                    break
+
+        parts.append(builder.subsequences)
+        num_total += builder.num_total
+        num_unks += builder.num_unks
+
+        if start is not None:
+            parts.append(itertools.islice(load(shard_file), start, None))
+            num_total += shard_total
+            num_unks += shard_unks
+            builder.set_state(final_state)
 
     print "%.2f%% UNK-s in %s" % (num_unks / num_total * 100, output_file)
 
-    dump(data, output_file)
+    dump(itertools.chain(*parts), output_file)
+
+    shutil.rmtree(shard_dir)
+
+def dataset_signature(input_files, variable_length=False):
+    """Everything a processed dataset depends on, so that it's rebuilt only if some of it changed"""
+    with open(WORD_VOCAB_FILE, 'rb') as f:
+        vocabulary_hash = hashlib.md5(f.read()).hexdigest()
+    return repr(([(p, os.path.getsize(p), os.path.getmtime(p)) for p in input_files], vocabulary_hash, MAX_SEQUENCE_LEN,
+                 PUNCTUATION_VOCABULARY, sorted(EOP_TOKENS), sorted(CRAP_TOKENS), variable_length))
+
+def vocabulary_signature(input_files, pretrained_embeddings_path):
+    return repr(([(p, os.path.getsize(p), os.path.getmtime(p)) for p in input_files + [pretrained_embeddings_path] if p],
+                 MAX_WORD_VOCABULARY_SIZE, MIN_WORD_COUNT_IN_VOCAB, PUNCTUATION_VOCABULARY, sorted(CRAP_TOKENS)))
+
+def is_up_to_date(output_file, signature):
+    if not os.path.exists(output_file + SIGNATURE_SUFFIX):
+        return False
+    with open(output_file + SIGNATURE_SUFFIX, 'r') as f:
+        return f.read() == signature
+
+def write_signature(output_file, signature):
+    with open(output_file + SIGNATURE_SUFFIX, 'w') as f:
+        f.write(signature)
 
-def create_dev_test_train_split_and_vocabulary(root_path, create_vocabulary, train_output, dev_output, test_output, pretrained_embeddings_path=None):
+def create_dev_test_train_split_and_vocabulary(root_path, create_vocabulary, train_output, dev_output, test_output, pretrained_embeddings_path=None, variable_length=False):
+    """Splits whose input files, vocabulary and settings haven't changed since they were last written are not rewritten"""
 
     train_txt_files = []
     dev_txt_files = []
     test_txt_files = []
 
-    if create_vocabulary and not pretrained_embeddings_path:
-        word_counts = dict()
-    
     for root, dirnames, filenames in os.walk(root_path):
         for filename in fnmatch.filter(filenames, '*.txt'):
 
@@ -219,32 +453,56 @@ def create_dev_test_train_split_and_vocabulary(root_path, create_vocabulary, tra
             elif filename.endswith(".train.txt"):
                 train_txt_files.append(path)
 
-                if create_vocabulary and not pretrained_embeddings_path:
-                    with codecs.open(path, 'r', 'utf-8') as text:
-                        for line in text:
-                            add_counts(word_counts, line)
-
     if create_vocabulary:
-        if pretrained_embeddings_path:
-            vocabulary = []
-            embeddings = []
-            with codecs.open(pretrained_embeddings_path, 'r', 'utf-8') as f:
-                for line in f:
-                    line = line.split()
-                    w = line[0]
-                    e = [float(x) for x in line[1:]]
-                    vocabulary.append(w)
-                    embeddings.append(e)
-
-            with open("We.pcl", 'wb') as f:
-                cPickle.dump(embeddings, f, cPickle.HIGHEST_PROTOCOL)
+        signature = vocabulary_signature(train_txt_files, pretrained_embeddings_path)
+
+        if is_up_to_date(WORD_VOCAB_FILE, signature):
+            print "%s is up to date" % WORD_VOCAB_FILE
+
         else:
-            vocabulary = build_vocabulary(word_counts)
-        write_vocabulary(vocabulary, WORD_VOCAB_FILE)
+            if os.path.exists(WORD_VOCAB_FILE + SIGNATURE_SUFFIX):
+                os.remove(WORD_VOCAB_FILE + SIGNATURE_SUFFIX)
+
+            if pretrained_embeddings_path:
+                vocabulary = []
+                embeddings = []
+                with codecs.open(pretrained_embeddings_path, 'r', 'utf-8') as f:
+                    for line in f:
+                        line = line.split()
+                        w = line[0]
+                        e = [float(x) for x in line[1:]]
+                        vocabulary.append(w)
+                        embeddings.append(e)
+
+                with open("We.pcl", 'wb') as f:
+                    cPickle.dump(embeddings, f, cPickle.HIGHEST_PROTOCOL)
+            else:
+                word_counts = dict()
+                with profiling.phase("word counting"):
+                    pool = multiprocessing.Pool(NUM_WORKERS)
+                    try:
+                        for counts in pool.imap(count_words, train_txt_files):
+                            merge_counts(word_counts, counts)
+                    finally:
+                        pool.terminate()
+                    vocabulary = build_vocabulary(word_counts)
+            with profiling.phase("vocabulary writing"):
+                write_vocabulary(vocabulary, WORD_VOCAB_FILE)
+            write_signature(WORD_VOCAB_FILE, signature)
+
+    for input_files, output_file in [(train_txt_files, train_output), (dev_txt_files, dev_output), (test_txt_files, test_output)]:
+        signature = dataset_signature(input_files, variable_length)
+
+        if is_up_to_date(output_file, signature):
+            print "%s is up to date" % output_file
+            continue
+
+        if os.path.exists(output_file + SIGNATURE_SUFFIX):
+            os.remove(output_file + SIGNATURE_SUFFIX)
 
-    write_processed_dataset(train_txt_files, train_output)
-    write_processed_dataset(dev_txt_files, dev_output)
-    write_processed_dataset(test_txt_files, test_output)
+        with profiling.phase("dataset conversion (%s)" % os.path.basename(output_file)):
+            write_processed_dataset_parallel(input_files, output_file, variable_length=variable_length)
+        write_signature(output_file, signature)
 
 if __name__ == "__main__":
 
@@ -254,25 +512,31 @@ if __name__ == "__main__":
         sys.exit("The path to stage1 source data directory with txt files is missing")
 
     replace = False
+    update = False
     if os.path.exists(DATA_PATH):
 
         while True:
-            resp = raw_input("Data path '%s' already exists. Do you want to:\n[r]eplace the files in existing data path?\n[e]xit?\n>" % DATA_PATH)
+            resp = raw_input("Data path '%s' already exists. Do you want to:\n[r]eplace the files in existing data path?\n[u]pdate the files whose inputs have changed?\n[e]xit?\n>" % DATA_PATH)
             resp = resp.lower().strip()
-            if resp not in ('r', 'e'):
+            if resp not in ('r', 'u', 'e'):
                 continue
             if resp == 'e':
                 sys.exit()
             elif resp == 'r':
                 replace = True
+            elif resp == 'u':
+                update = True
             break
 
     if replace and os.path.exists(DATA_PATH):
         shutil.rmtree(DATA_PATH)
 
-    os.makedirs(DATA_PATH)
+    if not update:
+        os.makedirs(DATA_PATH)
+
+    profiling.start(os.path.join(DATA_PATH, "data"))
     
-    create_dev_test_train_split_and_vocabulary(path, True, TRAIN_FILE, DEV_FILE, TEST_FILE, PRETRAINED_EMBEDDINGS_PATH)
+    create_dev_test_train_split_and_vocabulary(path, True, TRAIN_FILE, DEV_FILE, TEST_FILE, PRETRAINED_EMBEDDINGS_PATH, VARIABLE_LENGTH_SUBSEQUENCES)
 
     # Stage 2
     if len(sys.argv) > 2:
@@ -2,6 +2,7 @@
 
 """
 Computes and prints the overall classification error and precision, recall, F-score over punctuations.
+compute_error also returns the F-scores by punctuation and "Overall".
 """
 
 from numpy import nan
@@ -92,6 +93,7 @@ def compute_error(target_paths, predicted_paths):
     overall_tp = 0.0
     overall_fp = 0.0
     overall_fn = 0.0
+    f_scores = {}
 
     print "-"*46
     print "{:<16} {:<9} {:<9} {:<9}".format('PUNCTUATION','PRECISION','RECALL','F-SCORE')
@@ -108,6 +110,7 @@ def compute_error(target_paths, predicted_paths):
         precision = (true_positives.get(p,0.) / (true_positives.get(p,0.) + false_positives[p])) if p in false_positives else nan
         recall = (true_positives.get(p,0.) / (true_positives.get(p,0.) + false_negatives[p])) if p in false_negatives else nan
         f_score = (2. * precision * recall / (precision + recall)) if (precision + recall) > 0 else nan        
+        f_scores[p] = f_score
         print u"{:<16} {:<9} {:<9} {:<9}".format(punctuation, round(precision,3)*100, round(recall,3)*100, round(f_score,3)*100).encode('utf-8')
     print "-"*46
     pre = overall_tp/(overall_tp+overall_fp) if overall_fp else nan
@@ -117,6 +120,9 @@ def compute_error(target_paths, predicted_paths):
     print "Err: %s%%" % round((100.0 - float(total_correct) / float(counter-1) * 100.0), 2)
     print "SER: %s%%" % round((substitutions + deletions + insertions) / (correct + substitutions + deletions) * 100, 1)
 
+    f_scores["Overall"] = f1
+    return f_scores
+
 
 if __name__ == "__main__":
 
@@ -0,0 +1,158 @@
+# coding: utf-8
+
+import sys
+import os
+import json
+import codecs
+import cPickle
+
+import numpy as np
+
+INFO_FILE = "model.json"
+X_VOCABULARY_FILE = "x_vocabulary"
+Y_VOCABULARY_FILE = "y_vocabulary"
+PARAM_FILE = "param_%02d.npy"
+SCALE_FILE = "scale_%02d.npy"
+STAGE1_DIR = "stage1"
+
+"""
+Exports a model saved by main.py or main2.py to an inference only model directory, which models.load and numpy_models.load
+open faster and with less memory. The training state (gsums, random state, validation history) is left out, the
+parameters are stored as .npy files that are memory mapped when loaded, so processes running the same model share them,
+and the vocabularies are stored as text files, one token per line in the order of their ids.
+A second stage model includes its first stage model in the stage1 subdirectory.
+
+Optionally the weight matrices can be quantized to float16, or to int8 with a float32 scale per row. The embeddings are
+then kept quantized in memory and only the rows of the input words are converted, the other matrices, which are much smaller
+for a large vocabulary, are converted to float32 when the model is loaded. Inference runs in float32. To check how much
+quantization changes the output, see evaluate_quantization.py.
+
+e.g. python paragraph/export_model.py Model_althingi_h256_lr0.02.pcl $bundle/paragraph_model [int8|float16]
+"""
+
+QUANTIZATIONS = ("float16", "int8")
+
+class QuantizedMatrix(object):
+    """A float16 or int8 weight matrix, whose rows are converted to float32 when indexed"""
+
+    def __init__(self, values, scales=None):
+        self.values = values
+        self.scales = scales # int8 only, shape (rows, 1)
+        self.shape = values.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __getitem__(self, rows):
+        v = self.values[rows].astype(np.float32)
+        if self.scales is not None:
+            v *= self.scales[rows]
+        return v
+
+def quantize(param, quantization):
+    """Returns the quantized values and the int8 scales"""
+    if quantization == "float16":
+        return param.astype(np.float16), None
+    scales = np.abs(param).max(axis=1, keepdims=True) / 127.
+    scales[scales == 0] = 1.
+    return np.round(param / scales).astype(np.int8), scales.astype(np.float32)
+
+def dequantize(param):
+    if isinstance(param, QuantizedMatrix):
+        return param[:]
+    return param
+
+def write_vocabulary(vocabulary, file_name):
+    with codecs.open(file_name, 'w', 'utf-8') as f:
+        f.write("\n".join(w for w, _ in sorted(vocabulary.items(), key=lambda wi: wi[1])))
+
+def read_vocabulary(file_name):
+    with codecs.open(file_name, 'r', 'utf-8') as f:
+        return dict((w.strip(), i) for (i, w) in enumerate(f.readlines()))
+
+def export(model_file, output_dir, quantization=None):
+
+    assert quantization is None or quantization in QUANTIZATIONS, "Unknown quantization '%s'" % quantization
+
+    state = load_state(model_file)
+
+    os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, INFO_FILE), 'w') as f:
+        json.dump({"type": state["type"], "n_hidden": state["n_hidden"], "num_params": len(state["params"]), "quantization": quantization,
+                   "attention_window": state.get("attention_window")}, f)
+
+    write_vocabulary(state["x_vocabulary"], os.path.join(output_dir, X_VOCABULARY_FILE))
+    write_vocabulary(state["y_vocabulary"], os.path.join(output_dir, Y_VOCABULARY_FILE))
+
+    for i, param in enumerate(state["params"]):
+        param = dequantize(param)
+        if quantization and param.ndim == 2:
+            param, scales = quantize(param, quantization)
+            if scales is not None:
+                np.save(os.path.join(output_dir, SCALE_FILE % i), scales)
+        elif quantization:
+            param = param.astype(np.float32)
+        np.save(os.path.join(output_dir, PARAM_FILE % i), param)
+
+    if state.get("stage1_model_file_name"):
+        export(state["stage1_model_file_name"], os.path.join(output_dir, STAGE1_DIR), quantization)
+
+def load_state(file_path):
+    """
+    Returns the state dict of a model file saved by GRU.save, or of an exported model directory.
+    The state of an exported model has no training state and its parameters are read only memory maps,
+    quantized weight matrices are QuantizedMatrix objects (see dequantize).
+    """
+
+    if not os.path.isdir(file_path):
+        with open(file_path, 'rb') as f:
+            return cPickle.load(f)
+
+    with open(os.path.join(file_path, INFO_FILE), 'r') as f:
+        info = json.load(f)
+
+    params = []
+    for i in range(info["num_params"]):
+        param = np.load(os.path.join(file_path, PARAM_FILE % i), mmap_mode='r')
+        if info.get("quantization") and param.ndim == 2:
+            scale_file = os.path.join(file_path, SCALE_FILE % i)
+            param = QuantizedMatrix(param, np.load(scale_file) if os.path.exists(scale_file) else None)
+        params.append(param)
+
+    stage1_dir = os.path.join(file_path, STAGE1_DIR)
+
+    return {
+        "type":                     str(info["type"]),
+        "n_hidden":                 info["n_hidden"],
+        "x_vocabulary":             read_vocabulary(os.path.join(file_path, X_VOCABULARY_FILE)),
+        "y_vocabulary":             read_vocabulary(os.path.join(file_path, Y_VOCABULARY_FILE)),
+        "stage1_model_file_name":   stage1_dir if os.path.isdir(stage1_dir) else None,
+        "attention_window":         info.get("attention_window"),
+        "params":                   params,
+        "gsums":                    None,
+        "learning_rate":            None,
+        "validation_ppl_history":   None,
+        "epoch":                    None,
+        "random_state":             None
+    }
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        output_dir = sys.argv[2]
+    else:
+        sys.exit("Output directory argument missing")
+
+    quantization = sys.argv[3] if len(sys.argv) > 3 else None
+
+    if quantization and quantization not in QUANTIZATIONS:
+        sys.exit("Quantization must be one of: %s" % ", ".join(QUANTIZATIONS))
+
+    if os.path.exists(output_dir):
+        sys.exit("Output directory '%s' already exists" % output_dir)
+
+    export(model_file, output_dir, quantization)
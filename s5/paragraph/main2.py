@@ -14,18 +14,60 @@ import os.path
 import theano.tensor as T
 import numpy as np
 
-from main import get_minibatch
+from main import get_minibatch, PREFETCH_BATCHES
 
 MAX_EPOCHS = 50
 MINIBATCH_SIZE = 128
 L2_REG = 0.0
 CLIPPING_THRESHOLD = 2.0
 PATIENCE_EPOCHS = 1
+CACHE_STAGE1 = True # compute the hidden states of the frozen stage 1 model once instead of on every minibatch
+STAGE1_CACHE_SUFFIX = ".stage1_hidden_states.npy"
 
 """
 Second stage training
 """
 
+def cache_stage1_hidden_states(stage1_model_file, dataset_file, minibatch_size=MINIBATCH_SIZE):
+    """
+    Runs the stage 1 model once over the dataset and stores its last hidden states, one row per subsequence in dataset order,
+    in a .npy file next to the dataset. The file is reused while the model and the dataset are unchanged.
+    Returns the states memory mapped.
+    """
+
+    cache_file = dataset_file + STAGE1_CACHE_SUFFIX
+    signature = repr([(os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)) for f in [stage1_model_file, dataset_file + data.OFFSETS_SUFFIX, dataset_file + data.WORDS_SUFFIX]])
+
+    if data.is_up_to_date(cache_file, signature):
+        return np.load(cache_file, mmap_mode='r')
+
+    if os.path.exists(cache_file + data.SIGNATURE_SUFFIX):
+        os.remove(cache_file + data.SIGNATURE_SUFFIX)
+
+    print "Computing stage 1 hidden states for %s..." % dataset_file
+
+    dataset = data.load(dataset_file)
+
+    x = T.imatrix('x')
+    stage1, _ = models.load(stage1_model_file, minibatch_size, x)
+    compute_hidden_states = theano.function(inputs=[x], outputs=stage1.last_hidden_states)
+
+    hidden_states = np.lib.format.open_memmap(cache_file, mode='w+', dtype=theano.config.floatX, shape=(len(dataset), data.MAX_SEQUENCE_LEN - 1, stage1.n_hidden))
+
+    for start in range(0, len(dataset), minibatch_size):
+        X_batch = [dataset[i][0] for i in range(start, min(start + minibatch_size, len(dataset)))]
+        num_subsequences = len(X_batch)
+        X_batch += [X_batch[-1]] * (minibatch_size - num_subsequences) # pad the last minibatch, the subsequences don't affect each other
+        h = compute_hidden_states(np.array(X_batch, dtype=np.int32).T)
+        hidden_states[start:start+num_subsequences] = h[:,:num_subsequences].transpose(1, 0, 2)
+
+    hidden_states.flush()
+    del hidden_states
+
+    data.write_signature(cache_file, signature)
+
+    return np.load(cache_file, mmap_mode='r')
+
 if __name__ == "__main__":
 
     if len(sys.argv) > 1:
@@ -64,6 +106,7 @@ if __name__ == "__main__":
     x = T.imatrix('x')
     y = T.imatrix('y')
     p = T.matrix('p')
+    h = T.tensor3('h') if CACHE_STAGE1 else None
     lr = T.scalar('lr')
 
     continue_with_previous = False
@@ -72,6 +115,14 @@ if __name__ == "__main__":
         print "Found an existing model with the name %s" % model_file
         sys.exit()
         
+    if CACHE_STAGE1:
+        train_hidden_states = cache_stage1_hidden_states(stage1_model_file, data.TRAIN_FILE2)
+        dev_hidden_states = cache_stage1_hidden_states(stage1_model_file, data.DEV_FILE2)
+        cache_stage1_hidden_states(stage1_model_file, data.TEST_FILE2)
+    else:
+        train_hidden_states = None
+        dev_hidden_states = None
+
     if continue_with_previous:
         net, state = models.load(model_file, MINIBATCH_SIZE, x, p)
         gsums, learning_rate, validation_ppl_history, starting_epoch, rng = state
@@ -89,7 +140,8 @@ if __name__ == "__main__":
             x_vocabulary=word_vocabulary,
             y_vocabulary=punctuation_vocabulary,
             stage1_model_file_name=stage1_model_file,
-            p=p
+            p=p,
+            stage1_hidden_states=h
             )
 
         starting_epoch = 0
@@ -119,14 +171,15 @@ if __name__ == "__main__":
         updates[gsum] = gsum + (gparam ** 2)
         updates[param] = param - lr * (gparam / (T.sqrt(updates[gsum] + 1e-6)))
 
+    # with cached stage 1 hidden states they are the input instead of x
     train_model = theano.function(
-        inputs=[x, p, y, lr],
+        inputs=[h if CACHE_STAGE1 else x, p, y, lr],
         outputs=cost,
         updates=updates
     )
 
     validate_model = theano.function(
-        inputs=[x, p, y],
+        inputs=[h if CACHE_STAGE1 else x, p, y],
         outputs=net.cost(y)
     )
 
@@ -136,19 +189,24 @@ if __name__ == "__main__":
         total_neg_log_likelihood = 0
         total_num_output_samples = 0
         iteration = 0
-        for X, Y, P in get_minibatch(data.TRAIN_FILE2, MINIBATCH_SIZE, shuffle=True, with_pauses=True):
-            total_neg_log_likelihood += train_model(X, P, Y, learning_rate)
+        minibatches = get_minibatch(data.TRAIN_FILE2, MINIBATCH_SIZE, shuffle=True, with_pauses=True, hidden_states=train_hidden_states)
+        for minibatch in minibatches:
+            X, Y, P = minibatch[:3]
+            total_neg_log_likelihood += train_model(minibatch[-1] if CACHE_STAGE1 else X, P, Y, learning_rate)
             total_num_output_samples += np.prod(Y.shape)
             iteration += 1
             if iteration % 100 == 0:
                 sys.stdout.write("PPL: %.4f; Speed: %.2f sps\n" % (np.exp(total_neg_log_likelihood / total_num_output_samples), total_num_output_samples / max(time() - t0, 1e-100)))
                 sys.stdout.flush()
         print "Total number of training labels: %d" % total_num_output_samples
+        if PREFETCH_BATCHES > 0:
+            print "Waited for training data: %.2f sec (%.1f%% of the epoch)" % (minibatches.wait_time, minibatches.wait_time / max(time() - t0, 1e-100) * 100)
 
         total_neg_log_likelihood = 0
         total_num_output_samples = 0
-        for X, Y, P in get_minibatch(data.DEV_FILE2, MINIBATCH_SIZE, shuffle=False, with_pauses=True):
-            total_neg_log_likelihood += validate_model(X, P, Y)
+        for minibatch in get_minibatch(data.DEV_FILE2, MINIBATCH_SIZE, shuffle=False, with_pauses=True, hidden_states=dev_hidden_states):
+            X, Y, P = minibatch[:3]
+            total_neg_log_likelihood += validate_model(minibatch[-1] if CACHE_STAGE1 else X, P, Y)
             total_num_output_samples += np.prod(Y.shape)
         print "Total number of validation labels: %d" % total_num_output_samples
 
@@ -0,0 +1,185 @@
+# coding: utf-8
+from __future__ import division
+
+import export_model
+import numpy as np
+
+"""
+Inference only NumPy implementation of the models in models.py.
+Reads the same model files and does not need Theano. The forward pass mirrors the Theano graphs, but input side
+projections of the GRU layers are computed for the whole sequence at once, outside of the time step loop.
+Inputs have time as the first axis and the minibatch as the second axis, as in models.py.
+"""
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.)
+
+def softmax(x, axis=-1):
+    e = np.exp(x - x.max(axis=axis, keepdims=True))
+    return e / e.sum(axis=axis, keepdims=True)
+
+def pad(x, size):
+    """Pads the 0-axis of x with size zeros at both ends"""
+    padding = np.zeros((size,) + x.shape[1:], dtype=x.dtype)
+    return np.concatenate([padding, x, padding], axis=0)
+
+def load(file_path):
+
+    state = export_model.load_state(file_path)
+
+    Model = globals()[state["type"]]
+
+    return Model(state)
+
+class GRULayer(object):
+
+    def __init__(self, params):
+        self.W_x, self.W_h, self.b, self.W_x_h, self.W_h_h, self.b_h = params
+        self.n_out = self.W_h_h.shape[0]
+        # fused input weights of the gates and of the candidate hidden state
+        self.W_x_all = np.concatenate([self.W_x, self.W_x_h], axis=1)
+        self.b_all = np.concatenate([self.b, self.b_h])
+
+    def project_inputs(self, x):
+        # input side pre-activations for all time steps: x has shape (time, minibatch, n_in)
+        x_all = np.dot(x, self.W_x_all) + self.b_all
+        return x_all[..., :self.n_out*2], x_all[..., self.n_out*2:]
+
+    def step(self, x_rz_t, x_h_t, h_tm1):
+
+        rz = sigmoid(x_rz_t + np.dot(h_tm1, self.W_h))
+        r = rz[:, :self.n_out]
+        z = rz[:, self.n_out:]
+
+        h = np.tanh(x_h_t + np.dot(h_tm1 * r, self.W_h_h))
+
+        return z * h_tm1 + (1. - z) * h
+
+    def scan(self, x, mask=None):
+        x_rz, x_h = self.project_inputs(x)
+        h_tm1 = np.zeros((x.shape[1], self.n_out), dtype=x.dtype)
+        h = np.empty((x.shape[0], x.shape[1], self.n_out), dtype=x.dtype)
+        for t in range(x.shape[0]):
+            h_t = self.step(x_rz[t], x_h[t], h_tm1)
+            if mask is not None:
+                # padded time steps carry the previous hidden state over unchanged
+                h_t = mask[t][:, None] * h_t + (1. - mask[t][:, None]) * h_tm1
+            h[t] = h_t
+            h_tm1 = h_t
+        return h
+
+class GRU(object):
+
+    def __init__(self, state):
+
+        self.n_hidden = state["n_hidden"]
+        self.x_vocabulary = state["x_vocabulary"]
+        self.y_vocabulary = state["y_vocabulary"]
+        self.attention_window = state.get("attention_window")
+
+        # the embeddings of a quantized model stay quantized, rows are converted when they are looked up
+        params = state["params"][:1] + [export_model.dequantize(param) for param in state["params"][1:]]
+
+        (self.We,
+         self.Wy, self.by,
+         self.Wa_h, self.Wa_c, self.ba, self.Wa_y,
+         self.Wf_h, self.Wf_c, self.Wf_f, self.bf) = params[:11]
+
+        self.GRU = GRULayer(params[11:17])
+        self.GRU_f = GRULayer(params[17:23])
+        self.GRU_b = GRULayer(params[23:29])
+
+    def forward(self, x, mask=None):
+        """Returns the output probabilities with shape (time - 1, minibatch, y_vocabulary_size) and the late fused hidden states"""
+
+        x_emb = self.We[x]
+        if mask is not None:
+            mask = mask.astype(x_emb.dtype)
+
+        h_f = self.GRU_f.scan(x_emb, mask)
+        h_b = self.GRU_b.scan(x_emb[::-1], mask[::-1] if mask is not None else None)
+
+        # 0-axis is time steps, 1-axis is batch size and 2-axis is hidden layer size
+        context = np.concatenate([h_f, h_b[::-1]], axis=2)
+        projected_context = np.dot(context, self.Wa_c) + self.ba
+
+        if self.attention_window:
+            # the attention_window words on each side of the gap before step t start at t + 1 of the padded arrays
+            window_size = 2 * self.attention_window
+            window_mask = pad(mask if mask is not None else np.ones(x.shape, dtype=context.dtype), self.attention_window) # the padding gets no attention
+            padded_context = pad(context, self.attention_window)
+            padded_projected_context = pad(projected_context, self.attention_window)
+
+        # ignore the 1st word in context, because there's no punctuation before that
+        x_rz, x_h = self.GRU.project_inputs(context[1:])
+
+        num_steps = context.shape[0] - 1
+        h_tm1 = np.zeros((x.shape[1], self.n_hidden), dtype=context.dtype)
+        hf = np.empty((num_steps, x.shape[1], self.n_hidden), dtype=context.dtype)
+        y = np.empty((num_steps, x.shape[1], self.by.shape[0]), dtype=context.dtype)
+
+        for t in range(num_steps):
+
+            if self.attention_window:
+                c = padded_context[t+1:t+1+window_size]
+                pc = padded_projected_context[t+1:t+1+window_size]
+                m = window_mask[t+1:t+1+window_size]
+            else:
+                c, pc, m = context, projected_context, mask
+
+            # Attention model
+            h_a = np.tanh(pc + np.dot(h_tm1, self.Wa_h))
+            alphas = softmax(np.dot(h_a, self.Wa_y), axis=0)
+            if m is not None:
+                alphas = alphas * m # padded positions get no attention
+                if self.attention_window:
+                    alphas = alphas / np.maximum(alphas.sum(axis=0, keepdims=True), 1e-30) # the window of a padded time step has no words
+                else:
+                    alphas = alphas / alphas.sum(axis=0, keepdims=True)
+            weighted_context = np.einsum("tb,tbh->bh", alphas, c)
+
+            h_t = self.GRU.step(x_rz[t], x_h[t], h_tm1)
+
+            # Late fusion
+            lfc = np.dot(weighted_context, self.Wf_c) # late fused context
+            fw = sigmoid(np.dot(lfc, self.Wf_f) + np.dot(h_t, self.Wf_h) + self.bf) # fusion weights
+            hf[t] = lfc * fw + h_t # weighted fused context + hidden state
+
+            y[t] = softmax(np.dot(hf[t], self.Wy) + self.by)
+
+            h_tm1 = h_t
+
+        return y, hf
+
+    def predict(self, x, p=None, mask=None):
+        return self.forward(x, mask)[0]
+
+class GRUstage2(GRU):
+
+    def __init__(self, state):
+
+        self.n_hidden = state["n_hidden"]
+        self.x_vocabulary = state["x_vocabulary"]
+        self.y_vocabulary = state["y_vocabulary"]
+
+        self.stage1 = load(state["stage1_model_file_name"])
+
+        params = [export_model.dequantize(param) for param in state["params"]]
+
+        self.Wy, self.by = params[:2]
+        self.GRU = GRULayer(params[2:8])
+
+    def forward(self, x, p, mask=None):
+
+        _, last_hidden_states = self.stage1.forward(x, mask)
+
+        num_steps = min(last_hidden_states.shape[0], p.shape[0])
+        x_t = np.concatenate((last_hidden_states[:num_steps], p[:num_steps,:,None].astype(last_hidden_states.dtype)), axis=2)
+        h = self.GRU.scan(x_t)
+
+        y = softmax(np.dot(h, self.Wy) + self.by)
+
+        return y, h
+
+    def predict(self, x, p=None, mask=None):
+        return self.forward(x, p, mask)[0]
@@ -1,19 +1,21 @@
 # coding: utf-8
 from __future__ import division
 
-import models
 import data
+import profiling
 
-import theano
 import sys
 reload(sys)
 sys.setdefaultencoding('utf8')
+import os
 import codecs
 
-import theano.tensor as T
 import numpy as np
 
 MAX_SUBSEQUENCE_LEN = 200
+LOCAL_ATTENTION_MAX_SUBSEQUENCE_LEN = 1000 # for models with local attention, whose cost per word doesn't grow with the window
+
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "theano") # "theano" or "numpy". The numpy engine does not import Theano and needs no compilation.
 
 def to_array(arr, dtype=np.int32):
     # minibatch of 1 sequence as column
@@ -25,96 +27,181 @@ def convert_punctuation_to_readable(punct_token):
     else:
         return punct_token[0]
 
-def restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function):
-    i = 0
-    with codecs.open(output_file, 'w', 'utf-8') as f_out:
-        while True:
+def to_padded_array(arrs, minibatch_size, dtype=np.int32):
+    # minibatch of sequences as columns, shorter ones padded at the end. Unused columns are left as zero padding with a full mask.
+    X = np.zeros((max(len(arr) for arr in arrs), minibatch_size), dtype=dtype)
+    mask = np.ones(X.shape, dtype=np.float64)
+    for b, arr in enumerate(arrs):
+        X[:len(arr), b] = arr
+        mask[len(arr):, b] = 0.
+    return X, mask
 
-            subsequence = text[i:i+MAX_SUBSEQUENCE_LEN]
-            subsequence_pauses = pauses[i:i+MAX_SUBSEQUENCE_LEN]
+def load_model(model_file, use_pauses, minibatch_size=1, masked=False):
+    """
+    Returns the model and a prediction function with the inputs (x[, p][, mask]), using the engine set by INFERENCE_ENGINE.
+    Float inputs can be float64, they are cast to the precision of the model.
+    """
+    if INFERENCE_ENGINE == "numpy":
 
-            if len(subsequence) == 0:
-                break
+        import numpy_models
 
-            converted_subsequence = [word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence]
+        print "Loading model parameters..."
+        with profiling.phase("model load"):
+            net = numpy_models.load(model_file)
+
+        if use_pauses and masked:
+            predict = lambda x, p, mask: net.predict(x, p, mask)
+        elif use_pauses:
+            predict = lambda x, p: net.predict(x, p)
+        elif masked:
+            predict = lambda x, mask: net.predict(x, mask=mask)
+        else:
+            predict = lambda x: net.predict(x)
 
-            y = predict_function(to_array(converted_subsequence), to_array(subsequence_pauses, dtype=theano.config.floatX))
+    else:
 
-            f_out.write(subsequence[0])
+        import models
+        import theano
+        import theano.tensor as T
 
-            last_eop_idx = 0
-            punctuations = []
-            for y_t in y:
+        x = T.imatrix('x')
+        p = T.matrix('p') if use_pauses else None
+        mask = T.matrix('mask') if masked else None
 
-                p_i = np.argmax(y_t.flatten())
-                punctuation = reverse_punctuation_vocabulary[p_i]
+        print "Loading model parameters..."
+        with profiling.phase("model load"):
+            net, _ = models.load(model_file, minibatch_size, x, p, mask=mask)
 
-                punctuations.append(punctuation)
+        print "Building model..."
+        with profiling.phase("graph compile"):
+            predict = theano.function(
+                inputs=[v for v in [x, p, mask] if v is not None],
+                outputs=net.y,
+                allow_input_downcast=True
+            )
+
+    return net, profiling.timed("model calls", predict)
+
+def get_max_subsequence_len(net):
+    """Window length for the model. Longer windows with local attention recompute fewer words after the last EOP of a window."""
+    return LOCAL_ATTENTION_MAX_SUBSEQUENCE_LEN if getattr(net, "attention_window", None) else MAX_SUBSEQUENCE_LEN
+
+def get_punctuations(y, reverse_punctuation_vocabulary):
+    return [reverse_punctuation_vocabulary[np.argmax(y_t.flatten())] for y_t in y]
+
+def get_step(subsequence, punctuations, eop_tokens=data.EOP_TOKENS):
+    last_eop_idx = 0
+    for j, punctuation in enumerate(punctuations):
+        if punctuation in eop_tokens:
+            last_eop_idx = j + 1 # we intentionally want the index of next element
+
+    if subsequence[-1] == data.END:
+        return len(subsequence) - 1
+    elif last_eop_idx != 0:
+        return last_eop_idx
+    else:
+        return len(subsequence) - 1
+
+def write_subsequence(f_out, subsequence, punctuations, step):
+    f_out.write(subsequence[0])
+    for j in range(step):
+        f_out.write(" " + punctuations[j] + " " if punctuations[j] != data.SPACE else " ")
+        if j < step - 1:
+            f_out.write(subsequence[1+j])
+
+def split_input(input_text, punctuation_vocabulary):
+    """Returns the words of the input text, ending with END, and the pause durations if it is pause annotated"""
+    tokens = input_text.split()
+    text = [w for w in tokens if w not in punctuation_vocabulary and not w.startswith(data.PAUSE_PREFIX)] + [data.END]
+    pauses = [float(s.replace(data.PAUSE_PREFIX,"").replace(">","")) for s in tokens if s.startswith(data.PAUSE_PREFIX)]
+    return text, pauses
+
+def insert_paragraphs(f_out, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, eop_tokens=data.EOP_TOKENS, max_subsequence_len=MAX_SUBSEQUENCE_LEN):
+    """Writes the paragraphed text to the open file f_out. pauses is None for models without pause input."""
+    i = 0
+    while True:
 
-                if punctuation in data.EOP_TOKENS:
-                    last_eop_idx = len(punctuations) # we intentionally want the index of next element
+        subsequence = text[i:i+max_subsequence_len]
 
-            if subsequence[-1] == data.END:
-                step = len(subsequence) - 1
-            elif last_eop_idx != 0:
-                step = last_eop_idx
-            else:
-                step = len(subsequence) - 1
+        if len(subsequence) == 0:
+            break
 
-            for j in range(step):
-                f_out.write(" " + punctuations[j] + " " if punctuations[j] != data.SPACE else " ")
-                if j < step - 1:
-                    f_out.write(subsequence[1+j])
+        with profiling.phase("vocabulary mapping"):
+            converted_subsequence = [word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence]
 
-            if subsequence[-1] == data.END:
-                break
+        if pauses is None:
+            y = predict_function(to_array(converted_subsequence))
+        else:
+            y = predict_function(to_array(converted_subsequence), to_array(pauses[i:i+max_subsequence_len], dtype=np.float64))
 
-            i += step
+        with profiling.phase("output decoding"):
+            punctuations = get_punctuations(y, reverse_punctuation_vocabulary)
+            step = get_step(subsequence, punctuations, eop_tokens)
+        with profiling.phase("output writing"):
+            write_subsequence(f_out, subsequence, punctuations, step)
 
-def restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict_function):
-    i = 0
-    with codecs.open(output_file, 'w', 'utf-8') as f_out:
-        while True:
+        if subsequence[-1] == data.END:
+            break
 
-            subsequence = text[i:i+MAX_SUBSEQUENCE_LEN]
+        i += step
 
-            if len(subsequence) == 0:
-                break
+def restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=MAX_SUBSEQUENCE_LEN):
+    with codecs.open(output_file, 'w', 'utf-8') as f_out:
+        insert_paragraphs(f_out, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=max_subsequence_len)
 
-            converted_subsequence = [word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence]
+def restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=MAX_SUBSEQUENCE_LEN):
+    with codecs.open(output_file, 'w', 'utf-8') as f_out:
+        insert_paragraphs(f_out, text, None, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=max_subsequence_len)
 
-            y = predict_function(to_array(converted_subsequence))
+def restore_batched(output_files, texts, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, minibatch_size, eop_tokens=data.EOP_TOKENS, max_subsequence_len=MAX_SUBSEQUENCE_LEN):
+    """
+    Inserts paragraph breaks into many texts at once. The next window of a text starts after the last EOP predicted in its previous window,
+    so the windows of one text have to be processed in order, but windows of different texts share a padded and masked minibatch.
+    pauses is None for models without pause input.
+    """
+    f_outs = [codecs.open(output_file, 'w', 'utf-8') for output_file in output_files]
+    positions = [0 for _ in texts]
+    unfinished = [k for k in range(len(texts)) if len(texts[k]) > 0]
 
-            f_out.write(subsequence[0])
+    while unfinished:
 
-            last_eop_idx = 0
-            punctuations = []
-            for y_t in y:
+        finished = set()
 
-                p_i = np.argmax(y_t.flatten())
-                punctuation = reverse_punctuation_vocabulary[p_i]
+        for b_start in range(0, len(unfinished), minibatch_size):
 
-                punctuations.append(punctuation)
+            batch = unfinished[b_start:b_start+minibatch_size]
+            subsequences = [texts[k][positions[k]:positions[k]+max_subsequence_len] for k in batch]
 
-                if punctuation in data.EOP_TOKENS:
-                    last_eop_idx = len(punctuations) # we intentionally want the index of next element
+            with profiling.phase("vocabulary mapping"):
+                converted_subsequences = [[word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence] for subsequence in subsequences]
+                X, mask = to_padded_array(converted_subsequences, minibatch_size)
 
-            if subsequence[-1] == data.END:
-                step = len(subsequence) - 1
-            elif last_eop_idx != 0:
-                step = last_eop_idx
+            if pauses is None:
+                y = predict_function(X, mask)
             else:
-                step = len(subsequence) - 1
+                subsequence_pauses = [pauses[k][positions[k]:positions[k]+max_subsequence_len] or [0.0] for k in batch]
+                P, _ = to_padded_array(subsequence_pauses, minibatch_size, dtype=np.float64)
+                y = predict_function(X, P, mask)
+
+            for b, k in enumerate(batch):
 
-            for j in range(step):
-                f_out.write(" " + punctuations[j] + " " if punctuations[j] != data.SPACE else " ")
-                if j < step - 1:
-                    f_out.write(subsequence[1+j])
+                subsequence = subsequences[b]
 
-            if subsequence[-1] == data.END:
-                break
+                with profiling.phase("output decoding"):
+                    punctuations = get_punctuations(y[:len(subsequence)-1, b], reverse_punctuation_vocabulary)
+                    step = get_step(subsequence, punctuations, eop_tokens)
+                with profiling.phase("output writing"):
+                    write_subsequence(f_outs[k], subsequence, punctuations, step)
 
-            i += step
+                if subsequence[-1] == data.END:
+                    finished.add(k)
+
+                positions[k] += step
+
+        unfinished = [k for k in unfinished if k not in finished]
+
+    for f_out in f_outs:
+        f_out.close()
 
 if __name__ == "__main__":
 
@@ -130,31 +217,9 @@ if __name__ == "__main__":
 
     use_pauses = len(sys.argv) > 3 and bool(int(sys.argv[3]))
 
-    x = T.imatrix('x')
-    
-    if use_pauses:
-    
-        p = T.matrix('p')
-
-        print "Loading model parameters..."
-        net, _ = models.load(model_file, 1, x, p)
-
-        print "Building model..."
-        predict = theano.function(
-            inputs=[x, p],
-            outputs=net.y
-        )
-
-    else:
-
-        print "Loading model parameters..."
-        net, _ = models.load(model_file, 1, x)
+    profiling.start(output_file)
 
-        print "Building model..."
-        predict = theano.function(
-            inputs=[x],
-            outputs=net.y
-        )
+    net, predict = load_model(model_file, use_pauses)
 
     word_vocabulary = net.x_vocabulary
     punctuation_vocabulary = net.y_vocabulary
@@ -162,17 +227,18 @@ if __name__ == "__main__":
     reverse_word_vocabulary = {v:k for k,v in word_vocabulary.items()}
     reverse_punctuation_vocabulary = {v:k for k,v in punctuation_vocabulary.items()}
 
-    input_text = codecs.getreader('utf-8')(sys.stdin).read()
+    with profiling.phase("input reading"):
+        input_text = codecs.getreader('utf-8')(sys.stdin).read()
 
     if len(input_text) == 0:
         sys.exit("Input text from stdin missing.")
 
-    text = [w for w in input_text.split() if w not in punctuation_vocabulary and not w.startswith(data.PAUSE_PREFIX)] + [data.END]
-    pauses = [float(s.replace(data.PAUSE_PREFIX,"").replace(">","")) for s in input_text.split() if s.startswith(data.PAUSE_PREFIX)]
+    with profiling.phase("input splitting"):
+        text, pauses = split_input(input_text, punctuation_vocabulary)
 
     if not use_pauses:
-        restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict)
+        restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict, get_max_subsequence_len(net))
     else:
         if not pauses:
             pauses = [0.0 for _ in range(len(text)-1)]
-        restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict)
+        restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict, get_max_subsequence_len(net))
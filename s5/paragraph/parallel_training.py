@@ -0,0 +1,141 @@
+# coding: utf-8
+from __future__ import division
+
+import traceback
+import multiprocessing
+
+import theano
+import theano.tensor as T
+import numpy as np
+
+"""
+Data parallel training on CPU cores for main.py (see TRAINING_WORKERS there).
+Each minibatch is split into equal shards along the minibatch axis, and each worker process computes the cost and the
+gradients of its shard with a copy of the model built for the shard size. The gradients of the shards are summed, which
+gives the gradients of the whole minibatch, because the costs of the models are sums over the outputs, and the sum is clipped
+and applied with the same Adagrad update as in main.py. The parameters, the gradients and the gsums are in shared memory,
+so only the minibatches and the costs are sent between the processes. The shards and the sum are always in the same order,
+so training with the same seed and number of workers gives the same model.
+"""
+
+def to_shared_memory(value):
+    """Returns a copy of the array in memory that is shared with the processes forked after this"""
+    buf = multiprocessing.RawArray('b', max(value.nbytes, 1))
+    array = np.frombuffer(buf, dtype=value.dtype, count=value.size).reshape(value.shape)
+    array[...] = value
+    return array
+
+def clip_and_update(params, gparams, gsums, learning_rate, clipping_threshold):
+    """The Adagrad update of main.py with gradient clipping, in place on the parameter and gsum arrays"""
+    norm = np.sqrt(sum(np.sum(gparam ** 2) for gparam in gparams))
+
+    for gparam, param, gsum in zip(gparams, params, gsums):
+        if norm >= clipping_threshold:
+            gparam = gparam / norm * clipping_threshold
+        gsum += gparam ** 2
+        param -= learning_rate * (gparam / np.sqrt(gsum + 1e-6))
+
+class ParallelTrainer(object):
+    """
+    Trains net with num_workers processes. shard_net is the same model built for minibatches of minibatch_size/num_workers
+    sequences, inputs are the inputs of shard_cost (the training cost of shard_net, which should include 1/num_workers of
+    any regularization terms) and validation_cost. After this, the parameters of both models and the gsums (theano shared
+    variables like in main.py) are in shared memory.
+    train and validate take the same arguments as the train_model and validate_model functions of main.py.
+    """
+
+    def __init__(self, net, shard_net, inputs, shard_cost, validation_cost, gsums, num_workers, clipping_threshold):
+
+        self.num_workers = num_workers
+        self.clipping_threshold = clipping_threshold
+
+        self.params = []
+        for param, shard_param in zip(net.params, shard_net.params):
+            value = to_shared_memory(param.get_value(borrow=True))
+            param.set_value(value, borrow=True)
+            shard_param.set_value(value, borrow=True)
+            self.params.append(value)
+
+        self.gsums = []
+        for gsum in gsums:
+            value = to_shared_memory(gsum.get_value(borrow=True))
+            gsum.set_value(value, borrow=True)
+            self.gsums.append(value)
+
+        self.gparams = [[to_shared_memory(np.zeros_like(param)) for param in self.params] for _ in range(num_workers)]
+
+        # compiled once here, the workers get them when they are forked
+        self.compute_gradients = theano.function(
+            inputs=inputs,
+            outputs=[shard_cost] + T.grad(shard_cost, shard_net.params)
+        )
+        self.compute_cost = theano.function(
+            inputs=inputs,
+            outputs=validation_cost
+        )
+
+        self.task_queues = [multiprocessing.Queue() for _ in range(num_workers)]
+        self.result_queue = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=self._work, args=(k,)) for k in range(num_workers)]
+        for worker in self.workers:
+            worker.daemon = True # don't outlive the training script
+            worker.start()
+
+    def _work(self, k):
+        while True:
+            task = self.task_queues[k].get()
+            if task is None:
+                return
+            command, shard = task
+            try:
+                if command == "train":
+                    outputs = self.compute_gradients(*shard)
+                    for gparam, value in zip(self.gparams[k], outputs[1:]):
+                        gparam[...] = value
+                    cost = outputs[0]
+                else:
+                    cost = self.compute_cost(*shard)
+                self.result_queue.put((k, float(cost), None))
+            except Exception:
+                self.result_queue.put((k, None, traceback.format_exc()))
+
+    def _run(self, command, minibatch):
+        """Sends the shards of the minibatch to the workers and returns the sum of their costs"""
+        assert minibatch[0].shape[1] % self.num_workers == 0, "The minibatch size must be divisible by the number of workers"
+
+        shards = zip(*[np.split(array, self.num_workers, axis=1) for array in minibatch])
+        for k, shard in enumerate(shards):
+            self.task_queues[k].put((command, shard))
+
+        costs = [None] * self.num_workers
+        for _ in range(self.num_workers):
+            k, cost, error = self.result_queue.get()
+            if error is not None:
+                raise RuntimeError("Training worker %d failed:\n%s" % (k, error))
+            costs[k] = cost
+
+        return sum(costs)
+
+    def train(self, *inputs):
+        """Trains on the minibatch arrays inputs[:-1] with the learning rate inputs[-1] and returns the cost"""
+        minibatch, learning_rate = inputs[:-1], inputs[-1]
+
+        cost = self._run("train", minibatch)
+
+        # summed in the order of the workers, so that the result doesn't depend on which worker finishes first
+        gparams = [gparam.copy() for gparam in self.gparams[0]]
+        for k in range(1, self.num_workers):
+            for gparam, worker_gparam in zip(gparams, self.gparams[k]):
+                gparam += worker_gparam
+        clip_and_update(self.params, gparams, self.gsums, learning_rate, self.clipping_threshold)
+
+        return cost
+
+    def validate(self, *minibatch):
+        return self._run("validate", minibatch)
+
+    def close(self):
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,108 @@
+# coding: utf-8
+from __future__ import division
+
+import os
+import sys
+import atexit
+import cProfile
+import pstats
+
+from collections import OrderedDict
+from time import time
+
+"""
+Opt-in profiling of punctuator.py, paragrapher.py, main.py and data.py.
+With PUNCTUATOR_PROFILE=1 in the environment, the time spent in each phase of a run (model loading, graph compilation,
+vocabulary mapping, model calls, output writing etc.) is recorded, and a summary is written next to the output of the
+script when it exits (see start). With PUNCTUATOR_PROFILE=cprofile the run is also profiled with cProfile: the functions
+with the most cumulative time are added to the summary and the full statistics are written to a .prof file.
+Without the variable, phase and timed add nothing to the run.
+
+e.g. PUNCTUATOR_PROFILE=1 python punctuator/punctuator.py <model_path> <output_path> < input.txt
+or local/recognize/denormalize.sh --profile true <model-dir> <ASR-transcript> <out-file>
+"""
+
+PROFILE = os.environ.get("PUNCTUATOR_PROFILE", "")
+SUMMARY_SUFFIX = ".profile.txt"
+CPROFILE_SUFFIX = ".prof"
+CPROFILE_LINES = 40 # functions listed in the summary
+
+timings = OrderedDict() # phase name -> [seconds, count]
+
+class Phase(object):
+    """Context manager that adds the time of its block to a phase"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time()
+
+    def __exit__(self, *exc_info):
+        add(self.name, time() - self.t0)
+
+class NoPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NO_PHASE = NoPhase()
+
+def phase(name):
+    """e.g. with profiling.phase("model calls"): ..."""
+    return Phase(name) if PROFILE else NO_PHASE
+
+def add(name, seconds, count=1):
+    timing = timings.setdefault(name, [0., 0])
+    timing[0] += seconds
+    timing[1] += count
+
+def timed(name, function):
+    """Returns function with the time of each call added to the phase name, or function itself if profiling is off"""
+    if not PROFILE:
+        return function
+
+    def timed_function(*args, **kwargs):
+        t0 = time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            add(name, time() - t0)
+
+    return timed_function
+
+def start(output_file):
+    """
+    Starts profiling the rest of the run if it's on. The summary is written to output_file + SUMMARY_SUFFIX
+    when the process exits.
+    """
+    if not PROFILE:
+        return
+
+    profiler = None
+    if PROFILE == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    atexit.register(write_summary, output_file, time(), profiler)
+
+def write_summary(output_file, start_time, profiler=None):
+    total = time() - start_time
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(output_file + CPROFILE_SUFFIX)
+
+    with open(output_file + SUMMARY_SUFFIX, 'w') as f:
+        f.write("%s\n\n" % " ".join(sys.argv))
+        f.write("{:<32} {:>10} {:>10} {:>8}\n".format("PHASE", "SECONDS", "COUNT", "%"))
+        for name, (seconds, count) in timings.items():
+            f.write("{:<32} {:>10.3f} {:>10d} {:>8.1f}\n".format(name, seconds, count, seconds / max(total, 1e-100) * 100))
+        f.write("{:<32} {:>10.3f}\n".format("total (since start)", total))
+
+        if profiler is not None:
+            f.write("\n")
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(CPROFILE_LINES)
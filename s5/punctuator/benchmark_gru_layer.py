@@ -0,0 +1,125 @@
+# coding: utf-8
+from __future__ import division
+
+import models
+import data
+import main
+
+import sys
+
+import theano
+import theano.tensor as T
+import numpy as np
+
+from collections import OrderedDict
+from time import time
+
+"""
+Compares the training and inference speed of the GRU model with the current GRULayer, which computes the input
+projections of all time steps before the scan with fused weights, to the GRULayer that projected the inputs of each
+time step inside the scan. Both models get the same random weights and are trained on the same random minibatches of
+main.MINIBATCH_SIZE x data.MAX_SEQUENCE_LEN words with the Adagrad update of main.py.
+Prints the compilation time, the training speed in samples (punctuation decisions) per second like main.py does,
+the inference speed on one punctuator.py sized window, and the largest difference between the training costs of the two models.
+
+e.g. python punctuator/benchmark_gru_layer.py 256 100000 20
+"""
+
+INFERENCE_WINDOW_LEN = 200 # punctuator.MAX_SUBSEQUENCE_LEN
+
+# The previous GRULayer methods: the inputs are multiplied by the gate and candidate weights separately at each time step
+
+def unhoisted_project_inputs(self, x):
+    return x
+
+def unhoisted_step(self, x_t, h_tm1):
+
+    rz = T.nnet.sigmoid(T.dot(x_t, self.W_x) + T.dot(h_tm1, self.W_h) + self.b)
+    r = models._slice(rz, self.n_out, 0)
+    z = models._slice(rz, self.n_out, 1)
+
+    h = T.tanh(T.dot(x_t, self.W_x_h) + T.dot(h_tm1 * r, self.W_h_h) + self.b_h)
+
+    return z * h_tm1 + (1. - z) * h
+
+def build(hoisted, n_hidden, x_vocabulary, y_vocabulary, minibatch_size):
+
+    x = T.imatrix('x')
+    y = T.imatrix('y')
+    lr = T.scalar('lr')
+
+    project_inputs, step = models.GRULayer.__dict__["project_inputs"], models.GRULayer.__dict__["step"]
+    if not hoisted:
+        models.GRULayer.project_inputs, models.GRULayer.step = unhoisted_project_inputs, unhoisted_step
+    try:
+        net = models.GRU(rng=np.random.RandomState(1), x=x, minibatch_size=minibatch_size, n_hidden=n_hidden, x_vocabulary=x_vocabulary, y_vocabulary=y_vocabulary)
+    finally:
+        models.GRULayer.project_inputs, models.GRULayer.step = project_inputs, step
+
+    return net, x, y, lr
+
+def compile_training(net, x, y, lr):
+
+    cost = net.cost(y)
+    gparams = T.grad(cost, net.params)
+    gsums = [theano.shared(np.zeros_like(param.get_value(borrow=True))) for param in net.params]
+
+    norm = T.sqrt(T.sum([T.sum(gparam ** 2) for gparam in gparams]))
+
+    updates = OrderedDict()
+    for gparam, param, gsum in zip(gparams, net.params, gsums):
+        gparam = T.switch(T.ge(norm, main.CLIPPING_THRESHOLD), gparam / norm * main.CLIPPING_THRESHOLD, gparam)
+        updates[gsum] = gsum + (gparam ** 2)
+        updates[param] = param - lr * (gparam / (T.sqrt(updates[gsum] + 1e-6)))
+
+    return theano.function(inputs=[x, y, lr], outputs=cost, updates=updates)
+
+if __name__ == "__main__":
+
+    n_hidden = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    vocabulary_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    x_vocabulary = dict((str(i), i) for i in range(vocabulary_size))
+    y_vocabulary = data.iterable_to_dict(data.PUNCTUATION_VOCABULARY)
+
+    rng = np.random.RandomState(0)
+    minibatches = [(rng.randint(0, vocabulary_size, size=(data.MAX_SEQUENCE_LEN, main.MINIBATCH_SIZE)).astype(np.int32),
+                    rng.randint(0, len(y_vocabulary), size=(data.MAX_SEQUENCE_LEN - 1, main.MINIBATCH_SIZE)).astype(np.int32))
+                   for _ in range(iterations)]
+    window = rng.randint(0, vocabulary_size, size=(INFERENCE_WINDOW_LEN, 1)).astype(np.int32)
+
+    results = []
+    costs = []
+
+    for name, hoisted in [("per step", False), ("hoisted", True)]:
+
+        print "Building the model with the %s input projections..." % name
+
+        t0 = time()
+        net, x, y, lr = build(hoisted, n_hidden, x_vocabulary, y_vocabulary, main.MINIBATCH_SIZE)
+        train_model = compile_training(net, x, y, lr)
+        inference_net, x_inference, _, _ = build(hoisted, n_hidden, x_vocabulary, y_vocabulary, 1)
+        predict = theano.function(inputs=[x_inference], outputs=inference_net.y)
+        compile_time = time() - t0
+
+        costs.append([train_model(minibatches[0][0], minibatches[0][1], 0.02)]) # warm up
+        t0 = time()
+        for X, Y in minibatches:
+            costs[-1].append(train_model(X, Y, 0.02))
+        training_sps = sum(np.prod(Y.shape) for _, Y in minibatches) / (time() - t0)
+
+        t0 = time()
+        for _ in range(iterations):
+            predict(window)
+        inference_wps = iterations * INFERENCE_WINDOW_LEN / (time() - t0)
+
+        results.append((name, compile_time, training_sps, inference_wps))
+
+    print ""
+    print "{:<10} {:>12} {:>14} {:>16}".format("LAYER", "COMPILE (s)", "TRAINING sps", "INFERENCE wps")
+    for name, compile_time, training_sps, inference_wps in results:
+        print "{:<10} {:>12.1f} {:>14.0f} {:>16.0f}".format(name, compile_time, training_sps, inference_wps)
+    print ""
+    print "Training speedup: %.2fx, inference speedup: %.2fx" % (results[1][2] / results[0][2], results[1][3] / results[0][3])
+    print "Max relative difference of the training costs: %g" % np.max(np.abs(np.array(costs[0]) - np.array(costs[1])) / np.array(costs[0]))
@@ -0,0 +1,255 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import os
+import json
+import codecs
+import shutil
+import tempfile
+import platform
+import resource
+import subprocess
+import hashlib
+
+import numpy as np
+
+from time import time
+
+"""
+Benchmarks the inference paths that decode speeches: punctuator.py, punctuator_filein.py and paragraph/paragrapher.py.
+Each path runs in its own process over a fixed corpus of speeches (a directory with one text file per speech, e.g. the
+punctuator_in.tmp files of denormalize.sh), so that the peak memory of one path doesn't include the others. Punctuation
+tokens and pause annotations in the corpus are ignored, so the same speeches work for both models.
+
+For each path it reports the model load and compile time, the words per second over the whole corpus, the per speech
+latency percentiles, the peak RSS and an md5 sum of the outputs, which changes when the output does. The results are
+written to a JSON file, and two result files, e.g. from two commits, can be compared with the compare command.
+punctuator.py and paragrapher.py use the engine set by INFERENCE_ENGINE, punctuator_filein.py always runs on Theano.
+
+e.g. INFERENCE_ENGINE=numpy python punctuator/benchmark_inference.py ~/data/benchmark_speeches $bundle/punctuation_model $bundle/paragraph_model results.json
+     python punctuator/benchmark_inference.py compare results_before.json results.json
+
+The paragraph model can be given as - to leave out paragrapher.py.
+"""
+
+PATHS = ["punctuator", "punctuator_filein", "paragrapher"]
+MODULE_DIRS = {"punctuator": "punctuator", "punctuator_filein": "punctuator", "paragrapher": "paragraph"}
+PERCENTILES = [50, 90, 99]
+
+S5_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def list_corpus(corpus_dir):
+    """Sorted paths of the non-empty speech files"""
+    return [os.path.join(corpus_dir, f) for f in sorted(os.listdir(corpus_dir))
+            if os.path.isfile(os.path.join(corpus_dir, f)) and os.path.getsize(os.path.join(corpus_dir, f)) > 0]
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kilobytes on Linux
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=S5_DIR, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_punctuator(model_file):
+    import punctuator
+
+    net, predict = punctuator.load_model(model_file, False)
+    reverse_punctuation_vocabulary = {v:k for k,v in net.y_vocabulary.items()}
+    max_subsequence_len = punctuator.get_max_subsequence_len(net)
+    overlap = punctuator.get_overlap(net)
+
+    def run(input_text, output_file):
+        text, _ = punctuator.split_input(input_text, net.y_vocabulary)
+        punctuator.restore(output_file, text, net.x_vocabulary, reverse_punctuation_vocabulary, predict, max_subsequence_len, overlap)
+        return len(text) - 1
+
+    return run
+
+def load_punctuator_filein(model_file):
+    import punctuator_filein
+    import models
+    import data
+    import theano
+    import theano.tensor as T
+
+    x = T.imatrix('x')
+
+    print "Loading model parameters..."
+    net, _ = models.load(model_file, 1, x)
+
+    print "Building model..."
+    predict = theano.function(inputs=[x], outputs=net.y)
+
+    reverse_punctuation_vocabulary = {v:k for k,v in net.y_vocabulary.items()}
+
+    def run(input_text, output_file):
+        text = [w for w in input_text.split() if w not in net.y_vocabulary and w not in data.PUNCTUATION_MAPPING and not w.startswith(data.PAUSE_PREFIX)] + [data.END]
+        punctuator_filein.restore(output_file, text, net.x_vocabulary, reverse_punctuation_vocabulary, predict)
+        return len(text) - 1
+
+    return run
+
+def load_paragrapher(model_file):
+    import paragrapher
+
+    net, predict = paragrapher.load_model(model_file, False)
+    reverse_punctuation_vocabulary = {v:k for k,v in net.y_vocabulary.items()}
+    max_subsequence_len = paragrapher.get_max_subsequence_len(net)
+
+    def run(input_text, output_file):
+        text, _ = paragrapher.split_input(input_text, net.y_vocabulary)
+        paragrapher.restore(output_file, text, net.x_vocabulary, reverse_punctuation_vocabulary, predict, max_subsequence_len)
+        return len(text) - 1
+
+    return run
+
+LOADERS = {"punctuator": load_punctuator, "punctuator_filein": load_punctuator_filein, "paragrapher": load_paragrapher}
+
+def run_path(path, model_file, corpus_dir):
+    """Runs one inference path over the corpus in this process and returns its results"""
+
+    # paragrapher.py imports the data module of its own directory
+    sys.path.insert(0, os.path.join(S5_DIR, MODULE_DIRS[path]))
+
+    t0 = time()
+    run = LOADERS[path](model_file)
+    load_time = time() - t0
+    load_rss = peak_rss_mb()
+
+    output_dir = tempfile.mkdtemp()
+    md5 = hashlib.md5()
+    words = []
+    latencies = []
+
+    try:
+        for i, speech_file in enumerate(list_corpus(corpus_dir)):
+
+            with codecs.open(speech_file, 'r', 'utf-8') as f:
+                input_text = f.read()
+
+            output_file = os.path.join(output_dir, "%d.txt" % i)
+
+            t0 = time()
+            words.append(run(input_text, output_file))
+            latencies.append(time() - t0)
+
+            with open(output_file, 'rb') as f:
+                md5.update(f.read())
+    finally:
+        shutil.rmtree(output_dir)
+
+    return {
+        "model": model_file,
+        "engine": "theano" if path == "punctuator_filein" else os.environ.get("INFERENCE_ENGINE", "theano"),
+        "load_time": load_time,
+        "words": sum(words),
+        "words_per_sec": sum(words) / sum(latencies),
+        "latency": dict(("p%d" % q, v) for q, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))),
+        "latency_max": max(latencies),
+        "load_rss_mb": load_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "output_md5": md5.hexdigest(),
+    }
+
+def print_results(results):
+    print "{:<18} {:>9} {:>10} {:>9} {:>9} {:>9} {:>13}".format("PATH", "LOAD (s)", "WORDS/s", "P50 (s)", "P90 (s)", "P99 (s)", "PEAK RSS (MB)")
+    for path in PATHS:
+        if path in results:
+            r = results[path]
+            print "{:<18} {:>9.2f} {:>10.0f} {:>9.3f} {:>9.3f} {:>9.3f} {:>13.0f}".format(path, r["load_time"], r["words_per_sec"],
+                r["latency"]["p50"], r["latency"]["p90"], r["latency"]["p99"], r["peak_rss_mb"])
+
+def compare(old, new):
+    """Prints the change of each measure from the old results to the new ones"""
+    print "%s -> %s" % (old["commit"], new["commit"])
+    if old["corpus_md5"] != new["corpus_md5"]:
+        print "WARNING: the results are from different corpora"
+    print "{:<18} {:>9} {:>10} {:>9} {:>9} {:>9} {:>13} {:>8}".format("PATH", "LOAD", "WORDS/s", "P50", "P90", "P99", "PEAK RSS", "OUTPUT")
+    for path in PATHS:
+        if path in old["results"] and path in new["results"]:
+            o, n = old["results"][path], new["results"][path]
+            change = lambda a, b: "%+.1f%%" % ((b / a - 1) * 100) if a else "-"
+            print "{:<18} {:>9} {:>10} {:>9} {:>9} {:>9} {:>13} {:>8}".format(path, change(o["load_time"], n["load_time"]),
+                change(o["words_per_sec"], n["words_per_sec"]), change(o["latency"]["p50"], n["latency"]["p50"]),
+                change(o["latency"]["p90"], n["latency"]["p90"]), change(o["latency"]["p99"], n["latency"]["p99"]),
+                change(o["peak_rss_mb"], n["peak_rss_mb"]), "same" if o["output_md5"] == n["output_md5"] else "CHANGED")
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) < 4:
+            sys.exit("Two result file path arguments missing")
+        with open(sys.argv[2]) as f_old, open(sys.argv[3]) as f_new:
+            compare(json.load(f_old), json.load(f_new))
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--path": # a benchmarked path in its own process
+        path, model_file, corpus_dir, results_file = sys.argv[2:6]
+        with open(results_file, 'w') as f:
+            json.dump(run_path(path, model_file, corpus_dir), f)
+        sys.exit(0)
+
+    if len(sys.argv) > 1:
+        corpus_dir = sys.argv[1]
+    else:
+        sys.exit("Corpus directory argument missing")
+
+    if len(sys.argv) > 2:
+        punctuation_model = sys.argv[2]
+    else:
+        sys.exit("Punctuation model path argument missing")
+
+    if len(sys.argv) > 3:
+        paragraph_model = sys.argv[3]
+    else:
+        sys.exit("Paragraph model path argument missing")
+
+    if len(sys.argv) > 4:
+        output_file = sys.argv[4]
+    else:
+        sys.exit("Output file path argument missing")
+
+    speech_files = list_corpus(corpus_dir)
+    if not speech_files:
+        sys.exit("No speeches in %s" % corpus_dir)
+
+    corpus_md5 = hashlib.md5()
+    for speech_file in speech_files:
+        with open(speech_file, 'rb') as f:
+            corpus_md5.update(f.read())
+
+    models = {"punctuator": punctuation_model, "punctuator_filein": punctuation_model}
+    if paragraph_model != "-":
+        models["paragrapher"] = paragraph_model
+
+    temp_dir = tempfile.mkdtemp()
+    results = {}
+
+    try:
+        for path in PATHS:
+            if path not in models:
+                continue
+            print "Benchmarking %s..." % path
+            path_results_file = os.path.join(temp_dir, path + ".json")
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), "--path", path, models[path], corpus_dir, path_results_file])
+            with open(path_results_file) as f:
+                results[path] = json.load(f)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    with open(output_file, 'w') as f:
+        json.dump({
+            "commit": git_commit(),
+            "host": platform.node(),
+            "corpus": os.path.abspath(corpus_dir),
+            "corpus_md5": corpus_md5.hexdigest(),
+            "speeches": len(speech_files),
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+
+    print ""
+    print_results(results)
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+import sys
+import socket
+import codecs
+
+"""
+Client for server.py. Reads the input text from stdin and writes the output to a file, like punctuator.py and
+paragraph/paragrapher.py do. Exits with an error if the server can't be reached or the request fails.
+
+e.g. cat text.txt | python punctuator/client.py /tmp/punctuator.sock punctuate punctuated.txt
+"""
+
+def request(socket_path, command, input_text):
+    """Sends input_text to the server and returns its output text. Raises RuntimeError if the request fails."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    client.sendall(command + "\n" + input_text.encode('utf-8'))
+    client.shutdown(socket.SHUT_WR)
+
+    response = client.makefile('rb')
+    status = response.readline().strip()
+    output_text = response.read()
+    client.close()
+
+    if status != "OK":
+        raise RuntimeError("Request failed: %s" % status)
+
+    return output_text.decode('utf-8')
+
+def commands(socket_path):
+    """The commands of the server, i.e. the models and FSTs that it has loaded"""
+    return request(socket_path, "commands", u"").split()
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        socket_path = sys.argv[1]
+    else:
+        sys.exit("Socket path argument missing")
+
+    if len(sys.argv) > 2:
+        command = sys.argv[2]
+    else:
+        sys.exit("Command argument (punctuate, paragraph, abbreviate or insert_periods) missing")
+
+    if len(sys.argv) > 3:
+        output_file = sys.argv[3]
+    else:
+        sys.exit("Output file path argument missing")
+
+    input_text = codecs.getreader('utf-8')(sys.stdin).read()
+
+    if len(input_text) == 0:
+        sys.exit("Input text from stdin missing.")
+
+    try:
+        output_text = request(socket_path, command, input_text)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    with codecs.open(output_file, 'w', 'utf-8') as f_out:
+        f_out.write(output_text)
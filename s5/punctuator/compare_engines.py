@@ -0,0 +1,97 @@
+# coding: utf-8
+from __future__ import division
+
+import models
+import numpy_models
+import data
+
+import theano
+import sys
+import codecs
+
+import theano.tensor as T
+import numpy as np
+
+from time import time
+from punctuator import MAX_SUBSEQUENCE_LEN, to_array
+
+TOLERANCE = 1e-4
+
+"""
+Checks that the numpy inference engine gives the same outputs as the Theano model.
+Runs both over consecutive MAX_SUBSEQUENCE_LEN token windows of a text file and reports the largest absolute difference in
+output probabilities and the number of differing argmax decisions. Works for punctuation and paragraph models, and for
+joint punctuation and paragraph models, whose paragraph break outputs are compared too.
+"""
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        input_file = sys.argv[2]
+    else:
+        sys.exit("Input file path argument missing")
+
+    use_pauses = len(sys.argv) > 3 and bool(int(sys.argv[3]))
+
+    t0 = time()
+    np_net = numpy_models.load(model_file)
+    print "numpy engine loaded in %.2f sec" % (time() - t0)
+
+    t0 = time()
+    x = T.imatrix('x')
+    p = T.matrix('p') if use_pauses else None
+    net, _ = models.load(model_file, 1, x, p)
+    joint = isinstance(net, models.GRUjoint)
+    outputs = [net.y, net.y_paragraph] if joint else [net.y]
+    predict = theano.function(inputs=[v for v in [x, p] if v is not None], outputs=outputs, allow_input_downcast=True)
+    print "Theano model loaded and compiled in %.2f sec" % (time() - t0)
+
+    with codecs.open(input_file, 'r', 'utf-8') as f:
+        input_text = f.read()
+
+    word_vocabulary = net.x_vocabulary
+    text = [w for w in input_text.split() if w not in net.y_vocabulary and not w.startswith(data.PAUSE_PREFIX)] + [data.END]
+    pauses = [float(s.replace(data.PAUSE_PREFIX,"").replace(">","")) for s in input_text.split() if s.startswith(data.PAUSE_PREFIX)] or [0.0 for _ in range(len(text)-1)]
+
+    output_names = ["Punctuation", "Paragraph"] if joint else [None]
+    max_diff = [0.] * len(outputs)
+    num_decisions = [0] * len(outputs)
+    num_different = [0] * len(outputs)
+    theano_time = 0.
+    numpy_time = 0.
+
+    for i in range(0, len(text) - 1, MAX_SUBSEQUENCE_LEN):
+
+        X = to_array([word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in text[i:i+MAX_SUBSEQUENCE_LEN]])
+        P = to_array(pauses[i:i+MAX_SUBSEQUENCE_LEN], dtype=np.float64) if use_pauses else None
+
+        t0 = time()
+        y = predict(X, P) if use_pauses else predict(X)
+        theano_time += time() - t0
+
+        t0 = time()
+        np_y = np_net.predict(X, P)
+        numpy_time += time() - t0
+
+        if not joint: # GRUjoint.predict returns the punctuation and paragraph outputs
+            np_y = [np_y]
+
+        for k in range(len(outputs)):
+            max_diff[k] = max(max_diff[k], np.abs(y[k] - np_y[k]).max())
+            num_decisions[k] += y[k].shape[0]
+            num_different[k] += (y[k].argmax(axis=-1) != np_y[k].argmax(axis=-1)).sum()
+
+    print "Theano: %.2f sec, numpy: %.2f sec" % (theano_time, numpy_time)
+    for k, name in enumerate(output_names):
+        if name:
+            print "%s outputs:" % name
+        print "Max absolute difference: %g" % max_diff[k]
+        print "Different decisions: %d out of %d" % (num_different[k], num_decisions[k])
+
+    if max(max_diff) > TOLERANCE:
+        sys.exit("Outputs differ by more than %g" % TOLERANCE)
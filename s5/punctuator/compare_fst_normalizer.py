@@ -0,0 +1,73 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import os
+import shutil
+import tempfile
+
+import fst_normalizer
+
+from fst_normalizer import SPACE_SYMBOL, FstNormalizer
+
+ALPHABET = u"abcdeéxyð_ " # the input symbols of the test FST, other characters can't be rewritten
+
+# Input lines and their output with the test FST, which rewrites "a" to "b", deletes "_" and keeps the other characters of
+# ALPHABET. A line with other characters isn't rewritten and gives an empty line.
+GOLDEN_CASES = [
+    (u"abc dé", u"bbc dé"),
+    (u"x_y ð", u"xy ð"),
+    (u"", u""),
+    (u"a#b", u""),
+    (u"ea", u"eb"),
+]
+
+"""
+Checks that FstNormalizer gives the output of the Kaldi tools with the OpenFst Python extension (pywrapfst): a test FST is
+written to a temporary directory, read by FstNormalizer and applied to the golden cases in one batch, so that the output
+lines have to stay aligned with the input lines. The check is skipped when pywrapfst isn't installed.
+
+e.g. python punctuator/compare_fst_normalizer.py
+"""
+
+def write_test_fst(fst_file):
+    """Writes the FST of GOLDEN_CASES, a one state transducer of the code points of ALPHABET, and returns its symbols"""
+    pywrapfst = fst_normalizer.pywrapfst
+    fst = getattr(pywrapfst, "VectorFst", pywrapfst.Fst)()
+    state = fst.add_state()
+    fst.set_start(state)
+    fst.set_final(state)
+    rewrites = {u"a": ord(u"b"), u"_": 0}
+    for c in ALPHABET:
+        fst.add_arc(state, pywrapfst.Arc(ord(c), rewrites.get(c, ord(c)), None, state))
+    fst.write(fst_file)
+    return {ord(c): SPACE_SYMBOL if c == u" " else c for c in ALPHABET}
+
+if __name__ == "__main__":
+
+    if fst_normalizer.pywrapfst is None:
+        print("pywrapfst isn't installed, skipping")
+        sys.exit(0)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        fst_file = os.path.join(temp_dir, "test.fst")
+        normalize = FstNormalizer(fst_file, write_test_fst(fst_file))
+        outputs = normalize([input_line for input_line, _ in GOLDEN_CASES])
+    finally:
+        shutil.rmtree(temp_dir)
+
+    num_failed = 0
+    for (input_line, expected), output_line in zip(GOLDEN_CASES, outputs):
+        if output_line != expected:
+            num_failed += 1
+            print((u"Golden case differs:\n  input:    %s\n  expected: %s\n  output:   %s" % (input_line, expected, output_line)).encode('utf-8'))
+
+    if len(outputs) != len(GOLDEN_CASES):
+        num_failed += 1
+        print("%d output lines for %d input lines" % (len(outputs), len(GOLDEN_CASES)))
+
+    print("%d of %d golden cases differ" % (num_failed, len(GOLDEN_CASES)))
+
+    if num_failed > 0:
+        sys.exit("%d differences" % num_failed)
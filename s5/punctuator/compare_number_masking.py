@@ -0,0 +1,107 @@
+# coding: utf-8
+from __future__ import division
+
+import data
+
+import sys
+import os
+import codecs
+import shutil
+import tempfile
+import subprocess
+
+from server import Restorer
+from punctuator import is_number
+from denormalize import EOP_TOKENS
+
+"""
+Checks that punctuator.py, which masks the numbers of the input for the model itself, gives the same output as the
+numbers taken out with local/saving_numbers.py before punctuation and put back with local/re-inserting-numbers.py after it,
+as local/recognize/denormalize.sh did. Both models with NUM in their vocabulary and models without it (for which NUM is
+UNK) have to give the same output.
+
+The paragraph model, which sees the numbers as they are, is also checked if it's given (or "-" for none): its Restorer
+in server.py and denormalize.py has to give the same output as paragraph/paragrapher.py for the same input.
+
+e.g. python punctuator/compare_number_masking.py ~/models/latest/punctuation_model ~/models/latest/paragraph_model output/*/intermediate/thrax_out.tmp
+"""
+
+PARAGRAPHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "paragraph", "paragrapher.py")
+
+def save_numbers(text):
+    """The text with the numbers replaced by NUM and the numbers, as local/saving_numbers.py"""
+    masked_lines = []
+    numbers = []
+    for line in text.splitlines():
+        tokens = line.split()
+        numbers.extend(token for token in tokens if is_number(token))
+        masked_lines.append(" ".join(data.NUM if is_number(token) else token for token in tokens) + " \n")
+    return "".join(masked_lines), numbers
+
+def reinsert_numbers(text, numbers):
+    """The tokens of the punctuated text with the NUM tokens replaced by the numbers in order, as local/re-inserting-numbers.py"""
+    tokens = text.split()
+    for i, index in enumerate([i for i, token in enumerate(tokens) if token == data.NUM]):
+        tokens[index] = numbers[i]
+    return tokens
+
+def run_paragrapher(model_file, input_text):
+    """The output of paragraph/paragrapher.py for the input text"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        output_file = os.path.join(temp_dir, "paragraphed.txt")
+        process = subprocess.Popen([sys.executable, PARAGRAPHER, model_file, output_file], stdin=subprocess.PIPE)
+        process.communicate(input_text.encode('utf-8'))
+        if process.returncode != 0:
+            raise RuntimeError("paragrapher.py exited with code %d" % process.returncode)
+        with codecs.open(output_file, 'r', 'utf-8') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        paragraph_model_file = sys.argv[2] if sys.argv[2] != "-" else None
+    else:
+        sys.exit("Paragraph model file path argument missing")
+
+    input_files = sys.argv[3:]
+    if len(input_files) == 0:
+        sys.exit("Input file path arguments missing")
+
+    restore = Restorer(model_file, data.EOS_TOKENS, data.PUNCTUATION_MAPPING, mask_numbers=True)
+    print "%s in the vocabulary of the model: %s" % (data.NUM, data.NUM in restore.word_vocabulary)
+
+    paragraph = Restorer(paragraph_model_file, EOP_TOKENS, {}) if paragraph_model_file else None
+
+    num_failed = 0
+    for input_file in input_files:
+
+        with codecs.open(input_file, 'r', 'utf-8') as f:
+            input_text = f.read()
+
+        masked_text, numbers = save_numbers(input_text)
+        expected = reinsert_numbers(restore(masked_text), numbers)
+        output = restore(input_text).split()
+
+        if output != expected:
+            num_failed += 1
+            print "%s: the output differs from the numbers saved and re-inserted" % input_file
+        else:
+            print "%s: %d tokens, %d numbers, same output" % (input_file, len(output), len(numbers))
+
+        if paragraph is not None:
+            if paragraph(input_text).split() != run_paragrapher(paragraph_model_file, input_text).split():
+                num_failed += 1
+                print "%s: the paragraph output differs from paragrapher.py" % input_file
+            else:
+                print "%s: same paragraph output as paragrapher.py" % input_file
+
+    if num_failed > 0:
+        sys.exit("%d differences" % num_failed)
@@ -0,0 +1,156 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import codecs
+import subprocess
+
+from time import time
+from rewrite_rules import RewriteRules, RULE_GROUPS, REPETITION, remove_repetitions
+
+# The sed -re expressions that local/recognize/denormalize.sh applied, in the same order as RULE_GROUPS.
+# A change to the rules has to be made here too.
+SED_EXPRESSIONS = [
+    ur's:([Hh]æstv)irt[^ ]*\b:\1\.:g',
+    ur's:([Hh])áttv[^ ]+ (þingm[^ ]+):\1v\. \2:g',
+    ur's:([Hh]v\. ([0-9]+\. )?)þingm[^ .?:eö]+ ([A-ZÁÐÉÍÓÚÝÞÆÖ]):\1þm. \3:g',
+    ur's:([0-9]+\.) þingm[^ .?:eö]+ ([A-ZÁÐÉÍÓÚÝÞÆÖ]):\1 þm. \2:g',
+    ur's: ([0-9]{3})([0-9])–([0-9])\b: \1\2–\1\3:g',
+    ur's: ([0-9]{2})([0-9]{2})–([0-9]{2})\b: \1\2–\1\3:g',
+    ur's:\b(að|í|á|til|það|er|við) \1\b:\1 \1 \1:g',
+    ur's:(\b.+),? \1\b:\1:g',
+    ur's:([0-9]{2,})([0-9]{3})\b:\1.\2:g',
+    ur's:([0-9]+)([0-9]{3}\.[0-9]{3})\b:\1.\2:g',
+    ur's:([3-9])([0-9]{3})\b:\1.\2:g',
+    ur's:([Hh]v\. þm\. [A-ZÁÐÉÍÓÚÝÞÆÖ][a-záðéíóúýþæö]+ ([A-ZÁÐÉÍÓÚÝÞÆÖ][a-záðéíóúýþæö]*\.? )?[A-ZÁÐÉÍÓÚÝÞÆÖ][a-záðéíóúýþæö]+),:\1:g',
+    ur's:(([a-záðéíóúýþæö]+- og )?[a-záðéíóúýþæö]+nefnd),? háttvirtri:hv. \1:g',
+    ur's:<[^>]*unk[^>]*>:[unknown]:g',
+    ur's:,\.:.:g',
+]
+
+# Input lines and the output of the sed chain for them (GNU sed 4.9 in a UTF-8 locale)
+GOLDEN_CASES = [
+    (u"Ég þakka hæstvirtum ráðherra fyrir svarið og hæstvirtur forseti veit það.",
+     u"Ég þakka hæstv. ráðherra fyrir svarið og hæstv. forseti veit það."),
+    (u"Háttvirtur þingmaður Jón Gunnarsson sagði að háttvirtur þingmaður hefði rangt fyrir sér.",
+     u"Hv. þm. Jón Gunnarsson sagði að hv. þingmaður hefði rangt fyrir sér."),
+    (u"Ég vil spyrja hv. þingmann Guðmund Andra Thorsson, og hv. 5. þingmaður Suðurkjördæmis svaraði.",
+     u"Ég vil spyrja hv. þm. Guðmund Andra Thorsson og hv. 5. þm. Suðurkjördæmis svaraði."),
+    (u"Þetta sagði 3. þingmaður Norðausturkjördæmis í gær.",
+     u"Þetta sagði 3. þm. Norðausturkjördæmis í gær."),
+    (u"Á árunum 2014–17 og 1994–6 jukust útgjöldin, en ekki 2014–2017.",
+     u"Á árunum 2014–2017 og 1994–1996 jukust útgjöldin, en ekki 2014–2017."),
+    (u"Ég held að að við eigum ekki að í í þessu máli.",
+     u"Ég held að að við eigum ekki að í í þessu máli."),
+    (u"Við þurfum að ræða þetta, ræða þetta betur og betur og betur.",
+     u"Við þurfum að ræða þetta betur og betur."),
+    (u"Það er er gott að vera hér hér í dag, í dag.",
+     u"Það er er gott að vera hér í dag."),
+    (u"Kostnaðurinn var 1500000 krónur og 25000 manns komu, 4000 í fyrra en 2000 árið áður.",
+     u"Kostnaðurinn var 1.500.000 krónur og 25.000 manns komu, 4.000 í fyrra en 2000 árið áður."),
+    (u"Upphæðin nam 1234567890 krónum árið 2019.",
+     u"Upphæðin nam 1234.567.890 krónum árið 2019."),
+    (u"Hv. þm. Jón Gunnarsson, sagði þetta og hv. þm. Bjarkey Olsen Gunnarsdóttir, líka.",
+     u"Hv. þm. Jón Gunnarsson sagði þetta og hv. þm. Bjarkey Olsen Gunnarsdóttir líka."),
+    (u"Ég vísa málinu til umhverfis- og samgöngunefndar háttvirtri og velferðarnefnd, háttvirtri.",
+     u"Ég vísa málinu til umhverfis- og samgöngunefndar háttvirtri og hv. velferðarnefnd."),
+    (u"Hann sagði <unk> og <UNK> og <fimmunk> við þetta.",
+     u"Hann sagði [unknown] og <UNK> og [unknown] við þetta."),
+    (u"Já,. Nei, þetta er svona,.",
+     u"Já. Nei, þetta er svona."),
+    (u"forseti forseti, forseti herra forseti.",
+     u"forseti, forseti herra forseti."),
+    (u"1. 1. 2. 2 2 100 100 1000 1000.",
+     u"1. 1. 2. 2 100 1000."),
+    (u"abc abcd abc_ abc abc.",
+     u"abc abcd abc_ abc."),
+]
+
+# Lengths in words of the synthetic speeches that remove_repetitions is timed on, and the largest ratio of their times
+# that is accepted. The time has to grow linearly, also when a token repeats all through the speech.
+SCALING_WORDS = [20000, 80000]
+MAX_SCALING_RATIO = 8. # 4 for linear time, with some allowance for timing noise
+
+"""
+Checks the rules of rewrite_rules.py against the sed chain that they replaced, and measures their speed on long texts,
+e.g. the hv_abbreviated.tmp input files (punctuator_out_wPeriods.tmp) in the intermediate directories of whole speeches.
+
+The golden cases are checked first, and that the time of removing the repetitions grows linearly with the length of a
+speech in which some words repeat all the time (as "og" and "að" do). Then each given file is rewritten by sed, by the rules applied one after another as
+plain regular expressions, and by RewriteRules, and the outputs are compared. sed has to run in a UTF-8 locale.
+
+e.g. python punctuator/compare_rewrite_rules.py output/*/intermediate/punctuator_out_wPeriods.tmp
+"""
+
+def synthetic_speech(num_words):
+    """A speech with a frequent word as every other word and no repetitions"""
+    return u" ".join(u"og" if i % 2 == 0 else u"orð%d" % i for i in range(num_words)) + u"."
+
+def run_sed(input_file):
+    command = ["sed", "-r"]
+    for expression in SED_EXPRESSIONS:
+        command.extend(["-e", expression.encode('utf-8')])
+    return subprocess.check_output(command + [input_file]).decode('utf-8')
+
+if __name__ == "__main__":
+
+    rewrite = RewriteRules()
+
+    # the rules without the groups, and the repetitions removed by the regular expression
+    rewrite_sequentially = RewriteRules([([], [(REPETITION.pattern, ur"\1") if callable(rule) else (rule, replacement)
+                                               for _, rules in RULE_GROUPS for rule, replacement in rules])])
+
+    num_failed = 0
+    for input_text, expected in GOLDEN_CASES:
+        output_text = rewrite(input_text)
+        if output_text != expected:
+            num_failed += 1
+            print (u"Golden case differs:\n  input:    %s\n  expected: %s\n  output:   %s" % (input_text, expected, output_text)).encode('utf-8')
+
+    print "%d of %d golden cases differ" % (num_failed, len(GOLDEN_CASES))
+
+    scaling_times = []
+    for num_words in SCALING_WORDS:
+        input_text = synthetic_speech(num_words)
+        t0 = time()
+        output_text = remove_repetitions(input_text)
+        scaling_times.append(time() - t0)
+        if output_text != input_text:
+            num_failed += 1
+            print "Repetitions removed from the synthetic speech of %d words" % num_words
+        print "remove_repetitions: %d words in %.3f sec" % (num_words, scaling_times[-1])
+
+    ratio = scaling_times[-1] / max(scaling_times[0], 1e-3)
+    if ratio > MAX_SCALING_RATIO:
+        num_failed += 1
+        print "remove_repetitions took %.1f times longer for %d times the words" % (ratio, SCALING_WORDS[-1] // SCALING_WORDS[0])
+
+    total_chars = 0
+    total_times = [0., 0., 0.]
+
+    for input_file in sys.argv[1:]:
+
+        with codecs.open(input_file, 'r', 'utf-8') as f:
+            input_text = f.read()
+
+        times = []
+        outputs = []
+        for function in [run_sed, rewrite_sequentially, rewrite]:
+            t0 = time()
+            outputs.append(function(input_file if function is run_sed else input_text))
+            times.append(time() - t0)
+
+        if outputs[1] != outputs[0] or outputs[2] != outputs[0]:
+            num_failed += 1
+            print "%s: the outputs differ from sed" % input_file
+
+        print "%s: %d chars, sed: %.3f sec, regular expressions: %.3f sec, RewriteRules: %.3f sec" % ((input_file, len(input_text)) + tuple(times))
+
+        total_chars += len(input_text)
+        total_times = [total + t for total, t in zip(total_times, times)]
+
+    if len(sys.argv) > 2:
+        print "Total: %d chars, sed: %.3f sec, regular expressions: %.3f sec, RewriteRules: %.3f sec" % ((total_chars,) + tuple(total_times))
+
+    if num_failed > 0:
+        sys.exit("%d differences" % num_failed)
@@ -1,6 +1,32 @@
 import sys
 import codecs
-from data import EOS_TOKENS, PUNCTUATION_VOCABULARY
+from data import EOS_TOKENS, EOP, PUNCTUATION_VOCABULARY
+
+def convert(tokens, with_newlines=False):
+    """Returns the text of the punctuator.py output tokens with the punctuation tokens as marks and the sentences capitalized"""
+    output = []
+    last_was_eos = True
+    first = True
+    for token in tokens:
+        if token == EOP: # paragraph breaks of a joint model are kept for paragraph/convert_to_readable.py
+            output.append(('' if first else ' ') + token)
+            first = False
+            continue
+        if token in PUNCTUATION_VOCABULARY:
+            output.append(token[:1])
+        else:
+            if token.isupper():
+                output.append(('' if first else ' ') + token)
+            else:
+                output.append(('' if first else ' ') + (token.title() if last_was_eos else token))
+
+        last_was_eos = token in EOS_TOKENS
+        if with_newlines and last_was_eos:
+            output.append('\n')
+            first = True
+        else:
+            first = False
+    return ''.join(output)
 
 if __name__ == "__main__":
 
@@ -17,20 +43,4 @@ if __name__ == "__main__":
     with_newlines = len(sys.argv) > 3 and bool(int(sys.argv[3]))
 
     with codecs.open(input_file, 'r', 'utf-8') as in_f, codecs.open(output_file, 'w', 'utf-8') as out_f:
-        last_was_eos = True
-        first = True
-        for token in in_f.read().split():
-            if token in PUNCTUATION_VOCABULARY:
-                out_f.write(token[:1])
-            else:
-                if token.isupper():
-                    out_f.write(('' if first else ' ') + token)
-                else:
-                    out_f.write(('' if first else ' ') + (token.title() if last_was_eos else token))
-
-            last_was_eos = token in EOS_TOKENS
-            if with_newlines and last_was_eos:
-                out_f.write('\n')
-                first = True
-            else:
-                first = False
+        out_f.write(convert(in_f.read().split(), with_newlines))
@@ -9,6 +9,13 @@ import cPickle
 import codecs
 import fnmatch
 import shutil
+import hashlib
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import profiling
 
 #DATA_PATH = "../data"
 DATA_PATH = "punctuator/processed_data"
@@ -21,6 +28,7 @@ PRETRAINED_EMBEDDINGS_PATH = None
 
 END = "</S>"
 UNK = "<UNK>"
+NUM = "<NUM>" # numbers in the training data and the model input, see local/preprocessing_trainingdata.py and punctuator.replace_numbers
 
 SPACE = "_SPACE"
 
@@ -46,28 +54,105 @@ PUNCTUATION_VOCABULARY = [SPACE, ",COMMA", ".PERIOD", "?QUESTIONMARK"]
 PUNCTUATION_MAPPING = {";SEMICOLON": ".PERIOD", "!EXCLAMATIONMARK": ".PERIOD", ":COLON": ",COMMA", "-DASH": ",COMMA"}
 
 EOS_TOKENS = {".PERIOD", "?QUESTIONMARK"}
+EOP = "EOP" # paragraph break, for the joint punctuation and paragraph model (models.GRUjoint). Follows the punctuation of the gap.
+PARAGRAPH_VOCABULARY = [SPACE, EOP]
 CRAP_TOKENS = {"<doc>", "<doc.>"} # punctuations that are not included in vocabulary nor mapping, must be added to CRAP_TOKENS
 PAUSE_PREFIX = "<sil="
 
+NUM_WORKERS = multiprocessing.cpu_count() # processes for counting words and converting input files
+MAX_SYNC_SUBSEQUENCES = 1000 # how far into a file to look for the point where the parallel conversion catches up
+
+# A processed dataset is stored in flat binary files next to the given path, so that it can be read through numpy.memmap
+# without parsing and without holding it in RAM:
+# <path>.words - int32 word ids of all subsequences
+# <path>.punctuations - int32 punctuation ids of all subsequences (one less per subsequence than words)
+# <path>.pauses - float32 pause durations aligned with punctuations
+# <path>.paragraphs - int8 paragraph break labels (ids in PARAGRAPH_VOCABULARY) aligned with punctuations
+# <path>.offsets - int64 start of each subsequence in <path>.words, followed by the total number of words
+WORDS_SUFFIX = ".words"
+PUNCTUATIONS_SUFFIX = ".punctuations"
+PAUSES_SUFFIX = ".pauses"
+PARAGRAPHS_SUFFIX = ".paragraphs"
+OFFSETS_SUFFIX = ".offsets"
+SIGNATURE_SUFFIX = ".inputs" # what the processed file was built from, see dataset_signature
+
+class Dataset(object):
+    """Subsequences [words, punctuations, pauses, paragraphs] of a processed dataset, read lazily from disk"""
+
+    def __init__(self, path):
+        self.offsets = open_memmap(path + OFFSETS_SUFFIX, np.int64)
+        self.words = open_memmap(path + WORDS_SUFFIX, np.int32)
+        self.punctuations = open_memmap(path + PUNCTUATIONS_SUFFIX, np.int32)
+        self.pauses = open_memmap(path + PAUSES_SUFFIX, np.float32)
+        # datasets converted before paragraph labels were added have none
+        self.paragraphs = open_memmap(path + PARAGRAPHS_SUFFIX, np.int8) if os.path.exists(path + PARAGRAPHS_SUFFIX) else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i+1]
+        # punctuation and pause sequences are one shorter than word sequences, so the i-th starts i positions earlier
+        paragraphs = self.paragraphs[start-i:end-i-1] if self.paragraphs is not None else np.zeros(end-start-1, dtype=np.int8)
+        return [self.words[start:end], self.punctuations[start-i:end-i-1], self.pauses[start-i:end-i-1], paragraphs]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+def open_memmap(path, dtype):
+    if os.path.getsize(path) == 0: # empty files can't be mapped
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
 # replacement for pickling that takes less RAM. Useful for large datasets.
 def dump(d, path):
-    with open(path, 'w') as f:
-        for s in d:
-            f.write("%s\n" % repr(s))
+    offsets = [0]
+    with open(path + WORDS_SUFFIX, 'wb') as f_words, open(path + PUNCTUATIONS_SUFFIX, 'wb') as f_punctuations, \
+            open(path + PAUSES_SUFFIX, 'wb') as f_pauses, open(path + PARAGRAPHS_SUFFIX, 'wb') as f_paragraphs:
+        for words, punctuations, pauses, paragraphs in d:
+            np.asarray(words, dtype=np.int32).tofile(f_words)
+            np.asarray(punctuations, dtype=np.int32).tofile(f_punctuations)
+            np.asarray(pauses, dtype=np.float32).tofile(f_pauses)
+            np.asarray(paragraphs, dtype=np.int8).tofile(f_paragraphs)
+            offsets.append(offsets[-1] + len(words))
+    np.asarray(offsets, dtype=np.int64).tofile(path + OFFSETS_SUFFIX)
 
 def load(path):
+    if os.path.exists(path + OFFSETS_SUFFIX):
+        return Dataset(path)
+    # datasets written by older versions, one repr() of a subsequence per line
     d = []
     with open(path, 'r') as f:
         for l in f:
             d.append(eval(l))
     return d
 
-def add_counts(word_counts, line):
+def add_counts(word_counts, line, new_words=None):
     for w in line.split():
-        if w in CRAP_TOKENS or w in PUNCTUATION_VOCABULARY or w in PUNCTUATION_MAPPING or w.startswith(PAUSE_PREFIX):
+        if w in CRAP_TOKENS or w in PUNCTUATION_VOCABULARY or w in PUNCTUATION_MAPPING or w == EOP or w.startswith(PAUSE_PREFIX):
             continue
+        if new_words is not None and w not in word_counts:
+            new_words.append(w)
         word_counts[w] = word_counts.get(w, 0) + 1
 
+def count_words(input_file):
+    """
+    Word counts of a file as (word, count) pairs in the order of first occurrence.
+    Merging them file by file with merge_counts inserts the words in the same order as counting the files one after another,
+    which matters because build_vocabulary keeps the dict order among words with equal counts.
+    """
+    word_counts = dict()
+    new_words = []
+    with codecs.open(input_file, 'r', 'utf-8') as text:
+        for line in text:
+            add_counts(word_counts, line, new_words)
+    return [(w, word_counts[w]) for w in new_words]
+
+def merge_counts(word_counts, counts):
+    for w, c in counts:
+        word_counts[w] = word_counts.get(w, 0) + c
+
 def build_vocabulary(word_counts):
     return [wc[0] for wc in reversed(sorted(word_counts.items(), key=operator.itemgetter(1))) if wc[1] >= MIN_WORD_COUNT_IN_VOCAB and wc[0] != UNK][:MAX_WORD_VOCABULARY_SIZE] # Unk will be appended to end
 
@@ -89,126 +174,269 @@ def read_vocabulary(file_name):
     with codecs.open(file_name, 'r', 'utf-8') as f:
         return iterable_to_dict(f.readlines())
 
-def write_processed_dataset(input_files, output_file):
+def read_tokens(input_file):
+    with codecs.open(input_file, 'r', 'utf-8') as text:
+        for line in text:
+            for token in line.split():
+                yield token
+
+# words, punctuations, pauses, paragraphs, last_eos_idx (if it's still 0 when MAX_SEQUENCE_LEN is reached, then the sentence is too long and skipped),
+# last_token_was_punctuation (skip first token if it's punctuation), last_pause,
+# skip_until_eos (if a sentence does not fit into subsequence, then we need to skip tokens until we find a new sentence),
+# paragraph_pending (EOP came before the punctuation of the gap was known)
+INITIAL_BUILDER_STATE = ((), (), (), (), 0, True, 0.0, False, False)
+
+class SubsequenceBuilder(object):
     """
-    data will consist of two sets of aligned subsequences (words and punctuations) of MAX_SEQUENCE_LEN tokens (actually punctuation sequence will be 1 element shorter).
+    Cuts a token stream into aligned subsequences (words and punctuations) of MAX_SEQUENCE_LEN tokens (actually punctuation sequence will be 1 element shorter).
     If a sentence is cut, then it will be added to next subsequence entirely (words before the cut belong to both sequences)
+    EOP tokens mark a paragraph break in the gap they are in, they are labeled separately from the punctuations (all 0 if there are none).
     """
 
-    data = []
+    def __init__(self, word_vocabulary, punctuation_vocabulary):
+        self.word_vocabulary = word_vocabulary
+        self.punctuation_vocabulary = punctuation_vocabulary
 
-    word_vocabulary = read_vocabulary(WORD_VOCAB_FILE)
-    punctuation_vocabulary = iterable_to_dict(PUNCTUATION_VOCABULARY)
+        self.subsequences = []
 
-    num_total = 0
-    num_unks = 0
+        self.num_total = 0
+        self.num_unks = 0
 
-    current_words = []
-    current_punctuations = []
-    current_pauses = []
+        self.set_state(INITIAL_BUILDER_STATE)
 
-    last_eos_idx = 0 # if it's still 0 when MAX_SEQUENCE_LEN is reached, then the sentence is too long and skipped.
-    last_token_was_punctuation = True # skipt first token if it's punctuation
-    last_pause = 0.0
+    def get_state(self):
+        return (tuple(self.current_words), tuple(self.current_punctuations), tuple(self.current_pauses), tuple(self.current_paragraphs),
+                self.last_eos_idx, self.last_token_was_punctuation, self.last_pause, self.skip_until_eos, self.paragraph_pending)
 
-    skip_until_eos = False # if a sentence does not fit into subsequence, then we need to skip tokens until we find a new sentence
+    def set_state(self, state):
+        (current_words, current_punctuations, current_pauses, current_paragraphs,
+         self.last_eos_idx, self.last_token_was_punctuation, self.last_pause, self.skip_until_eos, self.paragraph_pending) = state
+        self.current_words = list(current_words)
+        self.current_punctuations = list(current_punctuations)
+        self.current_pauses = list(current_pauses)
+        self.current_paragraphs = list(current_paragraphs)
 
-    for input_file in input_files:
+    def add_punctuation(self, punctuation):
+        self.current_punctuations.append(punctuation)
+        self.current_paragraphs.append(int(self.paragraph_pending))
+        self.paragraph_pending = False
+
+    def add(self, token):
+        """Returns True if the token completed a subsequence or a sentence that was too long was dropped"""
+
+        # First map oov punctuations to known punctuations
+        if token in PUNCTUATION_MAPPING:
+            token = PUNCTUATION_MAPPING[token]
+
+        if self.skip_until_eos:
+
+            if token in EOS_TOKENS:
+                self.skip_until_eos = False
+
+            return False
+
+        elif token in CRAP_TOKENS:
+            return False
+
+        elif token.startswith(PAUSE_PREFIX):
+            self.last_pause = float(token.replace(PAUSE_PREFIX,"").replace(">",""))
+
+        elif token == EOP:
+
+            if len(self.current_punctuations) == len(self.current_words) and self.current_paragraphs: # the gap after the last word has its punctuation already
+                self.current_paragraphs[-1] = 1
+            elif self.current_words: # there's no gap before the first word of a subsequence
+                self.paragraph_pending = True
+
+            return False
+
+        elif token in self.punctuation_vocabulary:
+
+            if self.last_token_was_punctuation: # if we encounter sequences like: "... !EXLAMATIONMARK .PERIOD ...", then we only use the first punctuation and skip the ones that follow
+                return False
+
+            if token in EOS_TOKENS:
+                self.last_eos_idx = len(self.current_punctuations) # no -1, because the token is not added yet
+
+            self.add_punctuation(self.punctuation_vocabulary[token])
+            self.last_token_was_punctuation = True
+
+        else:
+
+            if not self.last_token_was_punctuation:
+                self.add_punctuation(self.punctuation_vocabulary[SPACE])
 
-        with codecs.open(input_file, 'r', 'utf-8') as text:
+            word = self.word_vocabulary.get(token, self.word_vocabulary[UNK])
 
-            for line in text:
+            self.current_words.append(word)
+            self.current_pauses.append(self.last_pause)
+            self.last_token_was_punctuation = False
 
-                for token in line.split():
+            self.num_total += 1
+            self.num_unks += int(word == self.word_vocabulary[UNK])
 
-                    # First map oov punctuations to known punctuations
-                    if token in PUNCTUATION_MAPPING:
-                        token = PUNCTUATION_MAPPING[token]
+        if len(self.current_words) < MAX_SEQUENCE_LEN:
+            return False
 
-                    if skip_until_eos:
+        # this also means, that last token was a word
+        assert len(self.current_words) == len(self.current_punctuations) + 1, "#words: %d; #punctuations: %d" % (len(self.current_words), len(self.current_punctuations))
+        assert self.current_pauses == [] or len(self.current_words) == len(self.current_pauses), "#words: %d; #pauses: %d" % (len(self.current_words), len(self.current_pauses))
 
-                        if token in EOS_TOKENS:
-                            skip_until_eos = False
+        # Sentence did not fit into subsequence - skip it
+        if self.last_eos_idx == 0:
+            self.skip_until_eos = True
 
-                        continue
+            self.current_words = []
+            self.current_punctuations = []
+            self.current_pauses = []
+            self.current_paragraphs = []
+            self.paragraph_pending = False
 
-                    elif token in CRAP_TOKENS:
-                        continue
+            self.last_token_was_punctuation = True # next sequence starts with a new sentence, so is preceded by eos which is punctuation
 
-                    elif token.startswith(PAUSE_PREFIX):
-                        last_pause = float(token.replace(PAUSE_PREFIX,"").replace(">",""))
+        else:
+            subsequence = [
+                self.current_words[:-1] + [self.word_vocabulary[END]],
+                self.current_punctuations,
+                self.current_pauses[1:],
+                self.current_paragraphs
+            ]
+
+            self.subsequences.append(subsequence)
+
+            # Carry unfinished sentence to next subsequence
+            self.current_words = self.current_words[self.last_eos_idx+1:]
+            self.current_punctuations = self.current_punctuations[self.last_eos_idx+1:]
+            self.current_pauses = self.current_pauses[self.last_eos_idx+1:]
+            self.current_paragraphs = self.current_paragraphs[self.last_eos_idx+1:]
+
+        self.last_eos_idx = 0 # sequence always starts with a new sentence
 
-                    elif token in punctuation_vocabulary:
+        return True
 
-                        if last_token_was_punctuation: # if we encounter sequences like: "... !EXLAMATIONMARK .PERIOD ...", then we only use the first punctuation and skip the ones that follow
-                            continue
+def write_processed_dataset(input_files, output_file):
+    """
+    data will consist of two sets of aligned subsequences (words and punctuations) of MAX_SEQUENCE_LEN tokens (actually punctuation sequence will be 1 element shorter).
+    If a sentence is cut, then it will be added to next subsequence entirely (words before the cut belong to both sequences)
+    """
 
-                        if token in EOS_TOKENS:
-                            last_eos_idx = len(current_punctuations) # no -1, because the token is not added yet
+    builder = SubsequenceBuilder(read_vocabulary(WORD_VOCAB_FILE), iterable_to_dict(PUNCTUATION_VOCABULARY))
 
-                        punctuation = punctuation_vocabulary[token]
+    for input_file in input_files:
+        for token in read_tokens(input_file):
+            builder.add(token)
 
-                        current_punctuations.append(punctuation)
-                        last_token_was_punctuation = True
+    print "%.2f%% UNK-s in %s" % (builder.num_unks / builder.num_total * 100, output_file)
 
-                    else:
+    dump(builder.subsequences, output_file)
 
-                        if not last_token_was_punctuation:
-                            current_punctuations.append(punctuation_vocabulary[SPACE])
+def write_shard(args):
+    """
+    Converts one input file to a shard as if it was the first file of the dataset.
+    Also returns the builder state after the first MAX_SYNC_SUBSEQUENCES subsequences, which write_processed_dataset_parallel
+    uses to find where a run that continues from the previous file catches up with the shard.
+    """
+    input_file, shard_file = args
 
-                        word = word_vocabulary.get(token, word_vocabulary[UNK])
+    builder = SubsequenceBuilder(read_vocabulary(WORD_VOCAB_FILE), iterable_to_dict(PUNCTUATION_VOCABULARY))
+    checkpoints = {}
 
-                        current_words.append(word)
-                        current_pauses.append(last_pause)
-                        last_token_was_punctuation = False
+    for i, token in enumerate(read_tokens(input_file)):
+        if builder.add(token) and len(checkpoints) < MAX_SYNC_SUBSEQUENCES:
+            checkpoints[i] = (builder.get_state(), len(builder.subsequences), builder.num_total, builder.num_unks)
 
-                        num_total += 1
-                        num_unks += int(word == word_vocabulary[UNK])
+    dump(builder.subsequences, shard_file)
 
-                    if len(current_words) == MAX_SEQUENCE_LEN: # this also means, that last token was a word
-                        
-                        assert len(current_words) == len(current_punctuations) + 1, "#words: %d; #punctuations: %d" % (len(current_words), len(current_punctuations))
-                        assert current_pauses == [] or len(current_words) == len(current_pauses), "#words: %d; #pauses: %d" % (len(current_words), len(current_pauses))
+    return checkpoints, builder.get_state(), builder.num_total, builder.num_unks
 
-                        # Sentence did not fit into subsequence - skip it
-                        if last_eos_idx == 0: 
-                            skip_until_eos = True
+def write_processed_dataset_parallel(input_files, output_file, num_workers=NUM_WORKERS):
+    """
+    Same output as write_processed_dataset, but the input files are converted to shards in parallel.
+    Subsequences can continue from one file to the next, so each file after the first is re-read from the state the previous
+    file ended in until the state matches the shard's (usually within a few subsequences), and the shard is used from there on.
+    """
 
-                            current_words = []
-                            current_punctuations = []
-                            current_pauses = []
+    if num_workers < 2 or len(input_files) < 2:
+        write_processed_dataset(input_files, output_file)
+        return
 
-                            last_token_was_punctuation = True # next sequence starts with a new sentence, so is preceded by eos which is punctuation
+    shard_dir = output_file + ".shards"
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+    shard_files = [os.path.join(shard_dir, str(i)) for i in range(len(input_files))]
 
-                        else:
-                            subsequence = [
-                                current_words[:-1] + [word_vocabulary[END]],
-                                current_punctuations,
-                                current_pauses[1:]
-                            ]
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        shards = pool.map(write_shard, zip(input_files, shard_files))
+    finally:
+        pool.terminate()
 
-                            data.append(subsequence)
+    builder = SubsequenceBuilder(read_vocabulary(WORD_VOCAB_FILE), iterable_to_dict(PUNCTUATION_VOCABULARY))
+    parts = []
+    num_total = 0
+    num_unks = 0
 
-                            # Carry unfinished sentence to next subsequence
-                            current_words = current_words[last_eos_idx+1:]
-                            current_punctuations = current_punctuations[last_eos_idx+1:]
-                            current_pauses = current_pauses[last_eos_idx+1:]
+    for input_file, shard_file, (checkpoints, final_state, shard_total, shard_unks) in zip(input_files, shard_files, shards):
 
-                        last_eos_idx = 0 # sequence always starts with a new sentence
+        start = 0 # first subsequence of the shard to use
+        builder.subsequences = []
+        builder.num_total = 0
+        builder.num_unks = 0
+
+        if builder.get_state() != INITIAL_BUILDER_STATE:
+            start = None
+            for i, token in enumerate(read_tokens(input_file)):
+                if builder.add(token) and i in checkpoints and checkpoints[i][0] == builder.get_state():
+                    _, start, shard_total_before, shard_unks_before = checkpoints[i]
+                    shard_total -= shard_total_before
+                    shard_unks -= shard_unks_before
+                    break
+
+        parts.append(builder.subsequences)
+        num_total += builder.num_total
+        num_unks += builder.num_unks
+
+        if start is not None:
+            parts.append(itertools.islice(load(shard_file), start, None))
+            num_total += shard_total
+            num_unks += shard_unks
+            builder.set_state(final_state)
 
     print "%.2f%% UNK-s in %s" % (num_unks / num_total * 100, output_file)
 
-    dump(data, output_file)
+    dump(itertools.chain(*parts), output_file)
+
+    shutil.rmtree(shard_dir)
+
+def dataset_signature(input_files):
+    """Everything a processed dataset depends on, so that it's rebuilt only if some of it changed"""
+    with open(WORD_VOCAB_FILE, 'rb') as f:
+        vocabulary_hash = hashlib.md5(f.read()).hexdigest()
+    return repr(([(p, os.path.getsize(p), os.path.getmtime(p)) for p in input_files], vocabulary_hash, MAX_SEQUENCE_LEN,
+                 PUNCTUATION_VOCABULARY, sorted(PUNCTUATION_MAPPING.items()), sorted(EOS_TOKENS), sorted(CRAP_TOKENS), PARAGRAPH_VOCABULARY))
+
+def vocabulary_signature(input_files, pretrained_embeddings_path):
+    return repr(([(p, os.path.getsize(p), os.path.getmtime(p)) for p in input_files + [pretrained_embeddings_path] if p],
+                 MAX_WORD_VOCABULARY_SIZE, MIN_WORD_COUNT_IN_VOCAB, PUNCTUATION_VOCABULARY, sorted(PUNCTUATION_MAPPING.items()), sorted(CRAP_TOKENS)))
+
+def is_up_to_date(output_file, signature):
+    if not os.path.exists(output_file + SIGNATURE_SUFFIX):
+        return False
+    with open(output_file + SIGNATURE_SUFFIX, 'r') as f:
+        return f.read() == signature
+
+def write_signature(output_file, signature):
+    with open(output_file + SIGNATURE_SUFFIX, 'w') as f:
+        f.write(signature)
 
 def create_dev_test_train_split_and_vocabulary(root_path, create_vocabulary, train_output, dev_output, test_output, pretrained_embeddings_path=None):
+    """Splits whose input files, vocabulary and settings haven't changed since they were last written are not rewritten"""
 
     train_txt_files = []
     dev_txt_files = []
     test_txt_files = []
 
-    if create_vocabulary and not pretrained_embeddings_path:
-        word_counts = dict()
-    
     for root, dirnames, filenames in os.walk(root_path):
         for filename in fnmatch.filter(filenames, '*.txt'):
 
@@ -223,32 +451,56 @@ def create_dev_test_train_split_and_vocabulary(root_path, create_vocabulary, tra
             elif filename.endswith(".train.txt"):
                 train_txt_files.append(path)
 
-                if create_vocabulary and not pretrained_embeddings_path:
-                    with codecs.open(path, 'r', 'utf-8') as text:
-                        for line in text:
-                            add_counts(word_counts, line)
-
     if create_vocabulary:
-        if pretrained_embeddings_path:
-            vocabulary = []
-            embeddings = []
-            with codecs.open(pretrained_embeddings_path, 'r', 'utf-8') as f:
-                for line in f:
-                    line = line.split()
-                    w = line[0]
-                    e = [float(x) for x in line[1:]]
-                    vocabulary.append(w)
-                    embeddings.append(e)
-
-            with open("We.pcl", 'wb') as f:
-                cPickle.dump(embeddings, f, cPickle.HIGHEST_PROTOCOL)
+        signature = vocabulary_signature(train_txt_files, pretrained_embeddings_path)
+
+        if is_up_to_date(WORD_VOCAB_FILE, signature):
+            print "%s is up to date" % WORD_VOCAB_FILE
+
         else:
-            vocabulary = build_vocabulary(word_counts)
-        write_vocabulary(vocabulary, WORD_VOCAB_FILE)
+            if os.path.exists(WORD_VOCAB_FILE + SIGNATURE_SUFFIX):
+                os.remove(WORD_VOCAB_FILE + SIGNATURE_SUFFIX)
+
+            if pretrained_embeddings_path:
+                vocabulary = []
+                embeddings = []
+                with codecs.open(pretrained_embeddings_path, 'r', 'utf-8') as f:
+                    for line in f:
+                        line = line.split()
+                        w = line[0]
+                        e = [float(x) for x in line[1:]]
+                        vocabulary.append(w)
+                        embeddings.append(e)
+
+                with open("We.pcl", 'wb') as f:
+                    cPickle.dump(embeddings, f, cPickle.HIGHEST_PROTOCOL)
+            else:
+                word_counts = dict()
+                with profiling.phase("word counting"):
+                    pool = multiprocessing.Pool(NUM_WORKERS)
+                    try:
+                        for counts in pool.imap(count_words, train_txt_files):
+                            merge_counts(word_counts, counts)
+                    finally:
+                        pool.terminate()
+                    vocabulary = build_vocabulary(word_counts)
+            with profiling.phase("vocabulary writing"):
+                write_vocabulary(vocabulary, WORD_VOCAB_FILE)
+            write_signature(WORD_VOCAB_FILE, signature)
+
+    for input_files, output_file in [(train_txt_files, train_output), (dev_txt_files, dev_output), (test_txt_files, test_output)]:
+        signature = dataset_signature(input_files)
+
+        if is_up_to_date(output_file, signature):
+            print "%s is up to date" % output_file
+            continue
+
+        if os.path.exists(output_file + SIGNATURE_SUFFIX):
+            os.remove(output_file + SIGNATURE_SUFFIX)
 
-    write_processed_dataset(train_txt_files, train_output)
-    write_processed_dataset(dev_txt_files, dev_output)
-    write_processed_dataset(test_txt_files, test_output)
+        with profiling.phase("dataset conversion (%s)" % os.path.basename(output_file)):
+            write_processed_dataset_parallel(input_files, output_file)
+        write_signature(output_file, signature)
 
 if __name__ == "__main__":
 
@@ -260,7 +512,9 @@ if __name__ == "__main__":
     if not os.path.exists(DATA_PATH):
         os.makedirs(DATA_PATH)
     else:
-        sys.exit("Data already exists")
+        print "Data already exists, updating the files whose inputs have changed"
+
+    profiling.start(os.path.join(DATA_PATH, "data"))
         
     # replace = False
     # if os.path.exists(DATA_PATH):
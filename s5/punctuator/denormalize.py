@@ -0,0 +1,238 @@
+# coding: utf-8
+from __future__ import division
+
+import data
+import client
+import profiling
+
+import sys
+import os
+import re
+import codecs
+
+from collections import OrderedDict
+from time import time
+from convert_to_readable import convert as punctuation_to_readable
+from rewrite_rules import RewriteRules
+from fst_normalizer import BUNDLE_FSTS, load_bundle_fsts, split_lines
+
+"""
+Denormalization of an ASR transcript into readable text in one process, with the same stages and output as the process
+chain of local/recognize/denormalize.sh, which runs this by default:
+
+abbreviate           ABBR_AND_DENORM.fst, as fststringcompile | fsttablecompose | fsts-to-transcripts | int2sym.pl
+punctuate            the punctuation model, as punctuator.py, which masks the numbers for the model (as local/saving_numbers.py
+                     and local/re-inserting-numbers.py did)
+punctuation marks    punctuation tokens to marks and capitalization, as convert_to_readable.py
+insert periods       INSERT_PERIODS.fst and a period at the end of the speech
+rewrite rules        the sed rules for "hv.", "hæstv." and "þm.", year intervals, repetitions, thousands etc. (rewrite_rules.py)
+paragraph            the paragraph model, as paragraph/paragrapher.py, unless the punctuation model is a joint model
+paragraph breaks     paragraph tokens to line breaks, as paragraph/convert_to_readable.py
+
+The FSTs and models are loaded once, and the text goes from stage to stage in memory. The FSTs are applied with
+fst_normalizer.py, which runs the Kaldi tools of the FST stages as a pipe of processes if the OpenFst Python extension isn't
+installed. The time of each stage is printed at the end, and added to the profile with PUNCTUATOR_PROFILE (see profiling.py).
+
+e.g. INFERENCE_ENGINE=numpy python punctuator/denormalize.py ~/models/latest output/radXXX/ASRtranscript.txt output/radXXX/radXXX.txt
+
+An intermediate directory can be given after the output file to write the text after each stage to the same files as
+denormalize.sh does, and a Unix socket of a running server.py after it to use its models instead of loading them, and its
+FSTs too if it has loaded the bundle.
+"""
+
+EOP_TOKENS = {"EOP"} # as in paragraph/data.py
+PARAGRAPH_PUNCTUATION_VOCABULARY = ["_SPACE", "EOP"] # as in paragraph/data.py
+
+# exit codes of the stages, the error codes of local/array.sh
+ERROR_CODES = {"abbreviate": 8, "punctuate": 9, "insert periods": 8, "rewrite rules": 13, "paragraph": 10}
+
+# The files that denormalize.sh writes to its intermediate directory, and the stages that write them
+INTERMEDIATE_FILES = {
+    "abbreviate": "thrax_out.tmp",
+    "punctuate": "punctuator_out.tmp",
+    "punctuation marks": "punctuator_out_wPuncts.tmp",
+    "insert periods": "punctuator_out_wPeriods.tmp",
+    "rewrite rules": "hv_abbreviated.tmp",
+    "paragraph": "paragraphed_tokens.tmp",
+}
+
+class DenormalizationError(Exception):
+    """An error in a stage, with the exit code of denormalize.sh for it"""
+
+    def __init__(self, stage, message):
+        Exception.__init__(self, "%s: %s" % (stage, message))
+        self.stage = stage
+        self.code = ERROR_CODES.get(stage, 1)
+
+def strip_utterance_ids(transcript):
+    """The text of the transcript without the utterance ids, as cut -d' ' -f2- | tr "\\n" " " """
+    return "".join((line.split(" ", 1)[1] if " " in line else line) + " " for line in split_lines(transcript))
+
+def check_rewritten(input_lines, output_lines):
+    """
+    Returns the output lines of an FST, or raises ValueError if a line wasn't rewritten, i.e. is empty in the output
+    (see fst_normalizer.py), where denormalize.sh failed with pipefail
+    """
+    for i, (input_line, output_line) in enumerate(zip(input_lines, output_lines)):
+        if input_line.strip() and not output_line:
+            raise ValueError("The FST didn't rewrite line %d" % (i + 1))
+    return output_lines
+
+def insert_final_period(lines):
+    """The lines as one line, ending with a period if it doesn't end with a sentence end, as the sed after INSERT_PERIODS.fst"""
+    text = re.sub(" +", " ", "".join(line + " " for line in lines))
+    text = re.sub(r"[ \t\n\r\f\v]*$", "", text)
+    return re.sub(r"([^.?!])$", r"\1.", text)
+
+def paragraphs_to_readable(tokens):
+    """The text with a line for each paragraph, as paragraph/convert_to_readable.py with newlines"""
+    output = []
+    last_was_eos = True
+    first = True
+    for token in tokens:
+        if token in PARAGRAPH_PUNCTUATION_VOCABULARY:
+            output.append('')
+        else:
+            output.append(('' if first else ' ') + (token.title() if last_was_eos else token))
+
+        last_was_eos = token in EOP_TOKENS
+        if last_was_eos:
+            output.append('\n')
+            first = True
+        else:
+            first = False
+    return ''.join(output)
+
+def load_restorer(model_file, eos_tokens, punctuation_mapping, server_socket=None, command=None, mask_numbers=False):
+    """A function from input text to output text for the model, loaded here or in the server"""
+    if server_socket:
+        restorer = lambda input_text: client.request(server_socket, command, input_text)
+    else:
+        from server import Restorer
+        restorer = Restorer(model_file, eos_tokens, punctuation_mapping, mask_numbers)
+
+    def restore(input_text):
+        if len(input_text) == 0: # as punctuator.py and paragrapher.py with empty input
+            raise ValueError("Input text missing")
+        return restorer(input_text)
+
+    return restore
+
+def load_served_fst(server_socket, command):
+    """A function from lines to lines for an FST that the server has loaded"""
+    return lambda lines: split_lines(client.request(server_socket, command, u"".join(line + u"\n" for line in lines)))
+
+class Denormalizer(object):
+    """The FSTs and models of a model bundle (see local/update_latest.sh), loaded for denormalizing many transcripts"""
+
+    def __init__(self, bundle, server_socket=None):
+        for f in ["utf8.syms", "text_norm/ABBR_AND_DENORM.fst", "text_norm/INSERT_PERIODS.fst", "punctuation_model"]:
+            if not os.path.exists(os.path.join(bundle, f)):
+                raise IOError("Expected %s to exist" % os.path.join(bundle, f))
+
+        # The FSTs are applied by the server if it has them (server.py with the bundle), and otherwise loaded here
+        if server_socket and set(BUNDLE_FSTS) <= set(client.commands(server_socket)):
+            fsts = {name: load_served_fst(server_socket, name) for name in BUNDLE_FSTS}
+        else:
+            fsts = load_bundle_fsts(bundle)
+        self.abbreviate_fst = fsts["abbreviate"]
+        self.insert_periods_fst = fsts["insert_periods"]
+        self.rewrite_rules = RewriteRules()
+
+        self.punctuate = load_restorer(os.path.join(bundle, "punctuation_model"), data.EOS_TOKENS, data.PUNCTUATION_MAPPING, server_socket, "punctuate",
+                                        mask_numbers=True)
+
+        # A bundle without a paragraph model has a joint punctuation and paragraph model,
+        # whose output already contains the paragraph breaks
+        paragraph_model = os.path.join(bundle, "paragraph_model")
+        self.paragraph = load_restorer(paragraph_model, EOP_TOKENS, {}, server_socket, "paragraph") if os.path.exists(paragraph_model) else None
+
+    def denormalize(self, transcript, intermediate_dir=None):
+        """Returns the readable text of the ASR transcript and the time of each stage"""
+        timings = OrderedDict()
+
+        def run(stage, function, *args):
+            t0 = time()
+            try:
+                result = function(*args)
+            except Exception as e:
+                raise DenormalizationError(stage, e)
+            timings[stage] = time() - t0
+            profiling.add(stage, timings[stage])
+            return result
+
+        def save(stage, text):
+            if intermediate_dir:
+                with codecs.open(os.path.join(intermediate_dir, INTERMEDIATE_FILES[stage]), 'w', 'utf-8') as f:
+                    f.write(text)
+
+        input_lines = [strip_utterance_ids(transcript)]
+        lines = run("abbreviate", lambda: [re.sub(" +", " ", line) for line in check_rewritten(input_lines, self.abbreviate_fst(input_lines))])
+        save("abbreviate", "".join(line + "\n" for line in lines))
+
+        punctuated = run("punctuate", self.punctuate, "".join(line + "\n" for line in lines))
+        save("punctuate", punctuated)
+
+        text = run("punctuation marks", punctuation_to_readable, punctuated.split())
+        save("punctuation marks", text)
+
+        input_lines = split_lines(text)
+        text = run("insert periods", lambda: insert_final_period(check_rewritten(input_lines, self.insert_periods_fst(input_lines))))
+        save("insert periods", text)
+
+        text = run("rewrite rules", self.rewrite_rules, text)
+        save("rewrite rules", text)
+
+        if self.paragraph is not None:
+            text = run("paragraph", self.paragraph, text)
+        save("paragraph", text)
+
+        text = run("paragraph breaks", paragraphs_to_readable, text.split())
+
+        return text, timings
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        bundle = sys.argv[1]
+    else:
+        sys.exit("Model bundle directory argument missing")
+
+    if len(sys.argv) > 2:
+        input_file = sys.argv[2]
+    else:
+        sys.exit("ASR transcript file path argument missing")
+
+    if len(sys.argv) > 3:
+        output_file = sys.argv[3]
+    else:
+        sys.exit("Output file path argument missing")
+
+    intermediate_dir = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != "-" else None
+    server_socket = sys.argv[5] if len(sys.argv) > 5 else None
+
+    profiling.start(os.path.join(intermediate_dir, "denormalize") if intermediate_dir else output_file)
+
+    t0 = time()
+    try:
+        denormalizer = Denormalizer(bundle, server_socket)
+    except IOError as e:
+        sys.exit(str(e))
+    load_time = time() - t0
+
+    with codecs.open(input_file, 'r', 'utf-8') as f:
+        transcript = f.read()
+
+    try:
+        text, timings = denormalizer.denormalize(transcript, intermediate_dir)
+    except DenormalizationError as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(e.code)
+
+    with codecs.open(output_file, 'w', 'utf-8') as f:
+        f.write(text)
+
+    print "{:<24} {:>10}".format("STAGE", "SECONDS")
+    print "{:<24} {:>10.3f}".format("loading", load_time)
+    for stage, seconds in timings.items():
+        print "{:<24} {:>10.3f}".format(stage, seconds)
@@ -0,0 +1,197 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import os
+import codecs
+import hashlib
+import itertools
+import multiprocessing
+
+from collections import OrderedDict
+from time import time
+from denormalize import Denormalizer, DenormalizationError
+from fst_normalizer import BUNDLE_FSTS
+
+NUM_WORKERS = multiprocessing.cpu_count() # processes that denormalize the transcripts
+MANIFEST_FILE = "manifest.txt" # in the output directory
+
+"""
+Denormalizes many ASR transcripts with one load of the FSTs and models (see denormalize.py), e.g. to re-denormalize an
+archive after a model update. The input is a directory of transcripts, whose outputs get the same names in the output
+directory, or a list with a transcript path and optionally an output path on each line.
+
+The bundle is loaded before the worker processes are forked, so they share the loaded models, and each worker denormalizes
+one transcript at a time. It's best to limit the BLAS threads of the workers, e.g. with OMP_NUM_THREADS=1.
+
+The status of each transcript is appended to manifest.txt in the output directory as it finishes, with the tab separated
+fields: transcript, output file, OK or FAILED, exit code of the failed stage (see denormalize.py), seconds, the error and
+the signature of the bundle (see bundle_signature). Transcripts that the manifest already has as OK with the same bundle
+are skipped, so a stopped run continues where it was when started again, and the transcripts are denormalized again when
+the models or FSTs of the bundle have changed.
+
+e.g. OMP_NUM_THREADS=1 INFERENCE_ENGINE=numpy python punctuator/denormalize_batch.py ~/models/latest transcripts/ denormalized/ 16
+"""
+
+denormalizer = None # loaded before the workers are forked
+
+def list_transcripts(input_path, output_dir):
+    """Returns the (transcript, output file) pairs of a directory of transcripts or an input list"""
+    if os.path.isdir(input_path):
+        return [(os.path.join(input_path, f), os.path.join(output_dir, f)) for f in sorted(os.listdir(input_path))
+                if os.path.isfile(os.path.join(input_path, f))]
+
+    io_files = []
+    with codecs.open(input_path, 'r', 'utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                io_files.append((fields[0], fields[1] if len(fields) > 1 else os.path.join(output_dir, os.path.basename(fields[0]))))
+    return io_files
+
+def bundle_signature(bundle):
+    """
+    A hash of the paths, sizes and modification times of the models and FSTs of the bundle, which changes when they are updated.
+    A model that is a directory (see export_model.py) counts with each file in it, e.g. model.json when tune_decoding.py rewrites it.
+    """
+    paths = []
+    for f in ["utf8.syms", "punctuation_model", "paragraph_model"] + sorted(BUNDLE_FSTS.values()):
+        path = os.path.realpath(os.path.join(bundle, f))
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                subdirectories.sort()
+                paths.extend(os.path.join(directory, name) for name in sorted(files))
+        elif os.path.exists(path):
+            paths.append(path)
+    return hashlib.md5(repr([(p, os.path.getsize(p), os.path.getmtime(p)) for p in paths])).hexdigest()
+
+def read_manifest(manifest_file, signature):
+    """Returns the output files of the transcripts that the manifest has as denormalized with the bundle of the signature"""
+    done = {}
+    if os.path.exists(manifest_file):
+        with codecs.open(manifest_file, 'r', 'utf-8') as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) > 6 and fields[2] == "OK" and fields[6] == signature:
+                    done[fields[0]] = fields[1]
+                elif fields[0] in done: # denormalized again since, e.g. with another bundle
+                    del done[fields[0]]
+    return done
+
+def denormalize_file(io_files):
+    """
+    Denormalizes one transcript with the global denormalizer and returns its status: the transcript and output file,
+    the exit code (0 if it's denormalized), seconds, the error message and the time of each stage
+    """
+    transcript_file, output_file = io_files
+    t0 = time()
+    try:
+        with codecs.open(transcript_file, 'r', 'utf-8') as f:
+            transcript = f.read()
+
+        text, timings = denormalizer.denormalize(transcript)
+
+        output_dir = os.path.dirname(output_file)
+        if output_dir and not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError: # made by another worker meanwhile
+                pass
+
+        with codecs.open(output_file, 'w', 'utf-8') as f:
+            f.write(text)
+
+    except DenormalizationError as e:
+        return transcript_file, output_file, e.code, time() - t0, unicode(e), {}
+    except (IOError, OSError, UnicodeError) as e:
+        return transcript_file, output_file, 1, time() - t0, unicode(e), {}
+
+    return transcript_file, output_file, 0, time() - t0, u"", timings
+
+def format_status(transcript_file, output_file, code, seconds, message, signature):
+    return u"\t".join([transcript_file, output_file, "OK" if code == 0 else "FAILED", str(code), "%.3f" % seconds, u" ".join(message.split()), signature]) + "\n"
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        bundle = sys.argv[1]
+    else:
+        sys.exit("Model bundle directory argument missing")
+
+    if len(sys.argv) > 2:
+        input_path = sys.argv[2]
+    else:
+        sys.exit("Transcript directory or input list argument missing")
+
+    if len(sys.argv) > 3:
+        output_dir = sys.argv[3]
+    else:
+        sys.exit("Output directory argument missing")
+
+    num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else NUM_WORKERS
+    server_socket = sys.argv[5] if len(sys.argv) > 5 else None
+
+    io_files = list_transcripts(input_path, output_dir)
+
+    if len(io_files) == 0:
+        sys.exit("No transcripts in %s" % input_path)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    signature = bundle_signature(bundle)
+    done = read_manifest(manifest_file, signature)
+    todo = [(t, o) for t, o in io_files if done.get(t) != o or not os.path.exists(o)]
+
+    print "%d transcripts, %d of them already denormalized" % (len(io_files), len(io_files) - len(todo))
+
+    t0 = time()
+    try:
+        denormalizer = Denormalizer(bundle, server_socket)
+    except IOError as e:
+        sys.exit(str(e))
+    load_time = time() - t0
+
+    num_workers = max(1, min(num_workers, len(todo)))
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+
+    stage_timings = OrderedDict()
+    num_failed = 0
+
+    t0 = time()
+    try:
+        results = pool.imap_unordered(denormalize_file, todo) if pool else itertools.imap(denormalize_file, todo)
+
+        with codecs.open(manifest_file, 'a', 'utf-8') as manifest:
+            for i, (transcript_file, output_file, code, seconds, message, timings) in enumerate(results):
+
+                manifest.write(format_status(transcript_file, output_file, code, seconds, message, signature))
+                manifest.flush()
+
+                if code != 0:
+                    num_failed += 1
+                    print "FAILED %s: %s" % (transcript_file, message)
+
+                for stage, stage_seconds in timings.items():
+                    stage_timings[stage] = stage_timings.get(stage, 0.) + stage_seconds
+
+                if (i + 1) % 100 == 0:
+                    print "%d/%d transcripts in %.1f sec" % (i + 1, len(todo), time() - t0)
+                    sys.stdout.flush()
+    finally:
+        if pool:
+            pool.terminate()
+
+    elapsed = max(time() - t0, 1e-100)
+
+    print "{:<24} {:>10}".format("STAGE", "SECONDS")
+    print "{:<24} {:>10.3f}".format("loading", load_time)
+    for stage, seconds in stage_timings.items():
+        print "{:<24} {:>10.3f}".format(stage, seconds)
+
+    print "Denormalized %d transcripts in %.2f sec with %d workers (%.2f transcripts/sec), %d failed, see %s" % (
+        len(todo) - num_failed, elapsed, num_workers, len(todo) / elapsed, num_failed, manifest_file)
+
+    if num_failed > 0:
+        sys.exit(1)
@@ -0,0 +1,99 @@
+# coding: utf-8
+from __future__ import division
+
+import numpy_models
+import export_model
+import data
+
+import sys
+import os
+import codecs
+import shutil
+import tempfile
+
+from time import time
+from error_calculator import compute_error
+from punctuator import split_input, punctuate
+
+"""
+Compares the float model to its int8 and float16 quantized exports (see export_model.py) with the numpy inference engine.
+Punctuates a punctuation annotated test text with each of them and prints the F-scores from error_calculator.compute_error,
+the size of the parameters on disk, the load time and the speed.
+
+e.g. python punctuator/evaluate_quantization.py Model_althingi_h256_lr0.02.pcl althingi.test.txt
+"""
+
+def model_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    stage1_model_file_name = export_model.load_state(path).get("stage1_model_file_name")
+    return os.path.getsize(path) + (model_size(stage1_model_file_name) if stage1_model_file_name else 0)
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        test_file = sys.argv[2]
+    else:
+        sys.exit("Test file path argument missing")
+
+    use_pauses = len(sys.argv) > 3 and bool(int(sys.argv[3]))
+
+    with codecs.open(test_file, 'r', 'utf-8') as f:
+        input_text = f.read()
+
+    temp_dir = tempfile.mkdtemp()
+    results = []
+
+    try:
+        # the predictions have no pause annotations, so they are left out of the target too
+        target_file = os.path.join(temp_dir, "target.txt")
+        with codecs.open(target_file, 'w', 'utf-8') as f:
+            f.write(" ".join(w for w in input_text.split() if not w.startswith(data.PAUSE_PREFIX)))
+
+        for quantization in [None] + list(export_model.QUANTIZATIONS):
+
+            name = quantization or "float"
+
+            if quantization:
+                model_path = os.path.join(temp_dir, name)
+                export_model.export(model_file, model_path, quantization)
+            else:
+                model_path = model_file
+
+            t0 = time()
+            net = numpy_models.load(model_path)
+            load_time = time() - t0
+
+            text, pauses = split_input(input_text, net.y_vocabulary)
+            if use_pauses and not pauses:
+                pauses = [0.0 for _ in range(len(text)-1)]
+            predict = (lambda x, p: net.predict(x, p)) if use_pauses else (lambda x: net.predict(x))
+
+            output_file = os.path.join(temp_dir, name + ".txt")
+            t0 = time()
+            with codecs.open(output_file, 'w', 'utf-8') as f_out:
+                punctuate(f_out, text, pauses if use_pauses else None, net.x_vocabulary, {v:k for k,v in net.y_vocabulary.items()}, predict)
+            words_per_sec = (len(text) - 1) / (time() - t0)
+
+            print "%s model:" % name
+            f_scores = compute_error([target_file], [output_file])
+            results.append((name, model_size(model_path), load_time, words_per_sec, f_scores))
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print ""
+    print "{:<9} {:>10} {:>9} {:>10} {:>10}".format("MODEL", "SIZE (MB)", "LOAD (s)", "WORDS/s", "F-SCORE")
+    for name, size, load_time, words_per_sec, f_scores in results:
+        print "{:<9} {:>10.1f} {:>9.2f} {:>10.0f} {:>10.1f}".format(name, size / 2**20, load_time, words_per_sec, f_scores["Overall"] * 100)
+
+    float_f_scores = results[0][4]
+    print ""
+    print "F-score change from the float model:"
+    for name, _, _, _, f_scores in results[1:]:
+        print "%s: %s" % (name, ", ".join("%s %+.1f" % (p, (f_scores[p] - float_f_scores[p]) * 100) for p in data.PUNCTUATION_VOCABULARY[1:] + ["Overall"]))
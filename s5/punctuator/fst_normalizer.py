@@ -0,0 +1,142 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import os
+import codecs
+import pipes
+import subprocess
+
+try:
+    import pywrapfst
+except ImportError: # the Kaldi tools are run instead
+    pywrapfst = None
+
+SPACE_SYMBOL = u"0x0020" # the symbol of a space in utf8.syms
+
+# The FSTs of a model bundle (see local/update_latest.sh) that denormalize.py applies, by their commands in server.py
+BUNDLE_FSTS = {"abbreviate": "text_norm/ABBR_AND_DENORM.fst", "insert_periods": "text_norm/INSERT_PERIODS.fst"}
+
+"""
+Applies a compiled Thrax FST, e.g. text_norm/ABBR_AND_DENORM.fst or text_norm/INSERT_PERIODS.fst of a model bundle, to
+batches of lines with the same output as
+
+fststringcompile ark:- ark:- | fsttablecompose --match-side=left ark,t:- FST ark:- | fsts-to-transcripts ark:- ark,t:- \
+  | int2sym.pl -f 2- utf8.syms | cut -d' ' -f2- | sed -re 's: ::g' -e 's:0x0020: :g'
+
+With the OpenFst Python extension (pywrapfst, built with OpenFst's --enable-python or installed with pynini), the FST is
+read once and each line is compiled into a string FST of its Unicode code points and composed with it in this process.
+Without it, each batch is run through the Kaldi tools above, which read the FST again for every batch.
+A line that the FST doesn't rewrite to one string, which the Kaldi tools leave out, is an empty line in the output, so
+the output has a line for each input line. compare_fst_normalizer.py checks the pywrapfst path.
+
+e.g. cut -d' ' -f2- ASRtranscript.txt | python punctuator/fst_normalizer.py $bundle/text_norm/ABBR_AND_DENORM.fst $bundle/utf8.syms > abbreviated.txt
+"""
+
+def read_symbols(symbols_file):
+    """Returns the symbols of a symbol table by their integer ids"""
+    symbols = {}
+    with codecs.open(symbols_file, 'r', 'utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                symbols[int(fields[1])] = fields[0]
+    return symbols
+
+def symbols_to_text(ids, symbols):
+    """The text of a transcript of symbol ids, as int2sym.pl | sed -re 's: ::g' -e 's:0x0020: :g'"""
+    try:
+        return u"".join(symbols[int(i)] for i in ids).replace(SPACE_SYMBOL, u" ")
+    except KeyError as e:
+        raise ValueError("Undefined symbol %s" % e)
+
+def split_lines(text):
+    """The lines of a text as sed and cut read them, with the newline at the end of the last line optional"""
+    lines = text.split(u"\n")
+    if lines[-1] == u"":
+        lines.pop()
+    return lines
+
+class FstNormalizer(object):
+    """A compiled Thrax FST and the symbol table of its output. Calling it with a list of lines returns the rewritten lines."""
+
+    def __init__(self, fst_file, symbols):
+        self.symbols = symbols
+        if pywrapfst is not None:
+            self.fst = pywrapfst.Fst.read(fst_file)
+            zero = getattr(pywrapfst.Weight, "zero", None) or pywrapfst.Weight.Zero # Zero before OpenFst 1.7
+            self.zero = zero(self.fst.weight_type()).to_string()
+        else:
+            self.fst = None
+            # fsttablecompose and fsts-to-transcripts exit with 1 when no line could be rewritten
+            self.command = "fststringcompile ark:- ark:- " \
+                           "| fsttablecompose --match-side=left ark,t:- %s ark:- " \
+                           "| fsts-to-transcripts ark:- ark,t:-; " \
+                           "codes=(${PIPESTATUS[@]}); [ ${codes[0]} -eq 0 -a ${codes[1]} -le 1 -a ${codes[2]} -le 1 ]" % pipes.quote(fst_file)
+
+    def compile_string(self, line):
+        """A linear acceptor of the code points of the line, as fststringcompile"""
+        string_fst = getattr(pywrapfst, "VectorFst", pywrapfst.Fst)(self.fst.arc_type())
+        state = string_fst.add_state()
+        string_fst.set_start(state)
+        for c in line:
+            next_state = string_fst.add_state()
+            string_fst.add_arc(state, pywrapfst.Arc(ord(c), ord(c), None, next_state))
+            state = next_state
+        string_fst.set_final(state)
+        string_fst.arcsort(sort_type="olabel")
+        return string_fst
+
+    def output_labels(self, fst):
+        """The output labels of a linear FST without epsilons, as fsts-to-transcripts, or None if it isn't linear or is empty"""
+        labels = []
+        state = fst.start()
+        while state != pywrapfst.NO_STATE_ID:
+            is_final = fst.final(state).to_string() != self.zero
+            if fst.num_arcs(state) == 0 and is_final:
+                return labels
+            if fst.num_arcs(state) != 1 or is_final:
+                break
+            arc = next(iter(fst.arcs(state)))
+            if arc.olabel != 0:
+                labels.append(arc.olabel)
+            state = arc.nextstate
+        return None
+
+    def __call__(self, lines):
+        if self.fst is not None:
+            output_labels = [self.output_labels(pywrapfst.compose(self.compile_string(line), self.fst)) for line in lines]
+            return [symbols_to_text(labels, self.symbols) if labels is not None else u"" for labels in output_labels]
+
+        process = subprocess.Popen(["bash", "-c", self.command], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output, _ = process.communicate(u"".join(u"%d %s\n" % (i, line) for i, line in enumerate(lines)).encode('utf-8'))
+        if process.returncode != 0:
+            raise RuntimeError("The FST tools failed")
+        # the lines by their keys, without the lines that the FST didn't rewrite
+        output_lines = {fields[0]: fields[1:] for fields in (line.split() for line in split_lines(output.decode('utf-8'))) if fields}
+        return [symbols_to_text(output_lines[str(i)], self.symbols) if str(i) in output_lines else u"" for i in range(len(lines))]
+
+def load_bundle_fsts(bundle):
+    """The BUNDLE_FSTS of a model bundle by their names, sharing the symbol table"""
+    symbols = read_symbols(os.path.join(bundle, "utf8.syms"))
+    return {name: FstNormalizer(os.path.join(bundle, fst_file), symbols) for name, fst_file in BUNDLE_FSTS.items()}
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        fst_file = sys.argv[1]
+    else:
+        sys.exit("FST file path argument missing")
+
+    if len(sys.argv) > 2:
+        symbols_file = sys.argv[2]
+    else:
+        sys.exit("Symbol table path argument missing")
+
+    normalize = FstNormalizer(fst_file, read_symbols(symbols_file))
+
+    lines = split_lines(codecs.getreader('utf-8')(sys.stdin).read())
+
+    output = codecs.getwriter('utf-8')(sys.stdout)
+    for line in normalize(lines):
+        output.write(line + u"\n")
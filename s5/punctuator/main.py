@@ -6,11 +6,17 @@ from time import time
 
 import models
 import data
+import parallel_training
+import validation
+import profiling
 
 import theano
 import cPickle
 import sys
 import os.path
+import glob
+import threading
+import Queue
 
 import theano.tensor as T
 import numpy as np
@@ -19,25 +25,47 @@ MAX_EPOCHS = 50
 MINIBATCH_SIZE = 128
 L2_REG = 0.0
 CLIPPING_THRESHOLD = 2.0
-PATIENCE_EPOCHS = 1
+PATIENCE_EPOCHS = 1 # full validations without improvement before stopping
 LR_DECAY = 0 # 0.8
+PREFETCH_BATCHES = 10 # minibatches assembled ahead of the training step
+TRAINING_WORKERS = int(os.environ.get("TRAINING_WORKERS", 1)) # CPU processes that share each minibatch (see parallel_training.py), 1 trains in this process
+SEED = 1 # of the initial weights and the minibatch order
+ATTENTION_WINDOW = None # words on each side of a gap that the output model attends to (local attention), None for the whole sequence
+ASYNC_VALIDATION = False # the full validation after each epoch runs in a separate process while the training continues (see validation.py)
+VALIDATION_THEANO_FLAGS = None # added to THEANO_FLAGS of the validation process, e.g. "device=cpu" to leave the GPU to the training
+FULL_VALIDATION_EPOCHS = 1 # the whole dev set is validated after every this many epochs
+SUBSET_VALIDATION_MINIBATCHES = 0 # size of a fixed subset of the dev set that is validated during the epochs, 0 turns this off
+SUBSET_VALIDATION_INTERVAL = 1000 # training minibatches between the subset validations
+SUBSET_PATIENCE = 5 # subset validations without improvement before stopping
+EARLY_STOPPING = "full" # validation perplexity that the best model is chosen and the training is stopped by, "full" or "subset"
+CHECKPOINT_MINUTES = 30 # the training state is saved this often during an epoch, so that a stopped job can be resumed (see save_checkpoint), 0 saves only after each epoch
 
 """
 Bi-directional RNN with attention
 For a sequence of N words, the model makes N punctuation decisions (no punctuation before the first word, but there's a decision after the last word or before </S>)
 """
    
-def get_minibatch(file_name, batch_size, shuffle, with_pauses=False):
+def get_minibatch(file_name, batch_size, shuffle, with_pauses=False, prefetch=PREFETCH_BATCHES, hidden_states=None, with_paragraphs=False, start=0, subset=None):
+    """
+    Returns an iterator over (X, Y) or (X, Y, P) minibatches of the dataset, followed by Z, the paragraph break labels,
+    if with_paragraphs is set, and by H, the minibatch of hidden_states
+    (an array with a row for each subsequence of the dataset, see main2.cache_stage1_hidden_states) if it is given.
+    The dataset is shuffled here, so the minibatches only depend on the state of np.random at the time of the call,
+    and they are then assembled in a background thread, which keeps up to prefetch minibatches ready (0 turns this off).
+    The first start minibatches are skipped. With subset, only that many subsequences, evenly spread over the dataset, are used.
+    """
 
     dataset = data.load(file_name)
 
+    # shuffle the order of the subsequences instead of the dataset itself, which stays on disk
+    order = np.arange(len(dataset))
     if shuffle:
-        np.random.shuffle(dataset)
+        np.random.shuffle(order)
 
-    X_batch = []
-    Y_batch = []
-    if with_pauses:
-        P_batch = []
+    if subset is not None and subset < len(order):
+        order = order[np.linspace(0, len(order) - 1, subset).astype(np.int64)] # evenly spread over the dataset
+
+    order = order[start*batch_size:] # the minibatches before start were trained on before the training was stopped
 
     if len(dataset) < batch_size:
         print "WARNING: Not enough samples in '%s'. Reduce mini-batch size to %d or use a dataset with at least %d words." % (
@@ -45,12 +73,33 @@ def get_minibatch(file_name, batch_size, shuffle, with_pauses=False):
             len(dataset),
             MINIBATCH_SIZE * data.MAX_SEQUENCE_LEN)
 
-    for subsequence in dataset:
+    minibatches = assemble_minibatches(dataset, order, batch_size, with_pauses, hidden_states, with_paragraphs)
+
+    if prefetch > 0:
+        return Prefetcher(minibatches, prefetch)
+    return minibatches
+
+def assemble_minibatches(dataset, order, batch_size, with_pauses, hidden_states=None, with_paragraphs=False):
+
+    X_batch = []
+    Y_batch = []
+    if with_pauses:
+        P_batch = []
+    Z_batch = []
+    H_batch = []
+
+    for i in order:
+
+        subsequence = dataset[i]
 
         X_batch.append(subsequence[0])
         Y_batch.append(subsequence[1])
         if with_pauses:
             P_batch.append(subsequence[2])
+        if with_paragraphs:
+            Z_batch.append(subsequence[3])
+        if hidden_states is not None:
+            H_batch.append(hidden_states[i])
         
         if len(X_batch) == batch_size:
 
@@ -61,18 +110,118 @@ def get_minibatch(file_name, batch_size, shuffle, with_pauses=False):
                 P = np.array(P_batch, dtype=theano.config.floatX).T
             
             if with_pauses:
-                yield X, Y, P
+                minibatch = (X, Y, P)
             else:
-                yield X, Y
+                minibatch = (X, Y)
+
+            if with_paragraphs:
+                minibatch += (np.array(Z_batch, dtype=np.int32).T,)
+            if hidden_states is not None:
+                minibatch += (np.array(H_batch, dtype=theano.config.floatX).transpose(1, 0, 2),)
+
+            yield minibatch
 
             X_batch = []
             Y_batch = []
             if with_pauses:
                 P_batch = []
+            Z_batch = []
+            H_batch = []
+
+def compute_perplexity(validate_model, file_name, with_paragraphs=False, subset=None):
+    """Perplexity of validate_model on the dataset, or on subset subsequences of it (see get_minibatch)"""
+    total_neg_log_likelihood = 0
+    total_num_output_samples = 0
+    for minibatch in get_minibatch(file_name, MINIBATCH_SIZE, shuffle=False, with_paragraphs=with_paragraphs, subset=subset):
+        Y = minibatch[1]
+        total_neg_log_likelihood += validate_model(*minibatch)
+        total_num_output_samples += np.prod(Y.shape)
+    print "Total number of validation labels: %d" % total_num_output_samples
+    return np.exp(total_neg_log_likelihood / total_num_output_samples)
+
+def record_validation(ppl, validation_ppl_history, patience, save_model):
+    """
+    Appends the perplexity of the early stopping signal (see EARLY_STOPPING) to the history and calls save_model if it's the
+    best so far. Returns True when the best one is older than the last patience validations, i.e. the training is finished.
+    """
+    validation_ppl_history.append(ppl)
+    best_ppl = min(validation_ppl_history)
+    if ppl <= best_ppl:
+        save_model()
+    elif best_ppl not in validation_ppl_history[-patience:]:
+        print "Finished!"
+        print "Best validation perplexity was %s" % best_ppl
+        return True
+    return False
+
+def record_validation_results(results, validation_ppl_history, patience, model_file):
+    """
+    Prints the (model_file, perplexity) results of validation.ValidationProcess, and with EARLY_STOPPING = "full",
+    records them like record_validation, keeping the best model as model_file. Returns True when the training is finished.
+    The validation history in model_file is the one at the time the model was saved, without its own validation.
+    """
+    finished = False
+    for candidate_file, ppl in results:
+        print "Validation perplexity of %s is %s" % (os.path.basename(candidate_file), np.round(ppl, 4))
+        if EARLY_STOPPING == "full":
+            finished = record_validation(ppl, validation_ppl_history, patience, lambda: os.rename(candidate_file, model_file)) or finished
+        if os.path.exists(candidate_file):
+            os.remove(candidate_file)
+    return finished
+
+def save_checkpoint(net, checkpoint_file, gsums, learning_rate, validation_ppl_history, epoch, checkpoint):
+    """
+    Saves the model with the training state, epoch and checkpoint (the position in the epoch, see the training loop),
+    from which the training continues the same way when main.py is run again. The file is written under
+    a temporary name first, so that a job that is killed while saving keeps its previous checkpoint.
+    """
+    with profiling.phase("checkpoint saving"):
+        net.save(checkpoint_file + ".tmp", gsums=gsums, learning_rate=learning_rate, validation_ppl_history=validation_ppl_history,
+            epoch=epoch, random_state=np.random.get_state(), checkpoint=checkpoint)
+        os.rename(checkpoint_file + ".tmp", checkpoint_file)
+
+class Prefetcher(object):
+    """
+    Runs an iterator in a background thread, keeping up to size items ready in a queue.
+    wait_time is the total time the consumer has waited for the next item.
+    """
+
+    def __init__(self, iterator, size):
+        self.queue = Queue.Queue(maxsize=size)
+        self.wait_time = 0.
+        self.thread = threading.Thread(target=self._produce, args=(iterator,))
+        self.thread.daemon = True # don't block exiting if the consumer stops early
+        self.thread.start()
+
+    def _produce(self, iterator):
+        try:
+            for item in iterator:
+                self.queue.put((item, None))
+        except Exception:
+            self.queue.put((None, sys.exc_info()))
+            return
+        self.queue.put((StopIteration, None))
+
+    def __iter__(self):
+        while True:
+            t0 = time()
+            item, exc_info = self.queue.get()
+            self.wait_time += time() - t0
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if item is StopIteration:
+                return
+            yield item
           
 
 if __name__ == "__main__":
 
+    if MINIBATCH_SIZE % TRAINING_WORKERS != 0:
+        sys.exit("MINIBATCH_SIZE must be divisible by TRAINING_WORKERS")
+
+    if EARLY_STOPPING == "subset" and SUBSET_VALIDATION_MINIBATCHES == 0:
+        sys.exit("EARLY_STOPPING = \"subset\" needs SUBSET_VALIDATION_MINIBATCHES")
+
     if len(sys.argv) > 1:
         model_path = os.path.abspath(sys.argv[1])
     else:
@@ -92,84 +241,137 @@ if __name__ == "__main__":
         initial_learning_rate = float(sys.argv[4])
     else:
         sys.exit("'Learning rate' argument missing!")    
-    
+
+    # joint punctuation and paragraph model, trained on data with EOP tokens (see data.py)
+    joint = len(sys.argv) > 5 and bool(int(sys.argv[5]))
 
     model_file_name = "Model_%s_h%d_lr%s.pcl" % (model_name, num_hidden, initial_learning_rate)
     model_file = model_path + "/" + model_file_name
+    checkpoint_file = model_file + ".checkpoint" # removed when the training finishes
     
     print num_hidden, initial_learning_rate, model_file
 
+    profiling.start(model_file)
+
     word_vocabulary = data.read_vocabulary(data.WORD_VOCAB_FILE)
     punctuation_vocabulary = data.iterable_to_dict(data.PUNCTUATION_VOCABULARY)
 
     x = T.imatrix('x')
     y = T.imatrix('y')
+    z = T.imatrix('z') # paragraph breaks
     lr = T.scalar('lr')
 
-    continue_with_previous = False
-    if os.path.isfile(model_file):
+    # the job was stopped before the training finished, e.g. by the time limit of the queue
+    continue_with_previous = os.path.isfile(checkpoint_file)
+    if not continue_with_previous and os.path.isfile(model_file):
 
         print "Found an existing model with the name %s" % model_file
         sys.exit()
           
     if continue_with_previous:
-        print "Loading previous model state" 
+        print "Loading previous model state from %s" % checkpoint_file
 
-        net, state = models.load(model_file, MINIBATCH_SIZE, x)
+        with profiling.phase("model load"):
+            net, state = models.load(checkpoint_file, MINIBATCH_SIZE, x)
         gsums, learning_rate, validation_ppl_history, starting_epoch, rng = state
-        best_ppl = min(validation_ppl_history)
+        checkpoint = net.checkpoint
 
     else:
         rng = np.random
-        rng.seed(1)
+        rng.seed(SEED)
 
         print "Building model..."
-        net = models.GRU(
+        t0 = time()
+        Model = models.GRUjoint if joint else models.GRU
+        net = Model(
             rng=rng,
             x=x,
             minibatch_size=MINIBATCH_SIZE,
             n_hidden=num_hidden,
             x_vocabulary=word_vocabulary,
-            y_vocabulary=punctuation_vocabulary
+            y_vocabulary=punctuation_vocabulary,
+            attention_window=ATTENTION_WINDOW
             )
 
         starting_epoch = 0
-        best_ppl = np.inf
         validation_ppl_history = []
+        checkpoint = None
         
         gsums = [theano.shared(np.zeros_like(param.get_value(borrow=True))) for param in net.params]
+        profiling.add("model build", time() - t0)
+
+    targets = [y, z] if joint else [y]
+
+    t0 = time()
+    if TRAINING_WORKERS > 1:
+
+        print "Building the model for %d training workers..." % TRAINING_WORKERS
+        # its own random state, so that building it doesn't change the minibatch order, its weights are replaced by the ones of net
+        shard_net = net.__class__(
+            rng=np.random.RandomState(SEED),
+            x=x,
+            minibatch_size=MINIBATCH_SIZE // TRAINING_WORKERS,
+            n_hidden=net.n_hidden,
+            x_vocabulary=net.x_vocabulary,
+            y_vocabulary=net.y_vocabulary,
+            attention_window=net.attention_window
+            )
+
+        trainer = parallel_training.ParallelTrainer(net, shard_net, [x] + targets,
+            shard_net.cost(*targets) + L2_REG * shard_net.L2_sqr / TRAINING_WORKERS,
+            shard_net.cost(*targets),
+            gsums, TRAINING_WORKERS, CLIPPING_THRESHOLD)
+        train_model, validate_model = trainer.train, trainer.validate
 
-    cost = net.cost(y) + L2_REG * net.L2_sqr
+    else:
 
-    gparams = T.grad(cost, net.params)
-    updates = OrderedDict()
+        cost = net.cost(*targets) + L2_REG * net.L2_sqr
 
-    # Compute norm of gradients
-    norm = T.sqrt(T.sum(
-               [T.sum(gparam ** 2) for gparam in gparams]
-           ))
+        gparams = T.grad(cost, net.params)
+        updates = OrderedDict()
+
+        # Compute norm of gradients
+        norm = T.sqrt(T.sum(
+                   [T.sum(gparam ** 2) for gparam in gparams]
+               ))
 
     
-    # Adagrad: "Adaptive subgradient methods for online learning and stochastic optimization" (2011)    
-    for gparam, param, gsum in zip(gparams, net.params, gsums):
-        gparam = T.switch(
-            T.ge(norm, CLIPPING_THRESHOLD),
-            gparam / norm * CLIPPING_THRESHOLD,
-            gparam
-        ) # Clipping of gradients
-        updates[gsum] = gsum + (gparam ** 2)
-        updates[param] = param - lr * (gparam / (T.sqrt(updates[gsum] + 1e-6)))
-
-    train_model = theano.function(
-        inputs=[x, y, lr],
-        outputs=cost,
-        updates=updates
-    )
-
-    validate_model = theano.function(
-        inputs=[x, y],
-        outputs=net.cost(y)
-    )
+        # Adagrad: "Adaptive subgradient methods for online learning and stochastic optimization" (2011)    
+        for gparam, param, gsum in zip(gparams, net.params, gsums):
+            gparam = T.switch(
+                T.ge(norm, CLIPPING_THRESHOLD),
+                gparam / norm * CLIPPING_THRESHOLD,
+                gparam
+            ) # Clipping of gradients
+            updates[gsum] = gsum + (gparam ** 2)
+            updates[param] = param - lr * (gparam / (T.sqrt(updates[gsum] + 1e-6)))
+
+        train_model = theano.function(
+            inputs=[x] + targets + [lr],
+            outputs=cost,
+            updates=updates
+        )
+
+        validate_model = theano.function(
+            inputs=[x] + targets,
+            outputs=net.cost(*targets)
+        )
+
+    profiling.add("graph compile", time() - t0)
+    train_model = profiling.timed("training steps", train_model)
+    validate_model = profiling.timed("validation steps", validate_model)
+
+    def save_model():
+        with profiling.phase("model saving"):
+            net.save(model_file, gsums=gsums, learning_rate=learning_rate, validation_ppl_history=validation_ppl_history, best_validation_ppl=min(validation_ppl_history), epoch=epoch, random_state=rng.get_state())
+
+    if ASYNC_VALIDATION:
+        validator = validation.ValidationProcess(VALIDATION_THEANO_FLAGS)
+        # the models that were waiting for validation when the training was stopped
+        for candidate_file in sorted(glob.glob(model_file + ".epoch*"), key=lambda f: int(f.rsplit(".epoch", 1)[1])):
+            validator.submit(candidate_file)
+
+    finished = False
 
     print "Training..."
     for epoch in range(starting_epoch, MAX_EPOCHS):
@@ -180,31 +382,68 @@ if __name__ == "__main__":
         learning_rate = np.float32(initial_learning_rate * np.exp(-LR_DECAY*epoch))
         print "Learning rate is %s" % np.round(learning_rate, 5)
         
-        for X, Y in get_minibatch(data.TRAIN_FILE, MINIBATCH_SIZE, shuffle=True):
-            total_neg_log_likelihood += train_model(X, Y, learning_rate)
+        if checkpoint is not None: # resumed in the middle of this epoch, see save_checkpoint
+            np.random.set_state(checkpoint["epoch_random_state"])
+            t0 -= checkpoint["elapsed"]
+            total_neg_log_likelihood = checkpoint["total_neg_log_likelihood"]
+            total_num_output_samples = checkpoint["total_num_output_samples"]
+            iteration = checkpoint["iteration"]
+            checkpoint = None
+        epoch_random_state = np.random.get_state() # the minibatch order of the epoch is drawn from this
+
+        minibatches = get_minibatch(data.TRAIN_FILE, MINIBATCH_SIZE, shuffle=True, with_paragraphs=joint, start=iteration)
+        last_checkpoint_time = time()
+        for minibatch in minibatches:
+            X, Y = minibatch[:2]
+            total_neg_log_likelihood += train_model(*(minibatch + (learning_rate,)))
             total_num_output_samples += np.prod(Y.shape)
             iteration += 1
             if iteration % 100 == 0:
                 sys.stdout.write("PPL: %.4f; Speed: %.2f sps\n" % (np.exp(total_neg_log_likelihood / total_num_output_samples), total_num_output_samples / max(time() - t0, 1e-100)))
                 sys.stdout.flush()
+            if SUBSET_VALIDATION_MINIBATCHES and iteration % SUBSET_VALIDATION_INTERVAL == 0:
+                ppl = compute_perplexity(validate_model, data.DEV_FILE, with_paragraphs=joint, subset=SUBSET_VALIDATION_MINIBATCHES * MINIBATCH_SIZE)
+                print "Subset validation perplexity is %s" % np.round(ppl, 4)
+                if EARLY_STOPPING == "subset":
+                    finished = record_validation(ppl, validation_ppl_history, SUBSET_PATIENCE, save_model)
+            if ASYNC_VALIDATION:
+                finished = record_validation_results(validator.get_results(), validation_ppl_history, PATIENCE_EPOCHS, model_file) or finished
+            if finished:
+                break
+            if CHECKPOINT_MINUTES and time() - last_checkpoint_time > CHECKPOINT_MINUTES * 60:
+                save_checkpoint(net, checkpoint_file, gsums, learning_rate, validation_ppl_history, epoch,
+                    {"iteration": iteration, "epoch_random_state": epoch_random_state, "elapsed": time() - t0,
+                     "total_neg_log_likelihood": total_neg_log_likelihood, "total_num_output_samples": total_num_output_samples})
+                last_checkpoint_time = time()
         print "Total number of training labels: %d" % total_num_output_samples
-        
-        total_neg_log_likelihood = 0
-        total_num_output_samples = 0
-        for X, Y in get_minibatch(data.DEV_FILE, MINIBATCH_SIZE, shuffle=False):
-            total_neg_log_likelihood += validate_model(X, Y)
-            total_num_output_samples += np.prod(Y.shape)
-        print "Total number of validation labels: %d" % total_num_output_samples
-        
-        ppl = np.exp(total_neg_log_likelihood / total_num_output_samples)
-        validation_ppl_history.append(ppl)
+        if PREFETCH_BATCHES > 0:
+            print "Waited for training data: %.2f sec (%.1f%% of the epoch)" % (minibatches.wait_time, minibatches.wait_time / max(time() - t0, 1e-100) * 100)
+            profiling.add("waiting for training data", minibatches.wait_time)
+        if finished:
+            break
 
-        print "Validation perplexity is %s" % np.round(ppl, 4)
+        if (epoch + 1) % FULL_VALIDATION_EPOCHS == 0:
+            if ASYNC_VALIDATION:
+                candidate_file = "%s.epoch%d" % (model_file, epoch)
+                with profiling.phase("model saving"):
+                    net.save(candidate_file, gsums=gsums, learning_rate=learning_rate, validation_ppl_history=validation_ppl_history, epoch=epoch, random_state=rng.get_state())
+                validator.submit(candidate_file)
+            else:
+                ppl = compute_perplexity(validate_model, data.DEV_FILE, with_paragraphs=joint)
+                print "Validation perplexity is %s" % np.round(ppl, 4)
+                if EARLY_STOPPING == "full" and record_validation(ppl, validation_ppl_history, PATIENCE_EPOCHS, save_model):
+                    break
 
-        if ppl <= best_ppl:
-            best_ppl = ppl
-            net.save(model_file, gsums=gsums, learning_rate=learning_rate, validation_ppl_history=validation_ppl_history, best_validation_ppl=best_ppl, epoch=epoch, random_state=rng.get_state())
-        elif best_ppl not in validation_ppl_history[-PATIENCE_EPOCHS:]:
-            print "Finished!"
-            print "Best validation perplexity was %s" % best_ppl
-            break
+        save_checkpoint(net, checkpoint_file, gsums, learning_rate, validation_ppl_history, epoch + 1,
+            {"iteration": 0, "epoch_random_state": np.random.get_state(), "elapsed": 0.,
+             "total_neg_log_likelihood": 0, "total_num_output_samples": 0})
+
+    if ASYNC_VALIDATION:
+        record_validation_results(validator.get_results(wait=True), validation_ppl_history, PATIENCE_EPOCHS, model_file)
+        validator.close()
+
+    if os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    if TRAINING_WORKERS > 1:
+        trainer.close()
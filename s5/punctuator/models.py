@@ -28,6 +28,11 @@ def _slice(tensor, size, i):
     else:
         raise NotImplementedError("Tensor should be 1 or 2 dimensional")
 
+def _pad(tensor, size):
+    """Pads the 0-axis of the tensor with size zeros at both ends"""
+    padding = T.zeros((size,) + tuple(tensor.shape[i] for i in range(1, tensor.ndim)), dtype=tensor.dtype)
+    return T.concatenate([padding, tensor, padding], axis=0)
+
 def weights_const(i, o, name, const, keepdims=False):
     W_values = np.ones(_get_shape(i, o, keepdims)).astype(theano.config.floatX) * const
     return theano.shared(value=W_values, name=name, borrow=True)
@@ -45,19 +50,22 @@ def weights_Glorot(i, o, name, rng, is_logistic_sigmoid=False, keepdims=False):
     W_values = rng.uniform(low=-d, high=d, size=_get_shape(i, o, keepdims)).astype(theano.config.floatX)
     return theano.shared(value=W_values, name=name, borrow=True)
 
-def load(file_path, minibatch_size, x, p=None):
+def load(file_path, minibatch_size, x, p=None, mask=None):
     import models
-    import cPickle
+    import export_model
     import theano
     import numpy as np
 
-    with open(file_path, 'rb') as f:
-        state = cPickle.load(f)
+    state = export_model.load_state(file_path)
 
     Model = getattr(models, state["type"])
 
+    # only set for GRU models with local attention
+    kwargs = {"attention_window": state["attention_window"]} if state.get("attention_window") else {}
+
     rng = np.random
-    rng.set_state(state["random_state"])
+    if state["random_state"] is not None: # exported models don't have it
+        rng.set_state(state["random_state"])
 
     net = Model(
         rng=rng,
@@ -67,11 +75,17 @@ def load(file_path, minibatch_size, x, p=None):
         x_vocabulary=state["x_vocabulary"],
         y_vocabulary=state["y_vocabulary"],
         stage1_model_file_name=state.get("stage1_model_file_name", None),
-        p=p
+        p=p,
+        mask=mask,
+        **kwargs
         )
 
     for net_param, state_param in zip(net.params, state["params"]):
-        net_param.set_value(state_param, borrow=True)
+        net_param.set_value(export_model.dequantize(state_param), borrow=True)
+
+    net.decoding = state.get("decoding") # window settings for inference, see tune_decoding.py
+
+    net.checkpoint = state.get("checkpoint") # position in the interrupted epoch, see main.save_checkpoint
 
     gsums = [theano.shared(gsum) for gsum in state["gsums"]] if state["gsums"] else None
 
@@ -100,13 +114,21 @@ class GRULayer(object):
 
         self.params = [self.W_x, self.W_h, self.b, self.W_x_h, self.W_h_h, self.b_h]
 
+    def project_inputs(self, x):
+        """
+        Input side pre-activations of the gates and of the candidate hidden state for all time steps of x (time is the 0-axis).
+        They don't depend on the recurrence, so they are computed before the scan, with one product of the fused input weights.
+        """
+        return T.dot(x, T.concatenate([self.W_x, self.W_x_h], axis=1)) + T.concatenate([self.b, self.b_h])
+
     def step(self, x_t, h_tm1):
+        """x_t is the time step of project_inputs"""
 
-        rz = T.nnet.sigmoid(T.dot(x_t, self.W_x) + T.dot(h_tm1, self.W_h) + self.b)
+        rz = T.nnet.sigmoid(x_t[:, :self.n_out*2] + T.dot(h_tm1, self.W_h))
         r = _slice(rz, self.n_out, 0)
         z = _slice(rz, self.n_out, 1)
 
-        h = T.tanh(T.dot(x_t, self.W_x_h) + T.dot(h_tm1 * r, self.W_h_h) + self.b_h)
+        h = T.tanh(x_t[:, self.n_out*2:] + T.dot(h_tm1 * r, self.W_h_h))
 
         h_t = z * h_tm1 + (1. - z) * h
 
@@ -114,7 +136,11 @@ class GRULayer(object):
 
 class GRU(object):
 
-    def __init__(self, rng, x, minibatch_size, n_hidden, x_vocabulary, y_vocabulary, stage1_model_file_name=None, p=None):
+    def __init__(self, rng, x, minibatch_size, n_hidden, x_vocabulary, y_vocabulary, stage1_model_file_name=None, p=None, mask=None, attention_window=None):
+        """
+        With attention_window set, each output step attends only to the attention_window words on each side of its gap
+        instead of the whole sequence, so the cost of the attention grows linearly with the sequence length.
+        """
 
         assert not stage1_model_file_name and not p, "Stage 1 model can't have stage 1 model"
 
@@ -124,6 +150,7 @@ class GRU(object):
         self.n_hidden = n_hidden
         self.x_vocabulary = x_vocabulary
         self.y_vocabulary = y_vocabulary
+        self.attention_window = attention_window
 
         # input model
         pretrained_embs_path = "We.pcl"
@@ -175,13 +202,25 @@ class GRU(object):
             h_b_t = self.GRU_b.step(x_t=x_b_t, h_tm1=h_b_tm1)
             return [h_f_t, h_b_t]
 
-        def output_recurrence(x_t, h_tm1, Wa_h, Wa_y, Wf_h, Wf_c, Wf_f, bf, Wy, by, context, projected_context):
+        def masked_input_recurrence(x_f_t, x_b_t, m_f_t, m_b_t, h_f_tm1, h_b_tm1):
+            h_f_t, h_b_t = input_recurrence(x_f_t, x_b_t, h_f_tm1, h_b_tm1)
+            # padded time steps carry the previous hidden state over unchanged
+            h_f_t = m_f_t[:, None] * h_f_t + (1. - m_f_t[:, None]) * h_f_tm1
+            h_b_t = m_b_t[:, None] * h_b_t + (1. - m_b_t[:, None]) * h_b_tm1
+            return [h_f_t, h_b_t]
+
+        def output_recurrence(x_t, h_tm1, Wa_h, Wa_y, Wf_h, Wf_c, Wf_f, bf, Wy, by, context, projected_context, mask=None):
 
             # Attention model
             h_a = T.tanh(projected_context + T.dot(h_tm1, Wa_h))
             alphas = T.exp(T.dot(h_a, Wa_y))
             alphas = alphas.reshape((alphas.shape[0], alphas.shape[1])) # drop 2-axis (sized 1)
-            alphas = alphas / alphas.sum(axis=0, keepdims=True) # These 3 lines is the softmax
+            if mask is not None:
+                alphas = alphas * mask # padded positions get no attention
+            if attention_window:
+                alphas = alphas / T.maximum(alphas.sum(axis=0, keepdims=True), 1e-30) # the window of a padded time step has no words
+            else:
+                alphas = alphas / alphas.sum(axis=0, keepdims=True) # These 3 lines is the softmax
             weighted_context = (context * alphas[:,:,None]).sum(axis=0)
                         
             h_t = self.GRU.step(x_t=x_t, h_tm1=h_tm1)
@@ -196,20 +235,47 @@ class GRU(object):
 
             return [h_t, hf_t, y_t, alphas]
 
+        def local_output_recurrence(t, x_t, h_tm1, Wa_h, Wa_y, Wf_h, Wf_c, Wf_f, bf, Wy, by, context, projected_context, mask):
+            # context, projected_context and mask are padded with attention_window positions at both ends,
+            # so the attention_window words on each side of the gap before x_t start at t + 1
+            window = slice(t + 1, t + 1 + 2 * attention_window)
+            return output_recurrence(x_t, h_tm1, Wa_h, Wa_y, Wf_h, Wf_c, Wf_f, bf, Wy, by, context[window], projected_context[window], mask[window])
+
         x_emb = self.We[x.flatten()].reshape((x.shape[0], minibatch_size, n_emb))
 
-        [h_f_t, h_b_t], _ = theano.scan(fn=input_recurrence,
-            sequences=[x_emb, x_emb[::-1]], # forward and backward sequences
-            outputs_info=[self.GRU_f.h0, self.GRU_b.h0])
+        # forward and backward sequences
+        x_f = self.GRU_f.project_inputs(x_emb)
+        x_b = self.GRU_b.project_inputs(x_emb[::-1])
+
+        if mask is None:
+            [h_f_t, h_b_t], _ = theano.scan(fn=input_recurrence,
+                sequences=[x_f, x_b],
+                outputs_info=[self.GRU_f.h0, self.GRU_b.h0])
+        else:
+            # mask is 1 for real tokens and 0 for padding at the end of shorter sequences in the minibatch
+            [h_f_t, h_b_t], _ = theano.scan(fn=masked_input_recurrence,
+                sequences=[x_f, x_b, mask, mask[::-1]],
+                outputs_info=[self.GRU_f.h0, self.GRU_b.h0])
 
         # 0-axis is time steps, 1-axis is batch size and 2-axis is hidden layer size
         context = T.concatenate([h_f_t, h_b_t[::-1]], axis=2)
         projected_context = T.dot(context, self.Wa_c) + self.ba
 
-        [_, self.last_hidden_states, self.y, self.alphas], _ = theano.scan(fn=output_recurrence,
-            sequences=[context[1:]], # ignore the 1st word in context, because there's no punctuation before that
-            non_sequences=[self.Wa_h, self.Wa_y, self.Wf_h, self.Wf_c, self.Wf_f, self.bf, self.Wy, self.by, context, projected_context],
-            outputs_info=[self.GRU.h0, None, None, None])
+        output_weights = [self.Wa_h, self.Wa_y, self.Wf_h, self.Wf_c, self.Wf_f, self.bf, self.Wy, self.by]
+
+        output_inputs = self.GRU.project_inputs(context[1:]) # ignore the 1st word in context, because there's no punctuation before that
+
+        if attention_window:
+            window_mask = mask if mask is not None else T.ones(x.shape, dtype=theano.config.floatX) # the padding gets no attention
+            [_, self.last_hidden_states, self.y, self.alphas], _ = theano.scan(fn=local_output_recurrence,
+                sequences=[T.arange(context.shape[0] - 1), output_inputs],
+                non_sequences=output_weights + [_pad(context, attention_window), _pad(projected_context, attention_window), _pad(window_mask, attention_window)],
+                outputs_info=[self.GRU.h0, None, None, None])
+        else:
+            [_, self.last_hidden_states, self.y, self.alphas], _ = theano.scan(fn=output_recurrence,
+                sequences=[output_inputs],
+                non_sequences=output_weights + [context, projected_context] + ([mask] if mask is not None else []),
+                outputs_info=[self.GRU.h0, None, None, None])
 
         print "Number of parameters is %d" % sum(np.prod(p.shape.eval()) for p in self.params)
 
@@ -221,7 +287,7 @@ class GRU(object):
         output = self.y.reshape((num_outputs, self.y.shape[2]))
         return -T.sum(T.log(output[T.arange(num_outputs), y.flatten()]))
 
-    def save(self, file_path, gsums=None, learning_rate=None, validation_ppl_history=None, best_validation_ppl=None, epoch=None, random_state=None):
+    def save(self, file_path, gsums=None, learning_rate=None, validation_ppl_history=None, best_validation_ppl=None, epoch=None, random_state=None, checkpoint=None):
         import cPickle
         state = {
             "type":                     self.__class__.__name__,
@@ -229,12 +295,14 @@ class GRU(object):
             "x_vocabulary":             self.x_vocabulary,
             "y_vocabulary":             self.y_vocabulary,
             "stage1_model_file_name":   self.stage1_model_file_name if hasattr(self, "stage1_model_file_name") else None,
+            "attention_window":         getattr(self, "attention_window", None),
             "params":                   [p.get_value(borrow=True) for p in self.params],
             "gsums":                    [s.get_value(borrow=True) for s in gsums] if gsums else None,
             "learning_rate":            learning_rate,
             "validation_ppl_history":   validation_ppl_history,
             "epoch":                    epoch,
-            "random_state":             random_state
+            "random_state":             random_state,
+            "checkpoint":               checkpoint
         }
 
         with open(file_path, 'wb') as f:
@@ -243,12 +311,12 @@ class GRU(object):
 
 class GRUstage2(GRU):
 
-    def __init__(self, rng, x, minibatch_size, n_hidden, x_vocabulary, y_vocabulary, stage1_model_file_name, p=None):
+    def __init__(self, rng, x, minibatch_size, n_hidden, x_vocabulary, y_vocabulary, stage1_model_file_name, p=None, mask=None, stage1_hidden_states=None):
 
         y_vocabulary_size = len(y_vocabulary)
 
         self.stage1_model_file_name = stage1_model_file_name
-        self.stage1, _ = load(stage1_model_file_name, minibatch_size, x)
+        self.stage1, _ = load(stage1_model_file_name, minibatch_size, x, mask=mask)
 
         self.n_hidden = n_hidden
         self.x_vocabulary = x_vocabulary
@@ -262,17 +330,24 @@ class GRUstage2(GRU):
         self.params = [self.Wy, self.by]
         self.params += self.GRU.params
 
-        def recurrence(x_t, p_t, h_tm1, Wy, by):
+        def recurrence(x_t, h_tm1, Wy, by):
 
-            h_t = self.GRU.step(x_t=T.concatenate((x_t, p_t.dimshuffle((0, 'x'))), axis=1), h_tm1=h_tm1)
+            h_t = self.GRU.step(x_t=x_t, h_tm1=h_tm1)
 
             z = T.dot(h_t, Wy) + by
             y_t = T.nnet.softmax(z)
 
             return [h_t, y_t]
 
+        # stage 1 is frozen, so its hidden states can be computed once in advance and given as stage1_hidden_states
+        if stage1_hidden_states is None:
+            stage1_hidden_states = self.stage1.last_hidden_states
+
+        num_steps = T.minimum(stage1_hidden_states.shape[0], p.shape[0])
+        inputs = T.concatenate((stage1_hidden_states[:num_steps], p[:num_steps].dimshuffle((0, 1, 'x'))), axis=2)
+
         [_, self.y], _ = theano.scan(fn=recurrence,
-            sequences=[self.stage1.last_hidden_states, p],
+            sequences=[self.GRU.project_inputs(inputs)],
             non_sequences=[self.Wy, self.by],
             outputs_info=[self.GRU.h0, None])
 
@@ -281,3 +356,37 @@ class GRUstage2(GRU):
 
         self.L1 = sum(abs(p).sum() for p in self.params)
         self.L2_sqr = sum((p**2).sum() for p in self.params)
+
+
+class GRUjoint(GRU):
+    """
+    Punctuation and paragraph break model. Shares the embeddings, the bi-directional encoder, the attention and the output
+    recurrence with GRU, and has a second softmax output on the late fused hidden states, which gives the probability of a
+    paragraph break (EOP) in each gap, so that both can be restored in one pass.
+    """
+
+    N_PARAGRAPH_CLASSES = 2 # no break or EOP, see data.PARAGRAPH_VOCABULARY
+
+    def __init__(self, rng, x, minibatch_size, n_hidden, x_vocabulary, y_vocabulary, stage1_model_file_name=None, p=None, mask=None, attention_window=None):
+
+        super(GRUjoint, self).__init__(rng, x, minibatch_size, n_hidden, x_vocabulary, y_vocabulary, stage1_model_file_name, p, mask, attention_window)
+
+        # paragraph output model
+        self.Wp = weights_const(n_hidden, self.N_PARAGRAPH_CLASSES, 'Wp', 0)
+        self.bp = weights_const(1, self.N_PARAGRAPH_CLASSES, 'bp', 0)
+
+        self.params += [self.Wp, self.bp]
+
+        hf = self.last_hidden_states
+        z = T.dot(hf.reshape((hf.shape[0]*hf.shape[1], n_hidden)), self.Wp) + self.bp
+        self.y_paragraph = T.nnet.softmax(z).reshape((hf.shape[0], hf.shape[1], self.N_PARAGRAPH_CLASSES))
+
+        print "Number of parameters with the paragraph output is %d" % sum(np.prod(p.shape.eval()) for p in self.params)
+
+        self.L1 = sum(abs(p).sum() for p in self.params)
+        self.L2_sqr = sum((p**2).sum() for p in self.params)
+
+    def cost(self, y, y_paragraph):
+        num_outputs = self.y.shape[0]*self.y.shape[1] # time steps * number of parallel sequences in batch
+        output = self.y_paragraph.reshape((num_outputs, self.N_PARAGRAPH_CLASSES))
+        return super(GRUjoint, self).cost(y) - T.sum(T.log(output[T.arange(num_outputs), y_paragraph.flatten()]))
@@ -1,17 +1,23 @@
 # coding: utf-8
 from __future__ import division
 
-import models
 import data
+import profiling
 
-import theano
 import sys
+import os
+import re
 import codecs
 
-import theano.tensor as T
 import numpy as np
 
 MAX_SUBSEQUENCE_LEN = 200
+LOCAL_ATTENTION_MAX_SUBSEQUENCE_LEN = 1000 # for models with local attention, whose cost per word doesn't grow with the window
+
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "theano") # "theano" or "numpy". The numpy engine does not import Theano and needs no compilation.
+
+digits = re.compile(r"\d")
+is_number = lambda x: len(digits.sub("", x)) / len(x) < 0.6 # as in local/saving_numbers.py
 
 def to_array(arr, dtype=np.int32):
     # minibatch of 1 sequence as column
@@ -23,96 +29,301 @@ def convert_punctuation_to_readable(punct_token):
     else:
         return punct_token[0]
 
-def restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function):
-    i = 0
-    with codecs.open(output_file, 'w', 'utf-8') as f_out:
-        while True:
+def to_padded_array(arrs, minibatch_size, dtype=np.int32):
+    # minibatch of sequences as columns, shorter ones padded at the end. Unused columns are left as zero padding with a full mask.
+    X = np.zeros((max(len(arr) for arr in arrs), minibatch_size), dtype=dtype)
+    mask = np.ones(X.shape, dtype=np.float64)
+    for b, arr in enumerate(arrs):
+        X[:len(arr), b] = arr
+        mask[len(arr):, b] = 0.
+    return X, mask
+
+def load_model(model_file, use_pauses, minibatch_size=1, masked=False):
+    """
+    Returns the model and a prediction function with the inputs (x[, p][, mask]), using the engine set by INFERENCE_ENGINE.
+    Float inputs can be float64, they are cast to the precision of the model.
+    For a joint punctuation and paragraph model the function returns a list of both outputs, see split_outputs.
+    """
+    if INFERENCE_ENGINE == "numpy":
+
+        import numpy_models
 
-            subsequence = text[i:i+MAX_SUBSEQUENCE_LEN]
-            subsequence_pauses = pauses[i:i+MAX_SUBSEQUENCE_LEN]
+        print "Loading model parameters..."
+        with profiling.phase("model load"):
+            net = numpy_models.load(model_file)
+
+        if use_pauses and masked:
+            predict = lambda x, p, mask: net.predict(x, p, mask)
+        elif use_pauses:
+            predict = lambda x, p: net.predict(x, p)
+        elif masked:
+            predict = lambda x, mask: net.predict(x, mask=mask)
+        else:
+            predict = lambda x: net.predict(x)
 
-            if len(subsequence) == 0:
-                break
+    else:
 
-            converted_subsequence = [word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence]
+        import models
+        import theano
+        import theano.tensor as T
 
-            y = predict_function(to_array(converted_subsequence), to_array(subsequence_pauses, dtype=theano.config.floatX))
+        x = T.imatrix('x')
+        p = T.matrix('p') if use_pauses else None
+        mask = T.matrix('mask') if masked else None
 
-            f_out.write(subsequence[0])
+        print "Loading model parameters..."
+        with profiling.phase("model load"):
+            net, _ = models.load(model_file, minibatch_size, x, p, mask=mask)
 
-            last_eos_idx = 0
-            punctuations = []
-            for y_t in y:
+        print "Building model..."
+        with profiling.phase("graph compile"):
+            predict = theano.function(
+                inputs=[v for v in [x, p, mask] if v is not None],
+                outputs=[net.y, net.y_paragraph] if hasattr(net, "y_paragraph") else net.y,
+                allow_input_downcast=True
+            )
+
+    return net, profiling.timed("model calls", predict)
+
+def split_outputs(y):
+    """Returns the punctuation probabilities and the paragraph break probabilities, or None if the model only punctuates"""
+    if isinstance(y, list):
+        return y[0], y[1]
+    return y, None
+
+def get_max_subsequence_len(net):
+    """
+    Window length for the model: the one chosen by tune_decoding.py if the model has it, otherwise a longer window for models
+    with local attention, which recomputes fewer words after the last EOS of a window.
+    """
+    decoding = getattr(net, "decoding", None) or {}
+    if decoding.get("max_subsequence_len"):
+        return decoding["max_subsequence_len"]
+    return LOCAL_ATTENTION_MAX_SUBSEQUENCE_LEN if getattr(net, "attention_window", None) else MAX_SUBSEQUENCE_LEN
+
+def get_overlap(net):
+    """The overlap of the windows chosen by tune_decoding.py (see get_step), or None if the model doesn't have one"""
+    decoding = getattr(net, "decoding", None) or {}
+    return decoding.get("overlap")
+
+def get_punctuations(y, reverse_punctuation_vocabulary):
+    return [reverse_punctuation_vocabulary[np.argmax(y_t.flatten())] for y_t in y]
+
+def get_paragraph_breaks(y_paragraph):
+    return [data.PARAGRAPH_VOCABULARY[np.argmax(y_t.flatten())] == data.EOP for y_t in y_paragraph]
+
+def get_step(subsequence, punctuations, eos_tokens=data.EOS_TOKENS, overlap=None):
+    """
+    Returns the number of words of the window to write. With overlap None the window is written up to its last predicted EOS,
+    otherwise up to its last overlap words, which are predicted again with more right context in the next window.
+    """
+    if overlap is not None and subsequence[-1] != data.END:
+        return max(1, len(subsequence) - 1 - overlap)
+
+    last_eos_idx = 0
+    for j, punctuation in enumerate(punctuations):
+        if punctuation in eos_tokens:
+            last_eos_idx = j + 1 # we intentionally want the index of next element
+
+    if subsequence[-1] == data.END:
+        return len(subsequence) - 1
+    elif last_eos_idx != 0:
+        return last_eos_idx
+    else:
+        return len(subsequence) - 1
+
+def write_subsequence(f_out, subsequence, punctuations, step, paragraph_breaks=None):
+    f_out.write(subsequence[0])
+    for j in range(step):
+        f_out.write(" " + punctuations[j] + " " if punctuations[j] != data.SPACE else " ")
+        if paragraph_breaks and paragraph_breaks[j] and subsequence[1+j] != data.END: # no break at the end of the text
+            f_out.write(data.EOP + " ")
+        if j < step - 1:
+            f_out.write(subsequence[1+j])
+
+def replace_numbers(words):
+    """
+    The model input words, with the numbers replaced by NUM as local/saving_numbers.py did for the punctuation model
+    (with mask_numbers, see punctuate). Models trained on text with masked numbers have NUM in their vocabulary, and for
+    other models it's UNK. The output is written from the original words, so the numbers stay in their positions.
+    """
+    return [data.NUM if is_number(w) else w for w in words]
+
+def split_input(input_text, punctuation_vocabulary, punctuation_mapping=data.PUNCTUATION_MAPPING):
+    """Returns the words of the input text, ending with END, and the pause durations if it is pause annotated"""
+    tokens = input_text.split()
+    text = [w for w in tokens if w not in punctuation_vocabulary and w not in punctuation_mapping and w != data.EOP and not w.startswith(data.PAUSE_PREFIX)] + [data.END]
+    pauses = [float(s.replace(data.PAUSE_PREFIX,"").replace(">","")) for s in tokens if s.startswith(data.PAUSE_PREFIX)]
+    return text, pauses
+
+def punctuate_window(f_out, subsequence, subsequence_pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, eos_tokens=data.EOS_TOKENS, overlap=None, mask_numbers=False):
+    """Punctuates one window, writes it up to the last predicted EOS (see get_step) and returns the number of words written"""
+    with profiling.phase("vocabulary mapping"):
+        words = replace_numbers(subsequence) if mask_numbers else subsequence
+        converted_subsequence = [word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in words]
+
+    if subsequence_pauses is None:
+        y = predict_function(to_array(converted_subsequence))
+    else:
+        y = predict_function(to_array(converted_subsequence), to_array(subsequence_pauses, dtype=np.float64))
 
-                p_i = np.argmax(y_t.flatten())
-                punctuation = reverse_punctuation_vocabulary[p_i]
+    y, y_paragraph = split_outputs(y)
 
-                punctuations.append(punctuation)
+    with profiling.phase("output decoding"):
+        punctuations = get_punctuations(y, reverse_punctuation_vocabulary)
+        paragraph_breaks = get_paragraph_breaks(y_paragraph) if y_paragraph is not None else None
+        step = get_step(subsequence, punctuations, eos_tokens, overlap)
+    with profiling.phase("output writing"):
+        write_subsequence(f_out, subsequence, punctuations, step, paragraph_breaks)
 
-                if punctuation in data.EOS_TOKENS:
-                    last_eos_idx = len(punctuations) # we intentionally want the index of next element
+    return step
 
+def punctuate(f_out, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, eos_tokens=data.EOS_TOKENS, max_subsequence_len=MAX_SUBSEQUENCE_LEN, overlap=None,
+              mask_numbers=False):
+    """
+    Writes the punctuated text to the open file f_out. pauses is None for models without pause input.
+    With mask_numbers, the numbers are NUM for the model (see replace_numbers), as for the punctuation model in denormalization.
+    """
+    i = 0
+    while True:
+
+        subsequence = text[i:i+max_subsequence_len]
+
+        if len(subsequence) == 0:
+            break
+
+        subsequence_pauses = pauses[i:i+max_subsequence_len] if pauses is not None else None
+
+        step = punctuate_window(f_out, subsequence, subsequence_pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, eos_tokens, overlap, mask_numbers)
+
+        if subsequence[-1] == data.END:
+            break
+
+        i += step
+
+class StreamingPunctuator(object):
+    """
+    Punctuates words as they arrive, e.g. from partial ASR output. A window is run as soon as max_subsequence_len words
+    (and pauses) have arrived, and the text up to the last predicted EOS is written to f_out. Only the unwritten words are kept,
+    so memory is bounded by the window size. The output is the same as from punctuate() over the whole text.
+    """
+
+    def __init__(self, f_out, word_vocabulary, punctuation_vocabulary, predict_function, use_pauses=False, eos_tokens=data.EOS_TOKENS, punctuation_mapping=data.PUNCTUATION_MAPPING,
+                 max_subsequence_len=MAX_SUBSEQUENCE_LEN, overlap=None, mask_numbers=False):
+        self.f_out = f_out
+        self.word_vocabulary = word_vocabulary
+        self.punctuation_vocabulary = punctuation_vocabulary
+        self.reverse_punctuation_vocabulary = {v:k for k,v in punctuation_vocabulary.items()}
+        self.predict_function = predict_function
+        self.use_pauses = use_pauses
+        self.eos_tokens = eos_tokens
+        self.punctuation_mapping = punctuation_mapping
+        self.max_subsequence_len = max_subsequence_len
+        self.overlap = overlap
+        self.mask_numbers = mask_numbers
+
+        self.subsequence = []
+        self.subsequence_pauses = []
+
+    def add(self, tokens):
+        """Adds tokens in the same format as the input of punctuator.py. Punctuation tokens are ignored."""
+        for token in tokens:
+            if token.startswith(data.PAUSE_PREFIX):
+                self.subsequence_pauses.append(float(token.replace(data.PAUSE_PREFIX,"").replace(">","")))
+            elif token not in self.punctuation_vocabulary and token not in self.punctuation_mapping and token != data.EOP:
+                self.subsequence.append(token)
+
+            while len(self.subsequence) >= self.max_subsequence_len and (not self.use_pauses or len(self.subsequence_pauses) >= self.max_subsequence_len):
+                self._punctuate_window(self.subsequence[:self.max_subsequence_len])
+
+    def close(self):
+        """Punctuates the words that are left at the end of the stream"""
+        self.subsequence.append(data.END)
+
+        if self.use_pauses and not self.subsequence_pauses:
+            self.subsequence_pauses = [0.0 for _ in range(len(self.subsequence)-1)]
+
+        while self.subsequence:
+            subsequence = self.subsequence[:self.max_subsequence_len]
+            self._punctuate_window(subsequence)
             if subsequence[-1] == data.END:
-                step = len(subsequence) - 1
-            elif last_eos_idx != 0:
-                step = last_eos_idx
-            else:
-                step = len(subsequence) - 1
+                break
 
-            for j in range(step):
-                f_out.write(" " + punctuations[j] + " " if punctuations[j] != data.SPACE else " ")
-                if j < step - 1:
-                    f_out.write(subsequence[1+j])
+        self.subsequence = []
+        self.subsequence_pauses = []
 
-            if subsequence[-1] == data.END:
-                break
+    def _punctuate_window(self, subsequence):
+        subsequence_pauses = self.subsequence_pauses[:self.max_subsequence_len] if self.use_pauses else None
 
-            i += step
+        step = punctuate_window(self.f_out, subsequence, subsequence_pauses, self.word_vocabulary, self.reverse_punctuation_vocabulary, self.predict_function, self.eos_tokens, self.overlap,
+                                self.mask_numbers)
+        self.f_out.flush()
 
-def restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict_function):
-    i = 0
+        self.subsequence = self.subsequence[step:]
+        self.subsequence_pauses = self.subsequence_pauses[step:]
+
+def restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=MAX_SUBSEQUENCE_LEN, overlap=None, mask_numbers=False):
     with codecs.open(output_file, 'w', 'utf-8') as f_out:
-        while True:
+        punctuate(f_out, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=max_subsequence_len, overlap=overlap, mask_numbers=mask_numbers)
 
-            subsequence = text[i:i+MAX_SUBSEQUENCE_LEN]
+def restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=MAX_SUBSEQUENCE_LEN, overlap=None, mask_numbers=False):
+    with codecs.open(output_file, 'w', 'utf-8') as f_out:
+        punctuate(f_out, text, None, word_vocabulary, reverse_punctuation_vocabulary, predict_function, max_subsequence_len=max_subsequence_len, overlap=overlap, mask_numbers=mask_numbers)
 
-            if len(subsequence) == 0:
-                break
+def restore_batched(output_files, texts, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict_function, minibatch_size, eos_tokens=data.EOS_TOKENS, max_subsequence_len=MAX_SUBSEQUENCE_LEN,
+                    overlap=None, mask_numbers=False):
+    """
+    Punctuates many texts at once. The next window of a text starts after the last EOS predicted in its previous window,
+    so the windows of one text have to be processed in order, but windows of different texts share a padded and masked minibatch.
+    pauses is None for models without pause input, and mask_numbers is as in punctuate().
+    """
+    f_outs = [codecs.open(output_file, 'w', 'utf-8') for output_file in output_files]
+    positions = [0 for _ in texts]
+    unfinished = [k for k in range(len(texts)) if len(texts[k]) > 0]
 
-            converted_subsequence = [word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in subsequence]
+    while unfinished:
 
-            y = predict_function(to_array(converted_subsequence))
+        finished = set()
 
-            f_out.write(subsequence[0])
+        for b_start in range(0, len(unfinished), minibatch_size):
 
-            last_eos_idx = 0
-            punctuations = []
-            for y_t in y:
+            batch = unfinished[b_start:b_start+minibatch_size]
+            subsequences = [texts[k][positions[k]:positions[k]+max_subsequence_len] for k in batch]
 
-                p_i = np.argmax(y_t.flatten())
-                punctuation = reverse_punctuation_vocabulary[p_i]
+            with profiling.phase("vocabulary mapping"):
+                converted_subsequences = [[word_vocabulary.get(w, word_vocabulary[data.UNK]) for w in (replace_numbers(subsequence) if mask_numbers else subsequence)]
+                                          for subsequence in subsequences]
+                X, mask = to_padded_array(converted_subsequences, minibatch_size)
 
-                punctuations.append(punctuation)
+            if pauses is None:
+                y = predict_function(X, mask)
+            else:
+                subsequence_pauses = [pauses[k][positions[k]:positions[k]+max_subsequence_len] or [0.0] for k in batch]
+                P, _ = to_padded_array(subsequence_pauses, minibatch_size, dtype=np.float64)
+                y = predict_function(X, P, mask)
 
-                if punctuation in data.EOS_TOKENS:
-                    last_eos_idx = len(punctuations) # we intentionally want the index of next element
+            y, y_paragraph = split_outputs(y)
 
-            if subsequence[-1] == data.END:
-                step = len(subsequence) - 1
-            elif last_eos_idx != 0:
-                step = last_eos_idx
-            else:
-                step = len(subsequence) - 1
+            for b, k in enumerate(batch):
 
-            for j in range(step):
-                f_out.write(" " + punctuations[j] + " " if punctuations[j] != data.SPACE else " ")
-                if j < step - 1:
-                    f_out.write(subsequence[1+j])
+                subsequence = subsequences[b]
 
-            if subsequence[-1] == data.END:
-                break
+                with profiling.phase("output decoding"):
+                    punctuations = get_punctuations(y[:len(subsequence)-1, b], reverse_punctuation_vocabulary)
+                    paragraph_breaks = get_paragraph_breaks(y_paragraph[:len(subsequence)-1, b]) if y_paragraph is not None else None
+                    step = get_step(subsequence, punctuations, eos_tokens, overlap)
+                with profiling.phase("output writing"):
+                    write_subsequence(f_outs[k], subsequence, punctuations, step, paragraph_breaks)
+
+                if subsequence[-1] == data.END:
+                    finished.add(k)
+
+                positions[k] += step
+
+        unfinished = [k for k in unfinished if k not in finished]
 
-            i += step
+    for f_out in f_outs:
+        f_out.close()
 
 if __name__ == "__main__":
 
@@ -128,31 +339,9 @@ if __name__ == "__main__":
 
     use_pauses = len(sys.argv) > 3 and bool(int(sys.argv[3]))
 
-    x = T.imatrix('x')
-    
-    if use_pauses:
-    
-        p = T.matrix('p')
+    profiling.start(output_file)
 
-        print "Loading model parameters..."
-        net, _ = models.load(model_file, 1, x, p)
-
-        print "Building model..."
-        predict = theano.function(
-            inputs=[x, p],
-            outputs=net.y
-        )
-
-    else:
-
-        print "Loading model parameters..."
-        net, _ = models.load(model_file, 1, x)
-
-        print "Building model..."
-        predict = theano.function(
-            inputs=[x],
-            outputs=net.y
-        )
+    net, predict = load_model(model_file, use_pauses)
 
     word_vocabulary = net.x_vocabulary
     punctuation_vocabulary = net.y_vocabulary
@@ -160,17 +349,18 @@ if __name__ == "__main__":
     reverse_word_vocabulary = {v:k for k,v in word_vocabulary.items()}
     reverse_punctuation_vocabulary = {v:k for k,v in punctuation_vocabulary.items()}
 
-    input_text = codecs.getreader('utf-8')(sys.stdin).read()
+    with profiling.phase("input reading"):
+        input_text = codecs.getreader('utf-8')(sys.stdin).read()
 
     if len(input_text) == 0:
         sys.exit("Input text from stdin missing.")
 
-    text = [w for w in input_text.split() if w not in punctuation_vocabulary and w not in data.PUNCTUATION_MAPPING and not w.startswith(data.PAUSE_PREFIX)] + [data.END]
-    pauses = [float(s.replace(data.PAUSE_PREFIX,"").replace(">","")) for s in input_text.split() if s.startswith(data.PAUSE_PREFIX)]
+    with profiling.phase("input splitting"):
+        text, pauses = split_input(input_text, punctuation_vocabulary)
 
     if not use_pauses:
-        restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict)
+        restore(output_file, text, word_vocabulary, reverse_punctuation_vocabulary, predict, get_max_subsequence_len(net), get_overlap(net), mask_numbers=True)
     else:
         if not pauses:
             pauses = [0.0 for _ in range(len(text)-1)]
-        restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict)
+        restore_with_pauses(output_file, text, pauses, word_vocabulary, reverse_punctuation_vocabulary, predict, get_max_subsequence_len(net), get_overlap(net), mask_numbers=True)
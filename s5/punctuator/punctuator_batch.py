@@ -0,0 +1,66 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import codecs
+
+from time import time
+from punctuator import load_model, split_input, restore_batched, get_max_subsequence_len, get_overlap
+
+MINIBATCH_SIZE = 32
+
+"""
+Punctuates many texts with one model instance. Windows from different texts are packed into a padded and masked minibatch.
+The input list has one "<input-file> <output-file>" pair per line. The input files are in the same format as the stdin of punctuator.py.
+"""
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        input_list = sys.argv[2]
+    else:
+        sys.exit("Input list argument missing")
+
+    minibatch_size = int(sys.argv[3]) if len(sys.argv) > 3 else MINIBATCH_SIZE
+
+    use_pauses = len(sys.argv) > 4 and bool(int(sys.argv[4]))
+
+    with open(input_list, 'r') as f:
+        io_files = [l.split() for l in f if l.strip()]
+
+    if len(io_files) == 0:
+        sys.exit("Input list is empty.")
+
+    minibatch_size = min(minibatch_size, len(io_files))
+
+    net, predict = load_model(model_file, use_pauses, minibatch_size, masked=True)
+
+    word_vocabulary = net.x_vocabulary
+    punctuation_vocabulary = net.y_vocabulary
+
+    reverse_punctuation_vocabulary = {v:k for k,v in punctuation_vocabulary.items()}
+
+    texts = []
+    pauses = []
+    for input_file, _ in io_files:
+
+        with codecs.open(input_file, 'r', 'utf-8') as f:
+            input_text = f.read()
+
+        text, text_pauses = split_input(input_text, punctuation_vocabulary)
+
+        texts.append(text)
+        pauses.append(text_pauses or [0.0 for _ in range(len(text)-1)])
+
+    t0 = time()
+    restore_batched([o for _, o in io_files], texts, pauses if use_pauses else None, word_vocabulary, reverse_punctuation_vocabulary, predict, minibatch_size,
+                    max_subsequence_len=get_max_subsequence_len(net), overlap=get_overlap(net), mask_numbers=True)
+    elapsed = max(time() - t0, 1e-100)
+
+    num_words = sum(len(text) - 1 for text in texts)
+    print "Punctuated %d texts, %d words in %.2f sec (%.2f words/sec)" % (len(texts), num_words, elapsed, num_words / elapsed)
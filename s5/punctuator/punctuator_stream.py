@@ -0,0 +1,42 @@
+# coding: utf-8
+from __future__ import division
+
+import sys
+import codecs
+
+from punctuator import load_model, StreamingPunctuator, get_max_subsequence_len, get_overlap
+
+"""
+Punctuates text from stdin as it arrives, e.g. partial ASR output of an ongoing speech, one or more words per line.
+Text is written to the output file, and flushed, up to the last predicted EOS each time a full window of words has arrived.
+The rest is written when stdin is closed. The final output is the same as from punctuator.py.
+
+e.g. tail -f partial_transcript.txt | python punctuator/punctuator_stream.py <model-file> /dev/stdout
+"""
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        output_file = sys.argv[2]
+    else:
+        sys.exit("Output file path argument missing")
+
+    use_pauses = len(sys.argv) > 3 and bool(int(sys.argv[3]))
+
+    net, predict = load_model(model_file, use_pauses)
+
+    with codecs.open(output_file, 'w', 'utf-8') as f_out:
+
+        punctuator = StreamingPunctuator(f_out, net.x_vocabulary, net.y_vocabulary, predict, use_pauses, max_subsequence_len=get_max_subsequence_len(net), overlap=get_overlap(net),
+                                         mask_numbers=True)
+
+        # readline instead of iterating over stdin, which reads ahead and would wait for a full buffer
+        for line in iter(sys.stdin.readline, ''):
+            punctuator.add(line.decode('utf-8').split())
+
+        punctuator.close()
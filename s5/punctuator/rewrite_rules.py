@@ -0,0 +1,173 @@
+# coding: utf-8
+from __future__ import division
+
+import re
+
+from bisect import bisect_right
+from collections import defaultdict
+
+"""
+The regular expressions that denormalize.py applies to the punctuated text (they were a sed -re chain in
+local/recognize/denormalize.sh), compiled once and applied in the order of RULE_GROUPS.
+Each group lists patterns that a text must contain for any rule of the group to match. A group is skipped when one of
+them isn't found, so most of the rules cost a fast search instead of a substitution pass over the whole speech.
+
+The repetition rule (\b.+),? \1\b -> \1 is applied by remove_repetitions, which gives the same result as the regular
+expression in time linear in the length of the text, for repetitions of up to MAX_REPETITION_WORDS words.
+compare_rewrite_rules.py checks the rules against the sed chain.
+"""
+
+MAX_REPETITION_WORDS = 100 # longest repeated word sequence that remove_repetitions looks for
+
+UPPER = u"A-ZÁÐÉÍÓÚÝÞÆÖ"
+LOWER = u"a-záðéíóúýþæö"
+
+WORD_BOUNDARY = re.compile(r"\b", re.UNICODE)
+REPETITION = re.compile(r"(\b.+),? \1\b", re.UNICODE)
+
+def is_word_character(c):
+    return c.isalnum() or c == u"_" # as \w
+
+def is_boundary(line, i):
+    # as \b at position i
+    return (i > 0 and is_word_character(line[i-1])) != (i < len(line) and is_word_character(line[i]))
+
+def find_repetition(line, tokens, starts, occurrences, a, o, max_words):
+    """
+    Returns the end of the longest (\b.+),? \1 match that starts at offset o of token a of the line, and the end of its group,
+    or None. Without double spaces, a repetition of the piece u = tokens[a][o:] and the tokens after it up to token b starts
+    at token b+1, which has to be u, followed by the same tokens up to the last one, which only needs to start with
+    tokens[b] (or tokens[b] without a comma that the match leaves out). So the candidates are the next occurrences of u.
+    """
+    u = tokens[a][o:]
+    i = starts[a] + o
+
+    # the groups that end with token b (or its comma), from the longest, and last the group within token a
+    # (only the occurrences within max_words tokens, so that the time per boundary doesn't grow with the frequency of u)
+    positions = occurrences[u]
+    window = positions[bisect_right(positions, a + 1):bisect_right(positions, a + max_words)]
+    candidates = [q - 1 for q in reversed(window)] + [a]
+
+    for b in candidates:
+        c = 2 * b - a + 1 # the token where the repetition of tokens[b] is
+        if c >= len(tokens) or tokens[a+1:b] != tokens[b+2:c]:
+            continue
+        last = tokens[b] if b > a else u
+        for piece in [last, last[:-1] if last.endswith(u",") else None]:
+            if piece is None or (b == a and len(piece) == 0):
+                continue
+            end = starts[c] + len(piece)
+            if tokens[c].startswith(piece) and is_boundary(line, end):
+                return end, starts[b] + len(piece) if b > a else i + len(piece)
+
+    return None
+
+def remove_repetitions(text, max_words=MAX_REPETITION_WORDS):
+    """
+    Same as re.sub(r"(\b.+),? \1\b", r"\1", text) with re.UNICODE, in linear time: the repetitions are found with an index
+    of the positions of each token in the line instead of trying every length of the group at every word boundary.
+    Lines with double spaces, which the text has none of after denormalize.py has squeezed the spaces, use the regular expression.
+    """
+    output_lines = []
+
+    for line in text.split(u"\n"):
+
+        if u"  " in line:
+            output_lines.append(REPETITION.sub(r"\1", line))
+            continue
+
+        tokens = line.split(u" ")
+        starts = []
+        occurrences = defaultdict(list)
+        position = 0
+        for k, token in enumerate(tokens):
+            starts.append(position)
+            occurrences[token].append(k)
+            position += len(token) + 1
+
+        output = []
+        last_end = 0
+        for boundary in WORD_BOUNDARY.finditer(line):
+            i = boundary.start()
+            if i < last_end:
+                continue
+            a = bisect_right(starts, i) - 1
+            o = i - starts[a]
+            if o >= len(tokens[a]): # a group can't start with a space without double spaces
+                continue
+            repetition = find_repetition(line, tokens, starts, occurrences, a, o, max_words)
+            if repetition is not None:
+                end, group_end = repetition
+                output.append(line[last_end:group_end])
+                last_end = end
+
+        output.append(line[last_end:])
+        output_lines.append(u"".join(output))
+
+    return u"\n".join(output_lines)
+
+# The rules in the order they are applied, as (patterns that the text must contain, [(pattern, replacement), ...]).
+# A rule that is a function instead of a pattern is applied to the whole text.
+RULE_GROUPS = [
+    # Abbreviate "háttvirtur", "hæstvirtur" and "þingmaður" in some cases
+    ([u"æstvirt"], [
+        (ur"([Hh]æstv)irt[^ ]*\b", ur"\1."),
+    ]),
+    ([u"áttv", u"þingm"], [
+        (ur"([Hh])áttv[^ ]+ (þingm[^ ]+)", ur"\1v. \2"),
+    ]),
+    ([u"þingm"], [
+        (ur"([Hh]v\. ([0-9]+\. )?)þingm[^ .?:eö]+ ([%s])" % UPPER, ur"\1þm. \3"),
+        (ur"([0-9]+\.) þingm[^ .?:eö]+ ([%s])" % UPPER, ur"\1 þm. \2"),
+    ]),
+    # Fix year intervals, e.g. 2014–17 -> 2014–2017 and 1994–6 -> 1994-1996
+    ([u"–"], [
+        (ur" ([0-9]{3})([0-9])–([0-9])\b", ur" \1\2–\1\3"),
+        (ur" ([0-9]{2})([0-9]{2})–([0-9]{2})\b", ur" \1\2–\1\3"),
+    ]),
+    # Remove repititions except when they are reps of: að, í, á, til, það, er, við
+    ([], [
+        (ur"\b(að|í|á|til|það|er|við) \1\b", ur"\1 \1 \1"),
+        (remove_repetitions, None), # (\b.+),? \1\b -> \1
+    ]),
+    # Insert periods into thousands and millions
+    ([ur"[0-9]{4}"], [
+        (ur"([0-9]{2,})([0-9]{3})\b", ur"\1.\2"),
+        (ur"([0-9]+)([0-9]{3}\.[0-9]{3})\b", ur"\1.\2"),
+        (ur"([3-9])([0-9]{3})\b", ur"\1.\2"),
+    ]),
+    # NOTE! Just a test! The editors want to test never having comma after "hv. þm. <name>"
+    ([ur"v\. þm\. "], [
+        (ur"([Hh]v\. þm\. [%(U)s][%(L)s]+ ([%(U)s][%(L)s]*\.? )?[%(U)s][%(L)s]+)," % {"U": UPPER, "L": LOWER}, ur"\1"),
+    ]),
+    # Rewrite "nefnd háttvirtri" to "hv. nefnd"
+    ([u" háttvirtri"], [
+        (ur"(([%(L)s]+- og )?[%(L)s]+nefnd),? háttvirtri" % {"L": LOWER}, ur"hv. \1"),
+    ]),
+    # Rewrite <unk> so not to interfere with XML tags
+    ([u"unk"], [
+        (ur"<[^>]*unk[^>]*>", ur"[unknown]"),
+    ]),
+    # Remove comma if appears before a period
+    ([ur",\."], [
+        (ur",\.", ur"."),
+    ]),
+]
+
+class RewriteRules(object):
+    """The rule groups compiled once. Calling it with a text returns the rewritten text."""
+
+    def __init__(self, rule_groups=RULE_GROUPS):
+        self.groups = []
+        for requirements, rules in rule_groups:
+            self.groups.append((
+                [re.compile(requirement, re.UNICODE) for requirement in requirements],
+                [(rule, None) if callable(rule) else (re.compile(rule, re.UNICODE), replacement) for rule, replacement in rules]
+            ))
+
+    def __call__(self, text):
+        for requirements, rules in self.groups:
+            if all(requirement.search(text) for requirement in requirements):
+                for rule, replacement in rules:
+                    text = rule(text) if replacement is None else rule.sub(replacement, text)
+        return text
@@ -0,0 +1,128 @@
+# coding: utf-8
+from __future__ import division
+
+import data
+
+import sys
+import os
+import codecs
+import signal
+import traceback
+import SocketServer
+
+from StringIO import StringIO
+from time import time
+from punctuator import load_model, split_input, punctuate, get_max_subsequence_len, get_overlap
+from fst_normalizer import load_bundle_fsts, split_lines
+
+EOP_TOKENS = {"EOP"} # as in paragraph/data.py
+
+"""
+Long running punctuation and paragraph service. Loads (and with the Theano engine compiles) the models once and serves
+requests over a Unix socket, see client.py. The engine is chosen with INFERENCE_ENGINE as in punctuator.py.
+
+A request is a command line, "punctuate" or "paragraph", followed by the input text in the same format as the stdin of
+punctuator.py and paragraph/paragrapher.py. The client then shuts down its sending side of the connection.
+The response is a status line, "OK" or "ERROR <message>", followed by the output text.
+
+With a model bundle as the last argument, the server also loads its FSTs (see fst_normalizer.py) and rewrites the lines of
+the input text with the commands "abbreviate" (ABBR_AND_DENORM.fst) and "insert_periods" (INSERT_PERIODS.fst).
+The command "commands" lists the commands of the server.
+
+e.g. python punctuator/server.py /tmp/punctuator.sock $bundle/punctuation_model $bundle/paragraph_model $bundle
+or with a joint model, python punctuator/server.py /tmp/punctuator.sock $bundle/punctuation_model - $bundle
+"""
+
+class Restorer(object):
+    """A loaded model, the tokens that end the windows of restore() and whether the numbers are masked (see punctuate)"""
+
+    def __init__(self, model_file, eos_tokens, punctuation_mapping, mask_numbers=False):
+        self.net, self.predict = load_model(model_file, False)
+        self.eos_tokens = eos_tokens
+        self.punctuation_mapping = punctuation_mapping
+        self.mask_numbers = mask_numbers
+        self.word_vocabulary = self.net.x_vocabulary
+        self.reverse_punctuation_vocabulary = {v:k for k,v in self.net.y_vocabulary.items()}
+
+    def __call__(self, input_text):
+        text, _ = split_input(input_text, self.net.y_vocabulary, self.punctuation_mapping)
+        f_out = StringIO()
+        punctuate(f_out, text, None, self.word_vocabulary, self.reverse_punctuation_vocabulary, self.predict, self.eos_tokens, get_max_subsequence_len(self.net), get_overlap(self.net),
+                  self.mask_numbers)
+        return f_out.getvalue()
+
+class FstCommand(object):
+    """Rewrites the lines of an input text with an FST"""
+
+    def __init__(self, fst):
+        self.fst = fst
+
+    def __call__(self, input_text):
+        return u"".join(line + u"\n" for line in self.fst(split_lines(input_text)))
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        command = self.rfile.readline().strip()
+        input_text = self.rfile.read().decode('utf-8')
+
+        t0 = time()
+        try:
+            if command == "commands":
+                output_text = u"".join(c + u"\n" for c in sorted(self.server.restorers))
+            elif command not in self.server.restorers:
+                raise ValueError("Unknown command '%s'" % command)
+            else:
+                output_text = self.server.restorers[command](input_text)
+        except Exception as e:
+            traceback.print_exc()
+            self.wfile.write("ERROR %s\n" % str(e).replace("\n", " "))
+            return
+
+        self.wfile.write("OK\n")
+        self.wfile.write(output_text.encode('utf-8'))
+
+        print "%s: %d words in %.2f sec" % (command, len(input_text.split()), time() - t0)
+        sys.stdout.flush()
+
+class Server(SocketServer.UnixStreamServer):
+
+    def __init__(self, socket_path, restorers):
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # left behind by a server that was killed
+        SocketServer.UnixStreamServer.__init__(self, socket_path, RequestHandler)
+        self.restorers = restorers
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        socket_path = sys.argv[1]
+    else:
+        sys.exit("Socket path argument missing")
+
+    if len(sys.argv) > 2:
+        punctuation_model_file = sys.argv[2]
+    else:
+        sys.exit("Punctuation model file path argument missing")
+
+    paragraph_model_file = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != "-" else None
+    bundle = sys.argv[4] if len(sys.argv) > 4 else None
+
+    restorers = {"punctuate": Restorer(punctuation_model_file, data.EOS_TOKENS, data.PUNCTUATION_MAPPING, mask_numbers=True)}
+    if paragraph_model_file:
+        restorers["paragraph"] = Restorer(paragraph_model_file, EOP_TOKENS, {})
+    if bundle:
+        for name, fst in load_bundle_fsts(bundle).items():
+            restorers[name] = FstCommand(fst)
+
+    server = Server(socket_path, restorers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print "Listening on %s" % socket_path
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
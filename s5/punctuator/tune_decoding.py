@@ -0,0 +1,128 @@
+# coding: utf-8
+from __future__ import division
+
+import export_model
+import data
+
+import sys
+import os
+import codecs
+import shutil
+import tempfile
+
+from time import time
+from error_calculator import compute_error
+from punctuator import load_model, split_input, restore, restore_with_pauses
+
+"""
+Chooses the window settings of punctuator.py for a model on a punctuation annotated dev set.
+punctuate() runs the model over windows of max_subsequence_len words and writes each window up to its last predicted EOS,
+or, with an overlap, up to its last overlap words, so the rest of the window is run again in the next one. This script
+punctuates the dev set with each window length in WINDOW_LENS and each overlap in OVERLAPS (None writes up to the last EOS),
+and reports the compute cost (model calls and the words run through the model), the time and the F-scores of
+error_calculator.compute_error. The fastest setting whose overall F-score is within F_SCORE_TOLERANCE of the best one is
+chosen (by time, because with full attention the cost of a word grows with the window length). It is saved in the model if
+it is an exported model directory (see export_model.py), from where punctuator.py, punctuator_batch.py, punctuator_stream.py
+and server.py use it.
+
+e.g. python punctuator/tune_decoding.py $bundle/punctuation_model althingi.dev.txt [1]
+"""
+
+WINDOW_LENS = [50, 100, 200, 400, 1000]
+OVERLAPS = [None, 10, 25, 50]
+F_SCORE_TOLERANCE = 0.005 # of the overall F-score
+
+class CountingPredict(object):
+    """Counts the calls of a prediction function and the words run through it"""
+
+    def __init__(self, predict_function):
+        self.predict_function = predict_function
+        self.calls = 0
+        self.words = 0
+
+    def __call__(self, x, *args):
+        self.calls += 1
+        self.words += x.shape[0]
+        return self.predict_function(x, *args)
+
+def choose(results, f_score_tolerance=F_SCORE_TOLERANCE):
+    """Returns the (max_subsequence_len, overlap) of the fastest result within f_score_tolerance of the best F-score"""
+    best_f_score = max(r["f_score"] for r in results)
+    good_enough = [r for r in results if r["f_score"] >= best_f_score - f_score_tolerance]
+    chosen = min(good_enough, key=lambda r: r["time"])
+    return chosen["max_subsequence_len"], chosen["overlap"]
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        model_file = sys.argv[1]
+    else:
+        sys.exit("Model file path argument missing")
+
+    if len(sys.argv) > 2:
+        dev_file = sys.argv[2]
+    else:
+        sys.exit("Dev file path argument missing")
+
+    use_pauses = len(sys.argv) > 3 and bool(int(sys.argv[3]))
+
+    with codecs.open(dev_file, 'r', 'utf-8') as f:
+        input_text = f.read()
+
+    net, predict = load_model(model_file, use_pauses)
+
+    reverse_punctuation_vocabulary = {v:k for k,v in net.y_vocabulary.items()}
+
+    text, pauses = split_input(input_text, net.y_vocabulary)
+    if use_pauses and not pauses:
+        pauses = [0.0 for _ in range(len(text)-1)]
+
+    temp_dir = tempfile.mkdtemp()
+    results = []
+
+    try:
+        # the predictions have no pause annotations, so they are left out of the target too
+        target_file = os.path.join(temp_dir, "target.txt")
+        with codecs.open(target_file, 'w', 'utf-8') as f:
+            f.write(" ".join(w for w in input_text.split() if not w.startswith(data.PAUSE_PREFIX)))
+
+        for max_subsequence_len in WINDOW_LENS:
+            for overlap in OVERLAPS:
+
+                if overlap is not None and overlap * 2 > max_subsequence_len:
+                    continue
+
+                counting_predict = CountingPredict(predict)
+                output_file = os.path.join(temp_dir, "output.txt")
+
+                t0 = time()
+                if use_pauses:
+                    restore_with_pauses(output_file, text, pauses, net.x_vocabulary, reverse_punctuation_vocabulary, counting_predict, max_subsequence_len, overlap)
+                else:
+                    restore(output_file, text, net.x_vocabulary, reverse_punctuation_vocabulary, counting_predict, max_subsequence_len, overlap)
+                elapsed = time() - t0
+
+                print "Window %d, overlap %s:" % (max_subsequence_len, overlap)
+                f_scores = compute_error([target_file], [output_file])
+
+                results.append({"max_subsequence_len": max_subsequence_len, "overlap": overlap, "calls": counting_predict.calls,
+                                "words": counting_predict.words, "time": elapsed, "f_score": f_scores["Overall"]})
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print ""
+    print "{:<8} {:>8} {:>7} {:>10} {:>12} {:>9} {:>9}".format("WINDOW", "OVERLAP", "CALLS", "WORDS RUN", "WORDS/WORD", "TIME (s)", "F-SCORE")
+    for r in results:
+        print "{:<8} {:>8} {:>7} {:>10} {:>12.2f} {:>9.2f} {:>9.1f}".format(r["max_subsequence_len"], "EOS" if r["overlap"] is None else r["overlap"],
+            r["calls"], r["words"], r["words"] / (len(text) - 1), r["time"], r["f_score"] * 100)
+
+    max_subsequence_len, overlap = choose(results)
+    print ""
+    print "Chosen: window %d, %s" % (max_subsequence_len, "written up to the last EOS" if overlap is None else "overlap %d" % overlap)
+
+    if os.path.isdir(model_file):
+        export_model.write_decoding(model_file, {"max_subsequence_len": max_subsequence_len, "overlap": overlap})
+        print "Saved in %s" % model_file
+    else:
+        print "Not saved: only exported models (see export_model.py) store the window settings"
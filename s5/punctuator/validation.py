@@ -0,0 +1,106 @@
+# coding: utf-8
+from __future__ import division
+
+import models
+import export_model
+import data
+import main
+
+import theano
+import sys
+import os
+import threading
+import subprocess
+import Queue
+
+import theano.tensor as T
+
+"""
+Validation of the models that main.py saves after each epoch in a separate process (see ASYNC_VALIDATION in main.py),
+so that the training continues while the dev set is run. Run as a script, this reads the paths of the saved models from
+stdin and writes the validation perplexity of each to stdout. The model is built and compiled for the first one, and
+only its parameters are replaced for the next ones.
+"""
+
+RESULT_PREFIX = "VALIDATION_PPL"
+
+class ValidationProcess(object):
+    """
+    Runs this script in a subprocess, which validates the models given to submit in the order they are given.
+    theano_flags are added to THEANO_FLAGS of the subprocess, e.g. "device=cpu" to leave the GPU to the training.
+    The other output of the subprocess is written to stdout with a prefix.
+    """
+
+    def __init__(self, theano_flags=None):
+        env = dict(os.environ)
+        if theano_flags:
+            env["THEANO_FLAGS"] = ",".join(flags for flags in [env.get("THEANO_FLAGS"), theano_flags] if flags)
+
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.results = Queue.Queue()
+        self.pending = 0
+
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self):
+        for line in iter(self.process.stdout.readline, ""):
+            if line.startswith(RESULT_PREFIX):
+                _, ppl, model_file = line.rstrip("\n").split(" ", 2)
+                self.results.put((model_file, float(ppl)))
+            else:
+                sys.stdout.write("[validation] " + line)
+                sys.stdout.flush()
+        self.results.put(None) # the process has exited
+
+    def submit(self, model_file):
+        self.process.stdin.write(model_file + "\n")
+        self.process.stdin.flush()
+        self.pending += 1
+
+    def get_results(self, wait=False):
+        """Returns the (model_file, perplexity) results that have arrived, or with wait, the results of all the submitted models"""
+        results = []
+        while self.pending > 0:
+            try:
+                result = self.results.get(block=wait)
+            except Queue.Empty:
+                break
+            if result is None:
+                raise RuntimeError("The validation process exited with code %s" % self.process.wait())
+            self.pending -= 1
+            results.append(result)
+        return results
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+if __name__ == "__main__":
+
+    x = T.imatrix('x')
+    y = T.imatrix('y')
+    z = T.imatrix('z')
+
+    net = None
+
+    for line in iter(sys.stdin.readline, ""):
+        model_file = line.rstrip("\n")
+
+        if net is None:
+            net, _ = models.load(model_file, main.MINIBATCH_SIZE, x)
+            joint = isinstance(net, models.GRUjoint)
+            targets = [y, z] if joint else [y]
+            validate_model = theano.function(
+                inputs=[x] + targets,
+                outputs=net.cost(*targets)
+            )
+        else:
+            for net_param, state_param in zip(net.params, export_model.load_state(model_file)["params"]):
+                net_param.set_value(state_param, borrow=True)
+
+        ppl = main.compute_perplexity(validate_model, data.DEV_FILE, with_paragraphs=joint)
+
+        sys.stdout.write("%s %r %s\n" % (RESULT_PREFIX, ppl, model_file))
+        sys.stdout.flush()